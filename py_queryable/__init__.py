@@ -2,3 +2,4 @@ from .providers import *
 from .managers import ConnectionManager
 from .entity.model import Model
 from .entity.column_types import *
+from .entity.index import Index
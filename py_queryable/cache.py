@@ -0,0 +1,73 @@
+import threading
+from collections import OrderedDict
+
+
+class LruCache(object):
+    """
+    Thread safe, bounded least recently used cache with hit and miss counters
+    """
+
+    def __init__(self, maxsize=512):
+        """
+        Default constructor
+        :param maxsize: maximum number of entries held before the least recently used entry is evicted
+        :return: void
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, factory):
+        """
+        Gets the value cached for key, calling factory to create (and cache) it on a miss
+        :param key: key of the entry. Unhashable keys are counted as misses and never cached
+        :param factory: callable taking no arguments that creates the value to cache
+        :return: cached value
+        """
+        with self._lock:
+            try:
+                value = self._entries.pop(key)
+            except (KeyError, TypeError) as ex:
+                self.misses += 1
+                cacheable = isinstance(ex, KeyError)
+            else:
+                self.hits += 1
+                self._entries[key] = value
+                return value
+        value = factory()
+        if not cacheable:
+            return value
+        with self._lock:
+            self._entries[key] = value
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        """
+        Removes all entries and resets the hit and miss counters
+        :return: void
+        """
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        """
+        :return: dictionary of hits, misses, maxsize and current size of the cache
+        """
+        return {
+            u"hits": self.hits,
+            u"misses": self.misses,
+            u"maxsize": self.maxsize,
+            u"size": len(self._entries)
+        }
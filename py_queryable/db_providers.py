@@ -1,12 +1,18 @@
 __author__ = 'Bruce Fenske'
 
 import abc
+import json
 import sqlite3
+from contextlib import contextmanager
 from decimal import Decimal
 from .parsers import SqliteUriParser
 from .entity.proxy import DynamicModelProxy
+from .entity.record import ModelRecord
 from .exceptions import InvalidArgumentError, NullArgumentError
 from .providers.SqliteQueryProvider import SqliteQueryProvider
+from .query.CompiledQuery import CompiledQuery
+from .query.QueryPlan import QueryPlan
+from .visitors.sql import CollectionParameter
 
 
 class DbConnectionBase(object):
@@ -25,6 +31,23 @@ class DbConnectionBase(object):
         :return: void
         """
         self.connection_uri = connection_uri
+        # set use_records to create the entities of query results as ModelRecord instances, which have a slot per
+        # column instead of an instance dictionary and a ColumnProxy per column
+        self.use_records = False
+        # rows read from the database hold values of the column types of the model the table was created from, so
+        # they are not validated unless trusted_hydration is cleared. Assignments to entities are always validated.
+        self.trusted_hydration = True
+
+    def row_factory(self, model, loaders=None):
+        """
+        Gets the function creating the entities of query results from rows
+        :param model: a py_linq.queryable.entity.model.Model child class
+        :param loaders: dictionary of ForeignKey attribute name to the loader of the referenced entities
+        :return: function of a row in the order of model.inspect_columns() returning an entity
+        """
+        if self.use_records:
+            return ModelRecord.row_factory(model, loaders)
+        return DynamicModelProxy.row_factory(model, loaders, validate=not self.trusted_hydration)
 
     def _generate_columns_and_values(self, model):
         """
@@ -108,7 +131,8 @@ class DbConnectionBase(object):
     @abc.abstractmethod
     def create_indexes(self, model):
         """
-        Executes command to create indexes on all unique columns in a data model
+        Executes command to create indexes on all unique columns in a data model and the indexes declared in its
+        __indexes__ list
         :param model: A child of py_linq.queryable.entity.model.Model
         :return: void
         """
@@ -123,6 +147,15 @@ class DbConnectionBase(object):
         """
         return NotImplementedError()
 
+    def compile(self, expression, func):
+        """
+        Compiles a query so that it is translated into SQL once and executed with different arguments
+        :param expression: an expression model the query starts from
+        :param func: function taking a Queryable followed by the query arguments that returns a Queryable
+        :return: CompiledQuery instance. Call it with the query arguments to execute it.
+        """
+        return CompiledQuery(self.query(expression), func)
+
     @abc.abstractmethod
     def update(self, model):
         """
@@ -158,6 +191,9 @@ class SqliteDbConnection(DbConnectionBase):
         super(SqliteDbConnection, self).__init__(connection_uri)
         self._provider_config = SqliteUriParser(connection_uri).parse_uri()
         self._query_provider = SqliteQueryProvider(self)
+        # set record_plans to collect the QueryPlan of every query executed through open_cursor in plans
+        self.record_plans = False
+        self.plans = []
 
     @property
     def driver(self):
@@ -195,7 +231,12 @@ class SqliteDbConnection(DbConnectionBase):
         if len(primary_keys) != 1:
             raise InvalidArgumentError(u"{0} appears to have incorrect number of primary key declared: {1}".format(model.table_name(), len(primary_keys)))
         sql = u"CREATE TABLE {table_name} ({columns})"
-        columns_sql = u", ".join([self._generate_col_sql(col[0], col[1]) for col in columns])
+        columns_sql = [self._generate_col_sql(col[0], col[1]) for col in columns]
+        # table constraints have to follow every column definition
+        columns_sql.extend(
+            [self._generate_foreign_key_sql(col[0], col[1]) for col in columns if col[1].foreign_key is not None]
+        )
+        columns_sql = u", ".join(columns_sql)
         sql = sql.format(
             table_name=model.table_name(),
             columns=columns_sql
@@ -217,19 +258,40 @@ class SqliteDbConnection(DbConnectionBase):
             sql = u"{0} PRIMARY KEY".format(sql)
         if column.is_unique and not column.is_primary_key:
             sql = u"{0} UNIQUE".format(sql)
-        if column.foreign_key is not None:
-            sql = u"{0}, FOREIGN KEY({1}) REFERENCES {2}({3})".format(sql, column_name, column.foreign_key.table_name(), column.foreign_column.column_name)
         return sql
 
+    def _generate_foreign_key_sql(self, column_name, column):
+        """
+        :return: SQL foreign key constraint for column as text
+        """
+        return u"FOREIGN KEY({0}) REFERENCES {1}({2})".format(
+            column_name,
+            column.foreign_key.table_name(),
+            column.foreign_column.column_name
+        )
+
     def create_indexes(self, model):
         try:
             unique_columns = filter(lambda c: c[1].is_unique, model.inspect_columns())
         except BaseException:
             raise InvalidArgumentError(u"Does not appear to be a proper data model that inherits from Model")
+        indexes = getattr(model, u"__indexes__", [])
+        names = [index.index_name(model) for index in indexes]
+        duplicates = sorted(set(n for n in names if names.count(n) > 1))
+        if len(duplicates) > 0:
+            # CREATE INDEX IF NOT EXISTS would skip every index but the first of a name without an error
+            raise InvalidArgumentError(u"{0} declares more than one index named {1}".format(
+                model.__name__, u", ".join(duplicates)))
         for column_name, column in unique_columns:
             index_name = u"{0}_index".format(column_name)
             sql = u"CREATE INDEX {0} ON {1}({2});".format(index_name, model.table_name(), column_name)
             self.connection.execute(sql)
+        for index in indexes:
+            self.connection.execute(index.sql(model))
+
+    @property
+    def query_provider(self):
+        return self._query_provider
 
     def query(self, expression):
         return self._query_provider.createQuery(expression)
@@ -286,10 +348,49 @@ class SqliteDbConnection(DbConnectionBase):
         )
         self.connection.execute(sql)
 
-    def execute_scalar(self, sql):
+    @staticmethod
+    def _bind(parameters):
+        """
+        Replaces CollectionParameter instances with the JSON array of their values, which the statement reads with
+        json_each. Binding a collection writes nothing, so a query does not open a transaction.
+        :param parameters: parameter values for the ? placeholders of a statement
+        :return: list of parameter values to execute the statement with
+        """
+        return [json.dumps(p.values) if isinstance(p, CollectionParameter) else p for p in parameters]
+
+    @contextmanager
+    def open_cursor(self, sql, parameters=()):
+        """
+        Executes a query. The plan of the query is appended to plans when record_plans is set.
+        :param sql: sql statement
+        :param parameters: parameter values for the ? placeholders in the sql, may include CollectionParameter
+        instances
+        :return: context manager of the cursor executing the statement
+        """
+        values = self._bind(parameters)
+        if self.record_plans:
+            self.plans.append(self._explain(sql, values))
         cursor = self.connection.cursor()
-        cursor.execute(sql)
-        result = cursor.fetchone()
+        cursor.execute(sql, values)
+        yield cursor
+
+    def explain(self, sql, parameters=()):
+        """
+        Gets the plan SQLite uses to execute a query
+        :param sql: sql statement
+        :param parameters: parameter values for the ? placeholders in the sql
+        :return: QueryPlan instance
+        """
+        return self._explain(sql, self._bind(parameters))
+
+    def _explain(self, sql, values):
+        cursor = self.connection.cursor()
+        cursor.execute(u"EXPLAIN QUERY PLAN {0}".format(sql), values)
+        return QueryPlan(sql, values, cursor.fetchall())
+
+    def execute_scalar(self, sql, parameters=()):
+        with self.open_cursor(sql, parameters) as cursor:
+            result = cursor.fetchone()
         if result is None:
             raise Exception(u"No scalar result from {0}".format(sql))
         return result[0]
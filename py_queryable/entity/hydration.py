@@ -0,0 +1,59 @@
+_row_factories = {}
+
+
+def row_factory(key, model, loaders, compile_factory):
+    """
+    Gets a function creating entities from rows of the columns of a model. The code of the function is generated
+    once per model with the column indexes and attribute names written into it, see compile_row_factory.
+    :param key: tuple identifying the kind of entity, e.g. (DynamicModelProxy, validate)
+    :param model: a child class of a py_queryable.entity.model.Model
+    :param loaders: dictionary of ForeignKey attribute name to the loader of the referenced entities. The
+    attribute loads its entity on first access instead of holding the key value.
+    :param compile_factory: function of the model generating the factory when there is none for the key yet
+    :return: function of a row in the order of model.inspect_columns() returning an entity
+    """
+    # keyed by the metadata, which is recomputed when a column is added to the model
+    key = (model.metadata(),) + key
+    factory = _row_factories.get(key)
+    if factory is None:
+        factory = compile_factory(model)
+        _row_factories[key] = factory
+    return factory(loaders)
+
+
+def compile_row_factory(model, create, assign, namespace):
+    """
+    Generates the factory used by row_factory. The generated create function sets each attribute of a new entity
+    from its column in the row and defers the ForeignKey attributes with a loader to the entity's
+    defer(key, loader) method, after adding their key values to the loader.
+    :param model: a child class of a py_queryable.entity.model.Model
+    :param create: lines of code creating the new entity named entity
+    :param assign: function of the attribute name and column index returning the lines of code setting the
+    attribute of entity to value
+    :param namespace: names used by the lines of code
+    :return: function of the dictionary of loaders returning the create function
+    """
+    keys = model.metadata().attributes
+    foreign_keys = [n for n, c in model.metadata().foreign_keys]
+    lines = [u"def factory(loaders):"]
+    for i, key in enumerate(foreign_keys):
+        lines.append(u"    loader{0} = None if loaders is None else loaders.get({1})".format(i, repr(key)))
+    lines.append(u"    def create(row):")
+    lines.extend(u"        {0}".format(line) for line in create)
+    for index, key in enumerate(keys):
+        lines.append(u"        value = row[{0}]".format(index))
+        lines.extend(u"        {0}".format(line) for line in assign(key, index))
+        if key in foreign_keys:
+            loader = u"loader{0}".format(foreign_keys.index(key))
+            lines.extend([
+                u"        if {0} is not None and value is not None:".format(loader),
+                u"            {0}.add(value)".format(loader),
+                u"            entity.defer({0}, {1})".format(repr(key), loader)
+            ])
+    lines.extend([
+        u"        return entity",
+        u"    return create"
+    ])
+    namespace = dict(namespace)
+    exec u"\n".join(lines) in namespace
+    return namespace[u"factory"]
@@ -0,0 +1,104 @@
+import re
+from decimal import Decimal
+from ..exceptions import InvalidArgumentError
+from ..expressions import LambdaExpression
+
+
+class Index(object):
+    """
+    Index declared by a Model in its __indexes__ list, e.g.
+    __indexes__ = [Index(lambda s: (s.last_name, s.first_name), where=lambda s: s.gpa > 0)]
+    The lambdas are translated like the lambdas of a query.
+    """
+
+    def __init__(self, columns, include=None, where=None, unique=False, name=None):
+        """
+        Default constructor
+        :param columns: lambda selecting the indexed column, or a tuple of columns for a composite index
+        :param include: lambda selecting columns appended to the indexed columns so that queries reading only
+        these columns are answered from the index (covering index), or None
+        :param where: lambda selecting the rows to index (partial index), or None. SQLite does not allow
+        parameters in index definitions, so the values in the lambda are written into the statement. Queries
+        bind their values as parameters though, and SQLite only uses a partial index when it can prove the
+        condition of the index from the query without knowing the parameter values. So queries use a partial
+        index whose condition is a column that is not NULL, e.g. where=lambda s: s.gpa != None, when they
+        compare the column, but not one with a value in its condition such as where=lambda s: s.gpa > 0.
+        :param unique: whether the indexed columns are unique. Cannot be combined with include, which would make
+        the indexed and included columns unique together instead of the indexed columns.
+        :param name: name of the index, by default made from the table and column names, the condition of a
+        partial index and whether the index is unique
+        :return: void
+        """
+        if unique and include is not None:
+            raise InvalidArgumentError(
+                u"A unique index cannot include columns, declare a unique index and a separate covering index")
+        self.columns = columns
+        self.include = include
+        self.where = where
+        self.unique = unique
+        self.name = name
+
+    @staticmethod
+    def _literal(value):
+        if value is None:
+            return u"NULL"
+        if isinstance(value, bool):
+            return unicode(int(value))
+        if isinstance(value, (int, long, float, Decimal)):
+            return unicode(value)
+        if isinstance(value, basestring):
+            return u"'{0}'".format(value.replace(u"'", u"''"))
+        raise InvalidArgumentError(u"{0} cannot be used in an index definition".format(repr(value)))
+
+    @classmethod
+    def _translate(cls, model, func):
+        """
+        Translates a lambda of the index into sql without the lambda argument and with literal values
+        :param model: Model the index belongs to
+        :param func: lambda function
+        :return: sql
+        """
+        t = LambdaExpression.parse(model, func)
+        sql = re.sub(r"(?<![\w.]){0}\.".format(re.escape(t.args.args[0].id)), u"", t.body.sql)
+        values = iter(LambdaExpression.bind(t.body, func))
+        return re.sub(u"\\?", lambda m: cls._literal(next(values)), sql)
+
+    def index_name(self, model):
+        """
+        Gets the name of the index
+        :param model: Model the index belongs to
+        :return: the name given to the constructor, or a name made from the table name and the definition
+        """
+        if self.name is not None:
+            return self.name
+        parts = [model.table_name(), self._translate(model, self.columns)]
+        if self.include is not None:
+            parts.append(self._translate(model, self.include))
+        if self.where is not None:
+            parts.extend([u"where", self._translate(model, self.where).lower()])
+        if self.unique:
+            parts.append(u"unique")
+        parts.append(u"index")
+        return u"_".join(re.sub(r"\W+", u"_", p).strip(u"_") for p in parts)
+
+    def sql(self, model):
+        """
+        Generates the statement creating the index
+        :param model: Model the index belongs to
+        :return: sql statement as text
+        """
+        columns = self._translate(model, self.columns)
+        if self.include is not None:
+            columns = u"{0}, {1}".format(columns, self._translate(model, self.include))
+        sql = u"CREATE {0}INDEX IF NOT EXISTS {1} ON {2} ({3})".format(
+            u"UNIQUE " if self.unique else u"",
+            self.index_name(model),
+            model.table_name(),
+            columns
+        )
+        if self.where is not None:
+            sql = u"{0} WHERE {1}".format(sql, self._translate(model, self.where))
+        return sql
+
+    def __repr__(self):
+        return u"Index(name={0}, unique={1})".format(self.name, self.unique)
@@ -0,0 +1,67 @@
+import inspect
+from decimal import Decimal
+from .column_types import Column
+from py_linq.exceptions import NoMatchingElement
+
+
+class ModelMetadata(object):
+    """
+    Column information of a Model class, computed once when the class is created instead of inspecting the class
+    members on every query, proxy construction and insert
+    """
+    __defaults = {
+        int: 0,
+        float: float(0),
+        Decimal: Decimal(0),
+        unicode: '',
+        bytes: b''
+    }
+
+    def __init__(self, model):
+        """
+        Default constructor
+        :param model: Model class
+        :return: void
+        """
+        self.model = model
+        self.members = [
+            (unicode(name), col) for name, col in inspect.getmembers(model)
+            if isinstance(col, Column)
+        ]
+        self.primary_keys = [m for m in self.members if m[1].is_primary_key]
+        self.foreign_keys = [m for m in self.members if m[1].foreign_key is not None]
+        rest = [m for m in self.members if not m[1].is_primary_key and m[1].foreign_key is None]
+        # the primary key is first for table creation, so every query selects the columns in this order
+        ordered = self.primary_keys[:1] + self.foreign_keys + rest
+        self.attributes = [name for name, col in ordered]
+        self.columns = [(name if col.column_name is None else col.column_name, col) for name, col in ordered]
+        self.column_names = dict((col, name) for name, col in self.columns)
+        self.members_by_attribute = dict(self.members)
+        self.__column_defaults = None
+
+    @property
+    def primary_key(self):
+        """
+        :return: (attribute name, column) of the primary key or None when the model has none
+        """
+        if len(self.primary_keys) > 1:
+            raise AttributeError(u"More than one primary key column defined for {0}".format(self.model.__name__))
+        return self.primary_keys[0] if len(self.primary_keys) > 0 else None
+
+    @property
+    def defaults(self):
+        """
+        :return: dictionary of attribute name to the value of the attribute in a new instance of the model: None for
+        nullable columns and the empty value of the column type otherwise
+        """
+        if self.__column_defaults is None:
+            defaults = {}
+            for name, col in self.members:
+                if col.is_nullable:
+                    defaults[name] = None
+                elif col.column_type in self.__defaults:
+                    defaults[name] = self.__defaults[col.column_type]
+                else:
+                    raise NoMatchingElement(u"No matching type for {0}:{1}".format(col.column_name, col.column_type))
+            self.__column_defaults = defaults
+        return self.__column_defaults
@@ -1,35 +1,48 @@
-import inspect
 from .column_types import Column
-from decimal import Decimal
-from py_linq.exceptions import NoMatchingElement
+from .metadata import ModelMetadata
+
+
+class ModelType(type):
+    """
+    Metaclass of Model computing the column information of each Model class once, when the class is created
+    """
+    # names of the tables declared by Model classes
+    tables = set()
+
+    def __init__(cls, name, bases, members):
+        super(ModelType, cls).__init__(name, bases, members)
+        cls.__metadata__ = ModelMetadata(cls)
+        if u"__table_name__" in members:
+            ModelType.tables.add(members[u"__table_name__"])
+
+    def __setattr__(cls, name, value):
+        super(ModelType, cls).__setattr__(name, value)
+        if isinstance(value, Column):
+            cls.__metadata__ = ModelMetadata(cls)
 
 
 class Model(object):
+    __metaclass__ = ModelType
 
     def __init__(self):
-        for name, value in inspect.getmembers(self):
-            if isinstance(value, Column):
-                if not value.is_nullable:
-                    v = None
-                    if value.column_type == int:
-                        v = 0
-                    elif value.column_type == float:
-                        v = float(0)
-                    elif value.column_type == Decimal:
-                        v = Decimal(0)
-                    elif value.column_type == unicode:
-                        v = ''
-                    elif value.column_type == bytes:
-                        v = b''
-                    else:
-                        raise NoMatchingElement(
-                            u"No matching type for {0}:{1}".format(value.column_name, value.column_type)
-                        )
-                    self.__dict__.setdefault(name, v)
-                else:
-                    self.__dict__.setdefault(name, None)
-            else:
-                self.__dict__.setdefault(name, value)
+        values = self.__dict__
+        if len(values) == 0:
+            values.update(self.__metadata__.defaults)
+            return
+        # attributes set by a subclass before calling this constructor keep their values
+        for name, value in self.__metadata__.defaults.iteritems():
+            values.setdefault(name, value)
+
+    @classmethod
+    def from_row(cls, row):
+        """
+        Creates an instance from column values without setting the default values first
+        :param row: column values in the order of inspect_columns()
+        :return: instance of the model
+        """
+        instance = cls.__new__(cls)
+        instance.__dict__.update(zip(cls.__metadata__.attributes, row))
+        return instance
 
     @classmethod
     def table_name(cls):
@@ -37,37 +50,27 @@ class Model(object):
             raise AttributeError(u'No __table_name__ attribute set for {0}'.format(cls.__name__))
         return getattr(cls, '__table_name__')
 
+    @classmethod
+    def metadata(cls):
+        """
+        :return: ModelMetadata instance of the model, computed when the class was created
+        """
+        return cls.__metadata__
+
     @classmethod
     def get_column_members(cls):
-        return [
-            (unicode(name), col) for name, col in inspect.getmembers(cls)
-            if isinstance(col, Column)
-        ]
+        return list(cls.__metadata__.members)
 
     @classmethod
     def inspect_columns(cls):
         """
-        :return: list of (column_name, column instances) for the model
+        :return: list of (column_name, column instances) for the model. The primary key is first, followed by the
+        foreign keys and the other columns.
         """
-        columns = cls.get_column_members()
-
-        """
-        # Need to reorder the columns so that primary key is first for table creation. So just have this method
-        # return the columns in the correct order everytime.
-        """
-
-        pk_col = cls.get_primary_key_column()
-        fk_col = filter(lambda c: c[1].foreign_key is not None, columns)
-        rest = filter(lambda c: not c[1].is_primary_key and c[1].foreign_key is None, columns)
-        columns = [pk_col] + fk_col + rest if pk_col is not None else [] + fk_col + rest
-        return [(name if col.column_name is None else col.column_name, col) for name, col in columns]
+        # raises when more than one primary key is declared
+        cls.get_primary_key_column()
+        return list(cls.__metadata__.columns)
 
     @classmethod
     def get_primary_key_column(cls):
-        columns = filter(lambda c: c[1].is_primary_key, cls.get_column_members())
-        result = len(columns)
-        if result == 0:
-            return None
-        if result > 1:
-            raise AttributeError(u"More than one primary key column defined for {0}".format(cls.__name__))
-        return columns[0]
+        return cls.__metadata__.primary_key
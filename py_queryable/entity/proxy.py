@@ -1,8 +1,8 @@
 __author__ = 'Bruce.Fenske'
 
-import inspect
 from .column_types import Column
 from ..exceptions import InvalidArgumentError
+from . import hydration
 
 
 class ColumnProxy(object):
@@ -53,6 +53,25 @@ class DynamicModelProxy(object):
             self.columns[key].value = value
         super(DynamicModelProxy, self).__setattr__(key, value)
 
+    def __getattr__(self, key):
+        # only called for attributes that are not set, i.e. ForeignKey attributes that are loaded on first access
+        loaders = self.__dict__.get(u"_loaders", {})
+        if key not in loaders:
+            raise AttributeError(u"{0} has no attribute {1}".format(self.__class__.__name__, key))
+        value = loaders.pop(key).load(self.columns[key].value)
+        self.__dict__[key] = value
+        return value
+
+    def defer(self, key, loader):
+        """
+        Loads the entity referenced by a ForeignKey attribute the first time the attribute is accessed
+        :param key: name of the ForeignKey attribute
+        :param loader: object with a load method returning the entity for a key value
+        :return: void
+        """
+        self.__dict__.setdefault(u"_loaders", {})[key] = loader
+        self.__dict__.pop(key, None)
+
     @staticmethod
     def create_proxy_from_model_instance(instance):
         """
@@ -66,6 +85,76 @@ class DynamicModelProxy(object):
                 proxy.__setattr__(k, instance.__dict__[k])
         return proxy
 
+    @staticmethod
+    def create_proxy_from_row(model, row, loaders=None):
+        """
+        Creates a proxy model from the values of the columns of a model
+        :param model: a child class of a py_queryable.entity.model.Model
+        :param row: column values in the order of model.inspect_columns()
+        :param loaders: dictionary of ForeignKey attribute name to the loader of the referenced entities. The
+        attribute loads its entity on first access instead of holding the key value.
+        :return: DynamicModelProxy instance
+        """
+        return DynamicModelProxy.row_factory(model, loaders)(row)
+
+    @staticmethod
+    def row_factory(model, loaders=None, validate=True):
+        """
+        Gets a function creating proxy models from rows of the columns of a model
+        :param model: a child class of a py_queryable.entity.model.Model
+        :param loaders: dictionary of ForeignKey attribute name to the loader of the referenced entities
+        :param validate: whether the values are checked against the column types. Rows read from a table created
+        from the model hold values of the column types already.
+        :return: function of a row in the order of model.inspect_columns() returning a DynamicModelProxy instance
+        """
+        return hydration.row_factory(
+            (DynamicModelProxy, validate),
+            model,
+            loaders,
+            lambda m: DynamicModelProxy._compile_row_factory(m, validate)
+        )
+
+    @staticmethod
+    def _compile_row_factory(model, validate):
+        if validate:
+            create = [
+                u"entity = DynamicModelProxy(model)",
+                u"columns = entity._column_proxies",
+                u"values = entity.__dict__"
+            ]
+        else:
+            # the constructor and the value setter of the column proxies are skipped
+            create = [
+                u"entity = new(DynamicModelProxy)",
+                u"columns = {}",
+                u"values = entity.__dict__",
+                u"values['_model'] = model",
+                u"values['_column_proxies'] = columns"
+            ]
+
+        def assign(key, index):
+            if validate:
+                # attributes of a new proxy are None already and the column proxies do not accept None
+                return [
+                    u"if value is not None:",
+                    u"    columns[{0}].value = value".format(repr(key)),
+                    u"    values[{0}] = value".format(repr(key))
+                ]
+            return [
+                u"columns[{0}] = ColumnProxy(column{1}, value)".format(repr(key), index),
+                u"values[{0}] = value".format(repr(key))
+            ]
+
+        namespace = {
+            u"DynamicModelProxy": DynamicModelProxy,
+            u"ColumnProxy": ColumnProxy,
+            u"model": model,
+            u"new": object.__new__
+        }
+        for index, (name, column) in enumerate(model.metadata().columns):
+            namespace[u"column{0}".format(index)] = column
+        return hydration.compile_row_factory(model, create, assign, namespace)
+
     @property
     def model(self):
         return self._model
@@ -75,11 +164,7 @@ class DynamicModelProxy(object):
         return self._column_proxies
 
     def _add_model_columns(self):
-        columns = [
-            (unicode(name), col) for name, col in inspect.getmembers(self.model)
-            if isinstance(col, Column)
-        ]
-        for name, col in columns:
+        for name, col in self.model.metadata().members:
             proxy = ColumnProxy(col, None)
             self.columns.setdefault(name, proxy)
             self.__dict__.setdefault(name, proxy.value)
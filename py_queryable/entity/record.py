@@ -0,0 +1,92 @@
+from . import hydration
+
+
+class ModelRecord(object):
+    """
+    Compact query result of a Model. A subclass with a __slots__ attribute per column is generated for every Model,
+    so a record is one object without an instance dictionary or column proxies. The values are not validated
+    against the column types: records hold the values read from the database.
+    """
+    __slots__ = ('_loaders',)
+    _model = None
+    _record_types = {}
+
+    def __getattr__(self, key):
+        # only called for slots that are not set, i.e. ForeignKey attributes that are loaded on first access
+        if key == u"_loaders":
+            raise AttributeError(key)
+        loaders = getattr(self, u"_loaders", {})
+        if key not in loaders:
+            raise AttributeError(u"{0} has no attribute {1}".format(self.__class__.__name__, key))
+        loader, value = loaders.pop(key)
+        value = loader.load(value)
+        setattr(self, key, value)
+        return value
+
+    @property
+    def model(self):
+        return self._model
+
+    @staticmethod
+    def record_type(model):
+        """
+        Gets the record class of a model
+        :param model: a child class of a py_queryable.entity.model.Model
+        :return: subclass of ModelRecord with a slot for every column attribute of the model
+        """
+        # a column added to the model recomputes its metadata and needs a new record class
+        metadata = model.metadata()
+        result = ModelRecord._record_types.get(metadata)
+        if result is None:
+            result = type(
+                str(u"{0}Record".format(model.__name__)),
+                (ModelRecord,),
+                {u"__slots__": tuple(str(a) for a in metadata.attributes), u"_model": model}
+            )
+            ModelRecord._record_types[metadata] = result
+        return result
+
+    @staticmethod
+    def row_factory(model, loaders=None):
+        """
+        Gets a function creating records from rows of the columns of a model
+        :param model: a child class of a py_queryable.entity.model.Model
+        :param loaders: dictionary of ForeignKey attribute name to the loader of the referenced entities. The
+        attribute loads its entity on first access instead of holding the key value.
+        :return: function of a row in the order of model.inspect_columns() returning a ModelRecord instance
+        """
+        return hydration.row_factory((ModelRecord,), model, loaders, ModelRecord._compile_row_factory)
+
+    @staticmethod
+    def _compile_row_factory(model):
+        return hydration.compile_row_factory(
+            model,
+            [u"entity = new(record_type)"],
+            lambda key, index: [u"entity.{0} = value".format(key)],
+            {u"new": object.__new__, u"record_type": ModelRecord.record_type(model)}
+        )
+
+    def defer(self, key, loader):
+        """
+        Loads the entity referenced by a ForeignKey attribute the first time the attribute is accessed
+        :param key: name of the ForeignKey attribute
+        :param loader: object with a load method returning the entity for a key value
+        :return: void
+        """
+        loaders = getattr(self, u"_loaders", None)
+        if loaders is None:
+            loaders = self._loaders = {}
+        # the slot is cleared so that accessing the attribute calls __getattr__
+        loaders[key] = (loader, getattr(self, key))
+        delattr(self, key)
+
+    def __repr__(self):
+        # shows the key value of a ForeignKey attribute that is not loaded yet instead of loading it
+        loaders = getattr(self, u"_loaders", {})
+        return u"{0}({1})".format(
+            self.__class__.__name__,
+            u", ".join(
+                u"{0}={1}".format(k, repr(loaders[k][1] if k in loaders else getattr(self, k, None)))
+                for k in self.__slots__
+            )
+        )
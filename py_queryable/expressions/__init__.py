@@ -2,39 +2,194 @@ import abc
 import meta
 import ast
 from collections import deque
-from ..visitors.lambda_visitors import SqlLambdaTranslator
+from ..cache import LruCache
+from ..visitors.lambda_visitors import SqlLambdaTranslator, CapturedValue, DeferredValue
 
 
 class LambdaExpression(object):
 
     """
     Parses a python lambda expression and returns a modified tree that contains
-    appropriate sql syntax
+    appropriate sql syntax. Translated trees are cached by code object, closure and default values
+    so they are shared between callers and must be treated as read only.
     """
+    cache = LruCache(maxsize=1024)
+
     @staticmethod
     def parse(T, func):
+        key = LambdaExpression.cache_key(func)
+        if key is None:
+            return LambdaExpression.translate(func)
+        return LambdaExpression.cache.get(key, lambda: LambdaExpression.translate(func))
+
+    @staticmethod
+    def translate(func):
+        """
+        Decompiles and translates a lambda expression without going through the cache
+        :param func: lambda function
+        :return: translated tree
+        """
         tree = meta.decompiler.decompile_func(func)
-        translator = SqlLambdaTranslator()
+        translator = SqlLambdaTranslator(func)
         translator.generic_visit(tree)
         return tree
 
+    @staticmethod
+    def cache_key(func):
+        """
+        Gets the key used to cache the translated tree of a lambda expression. Captured values are bound
+        when the tree is used, so only their types are part of the key.
+        :param func: lambda function
+        :return: key tuple or None if a closure variable is not bound yet
+        """
+        try:
+            closure = tuple(type(c.cell_contents) for c in func.__closure__ or ())
+        except ValueError:
+            return None
+        return func.__code__, closure, tuple(type(d) for d in func.__defaults__ or ())
+
+    @staticmethod
+    def fingerprint(func):
+        """
+        Gets a hashable value identifying a lambda function by its code and the values it has captured from
+        its closure, default arguments and globals. Captured objects are compared using their own equality.
+        :param func: lambda function or None
+        :return: tuple of (code, closure values, default values, global values), or the function itself
+        when a captured value cannot be hashed
+        """
+        if func is None:
+            return None
+        code = func.__code__
+        try:
+            closure = tuple(c.cell_contents for c in func.__closure__ or ())
+        except ValueError:
+            return func
+        names = LambdaExpression._global_names(code)
+        result = (
+            code,
+            closure,
+            func.__defaults__,
+            tuple((n, func.__globals__[n]) for n in names if n in func.__globals__)
+        )
+        try:
+            hash(result)
+        except TypeError:
+            return func
+        return result
+
+    @staticmethod
+    def _global_names(code):
+        names = list(code.co_names)
+        for c in code.co_consts:
+            if hasattr(c, u"co_names"):
+                names.extend(LambdaExpression._global_names(c))
+        return names
+
+    @staticmethod
+    def bind(node, func):
+        """
+        Gets the parameter values for the placeholders in the sql of a translated node
+        :param node: translated node of the tree returned by parse
+        :param func: the lambda function the tree was parsed from
+        :return: list of parameter values
+        """
+        return [
+            p.resolve(func) if isinstance(p, CapturedValue) else p
+            for p in getattr(node, u"params", [])
+        ]
+
+    @staticmethod
+    def defer(node, func):
+        """
+        Gets the parameters for the placeholders in the sql of a translated node where captured values are
+        DeferredValue instances to be resolved when the sql is executed
+        :param node: translated node of the tree returned by parse
+        :param func: the lambda function the tree was parsed from
+        :return: list of parameter values and DeferredValue instances
+        """
+        return [
+            DeferredValue(p, func) if isinstance(p, CapturedValue) else p
+            for p in getattr(node, u"params", [])
+        ]
+
+    @staticmethod
+    def cache_info():
+        """
+        :return: dictionary of hits, misses, maxsize and current size of the translated lambda cache
+        """
+        return LambdaExpression.cache.info()
+
+    @staticmethod
+    def clear_cache():
+        """
+        Empties the translated lambda cache and resets its counters
+        :return: void
+        """
+        LambdaExpression.cache.clear()
+
 
 class Expression(object):
+    """
+    Base class of expression tree nodes. Nodes are immutable once constructed: each attribute can only be
+    assigned once, so trees can be cached and shared between threads. Nodes compare and hash by structure,
+    so equal trees can be used as dictionary keys.
+    """
+    __slots__ = ('class_type', '_hash', '_key')
+
     def __init__(self):
-        self.visited = False
-        self.class_type = None
+        super(Expression, self).__init__()
+
+    def __setattr__(self, key, value):
+        if hasattr(self, key):
+            raise AttributeError(u"{0} is immutable, cannot reassign {1}".format(self.__class__.__name__, key))
+        super(Expression, self).__setattr__(key, value)
 
     def __eq__(self, other):
-        return self.__repr__() == other.__repr__()
+        if self is other:
+            return True
+        if not isinstance(other, Expression):
+            return False
+        return hash(self) == hash(other) and self.key == other.key
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        try:
+            return self._hash
+        except AttributeError:
+            object.__setattr__(self, '_hash', hash(self.key))
+            return self._hash
+
+    @property
+    def key(self):
+        """
+        Structural key of the node made from its type and the values returned by key_fields
+        :return: tuple
+        """
+        try:
+            return self._key
+        except AttributeError:
+            object.__setattr__(self, '_key', (self.__class__,) + tuple(self.key_fields()))
+            return self._key
+
+    @abc.abstractmethod
+    def key_fields(self):
+        """
+        :return: tuple of child expressions and values that identify the node
+        """
+        raise NotImplementedError()
 
     @property
     def type(self):
-        if self.class_type is None:
+        try:
+            return self.class_type
+        except AttributeError:
             t = self.find(TableExpression)
             if t is None:
                 raise Exception("Cannot find TableExpression in {0}".format(self.exp.__repr__()))
-            self.class_type = t.type
-        return self.class_type
+            object.__setattr__(self, 'class_type', t.type)
+            return self.class_type
 
     @abc.abstractmethod
     def visit(self, visitor):
@@ -51,7 +206,7 @@ class Expression(object):
         :return: First expression that matches given expression else None
         """
         if isinstance(self, expression):
-            return expression
+            return self
         q = deque(self.children)
         while len(q) > 0:
             node = q.popleft()
@@ -63,6 +218,8 @@ class Expression(object):
 
 
 class TableExpression(Expression):
+    __slots__ = ()
+
     def __init__(self, T):
         super(TableExpression, self).__init__()
         if not hasattr(T, u"__table_name__"):
@@ -72,15 +229,20 @@ class TableExpression(Expression):
     def visit(self, visitor):
         return visitor.visit_TableExpression(self)
 
+    def key_fields(self):
+        return self.class_type,
+
     @property
     def children(self):
         return []
 
     def __repr__(self):
-        return u"Table(table_name={0})".format(self.type.table_name)
+        return u"Table(table_name={0})".format(self.type.table_name())
 
 
 class UnaryExpression(Expression):
+    __slots__ = ('exp',)
+
     def __init__(self, exp):
         super(UnaryExpression, self).__init__()
         self.exp = exp
@@ -88,6 +250,9 @@ class UnaryExpression(Expression):
     def visit(self, visitor):
         return visitor.visit(self)
 
+    def key_fields(self):
+        return self.exp,
+
     @property
     def children(self):
         return [self.exp]
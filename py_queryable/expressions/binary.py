@@ -1,8 +1,10 @@
 import abc
-from . import Expression
+from . import Expression, LambdaExpression
 
 
 class BinaryExpression(Expression):
+    __slots__ = ('left', 'right')
+
     def __init__(self, left_exp, right_exp):
         super(BinaryExpression, self).__init__()
         self.left = left_exp
@@ -12,32 +14,104 @@ class BinaryExpression(Expression):
     def visit(self, visitor):
         raise NotImplementedError()
 
+    def key_fields(self):
+        return self.left, self.right
+
     @property
     def children(self):
         return [self.left, self.right]
 
     def __repr__(self):
-        return u"{0}(left={1}, right={3})".format(
+        return u"{0}(left={1}, right={2})".format(
             self.__class__.__name__,
             self.left.__repr__(),
             self.right.__repr__())
 
 
 class JoinExpression(BinaryExpression):
-    def __init__(self, outer_exp, inner_exp, outer_key, inner_key, select_func):
+    """
+    Correlates the rows of two expressions whose keys are equal. The lambda selecting the result takes the outer
+    and the inner row as arguments, e.g. lambda s, e: (s.first_name, e.grade).
+    """
+    __slots__ = ('inner_key', 'outer_key', 'select_func', 'join_type')
+
+    def __init__(self, outer_exp, inner_exp, outer_key, inner_key, select_func, join_type=u"INNER"):
+        """
+        Default constructor
+        :param outer_exp: outer expression
+        :param inner_exp: inner expression
+        :param outer_key: lambda selecting the key of an outer row
+        :param inner_key: lambda selecting the key of an inner row
+        :param select_func: lambda of an outer and an inner row selecting the result
+        :param join_type: INNER to only keep outer rows with matching inner rows or LEFT to keep every outer row
+        :return: void
+        """
         super(JoinExpression, self).__init__(outer_exp, inner_exp)
         self.inner_key = inner_key
         self.outer_key = outer_key
         self.select_func = select_func
+        self.join_type = join_type
 
     def visit(self, visitor):
         return visitor.visit_JoinExpression(self)
 
+    @property
+    def type(self):
+        return self.left.type
+
+    def key_fields(self):
+        return (
+            self.left,
+            self.right,
+            LambdaExpression.fingerprint(self.outer_key),
+            LambdaExpression.fingerprint(self.inner_key),
+            LambdaExpression.fingerprint(self.select_func),
+            self.join_type
+        )
+
     def __repr__(self):
-        return u"JoinExpression(outer={0}, inner={1}, outer_key={2}, inner_key={3}, select={4})".format(
+        return u"JoinExpression(outer={0}, inner={1}, outer_key={2}, inner_key={3}, select={4}, type={5})".format(
             self.left.__repr__(),
             self.right.__repr__(),
             self.outer_key.__repr__(),
             self.inner_key.__repr__(),
-            self.select_func.__repr__()
+            self.select_func.__repr__(),
+            self.join_type
+        )
+
+
+class SetExpression(BinaryExpression):
+    """
+    Combines the rows of two expressions with the same projection using a compound SELECT operator
+    """
+    __slots__ = ('operation',)
+
+    def __init__(self, left_exp, right_exp, operation):
+        """
+        Default constructor
+        :param left_exp: left expression
+        :param right_exp: right expression
+        :param operation: UNION or UNION ALL to return the rows of both expressions with or without duplicates,
+        INTERSECT to return the rows of the left expression that the right one returns or EXCEPT to return the rows
+        of the left expression that the right one does not return
+        :return: void
+        """
+        super(SetExpression, self).__init__(left_exp, right_exp)
+        self.operation = operation
+
+    def visit(self, visitor):
+        return visitor.visit_SetExpression(self)
+
+    @property
+    def type(self):
+        return self.left.type
+
+    def key_fields(self):
+        return self.left, self.right, self.operation
+
+    def __repr__(self):
+        return u"SetExpression(left={0}, right={1}, operation={2})".format(
+            self.left.__repr__(),
+            self.right.__repr__(),
+            self.operation
         )
@@ -4,6 +4,8 @@ from . import Expression, UnaryExpression, TableExpression, LambdaExpression
 
 
 class LambdaOperator(Expression):
+    __slots__ = ('exp', 'func')
+
     def __init__(self, exp, func):
         super(LambdaOperator, self).__init__()
         self.exp = exp
@@ -13,15 +15,20 @@ class LambdaOperator(Expression):
     def children(self):
         return [self.exp]
 
+    def key_fields(self):
+        return self.exp, LambdaExpression.fingerprint(self.func)
+
     def __repr__(self):
         return u"{0}(T={1}, func={2})".format(
             self.__class__.__name__,
-            self.type.__class__.__name__,
-            ast.dump(LambdaExpression.parse(self.type, self.func))
+            self.type.__name__,
+            ast.dump(LambdaExpression.parse(self.type, self.func)) if self.func is not None else None
         )
 
 
 class SelectOperator(LambdaOperator):
+    __slots__ = ()
+
     def __init__(self, exp, func=None):
         super(SelectOperator, self).__init__(exp, func)
 
@@ -30,6 +37,8 @@ class SelectOperator(LambdaOperator):
 
 
 class WhereOperator(LambdaOperator):
+    __slots__ = ()
+
     def __init__(self, exp, func):
         super(WhereOperator, self).__init__(exp, func)
 
@@ -38,15 +47,22 @@ class WhereOperator(LambdaOperator):
 
 
 class AliasOperator(UnaryExpression):
+    __slots__ = ('alias',)
+
     def __init__(self, alias, exp):
         super(AliasOperator, self).__init__(exp)
         self.alias = alias
 
+    def key_fields(self):
+        return self.exp, self.alias
+
     def visit(self, visitor):
         return visitor.visit_AliasOperator(self)
 
 
 class CountOperator(UnaryExpression):
+    __slots__ = ()
+
     def __init__(self, exp):
         super(CountOperator, self).__init__(exp)
 
@@ -55,24 +71,36 @@ class CountOperator(UnaryExpression):
 
 
 class TakeOperator(UnaryExpression):
+    __slots__ = ('limit',)
+
     def __init__(self, exp, limit):
         super(TakeOperator, self).__init__(exp)
         self.limit = limit
 
+    def key_fields(self):
+        return self.exp, self.limit
+
     def visit(self, visitor):
         return visitor.visit_TakeOperator(self)
 
 
 class SkipOperator(UnaryExpression):
+    __slots__ = ('skip',)
+
     def __init__(self, exp, skip):
         super(SkipOperator, self).__init__(exp)
         self.skip = skip
 
+    def key_fields(self):
+        return self.exp, self.skip
+
     def visit(self, visitor):
         return visitor.visit_SkipOperator(self)
 
 
 class MaxOperator(LambdaOperator):
+    __slots__ = ()
+
     def __init__(self, exp, func=None):
         super(MaxOperator, self).__init__(exp, func)
 
@@ -81,6 +109,8 @@ class MaxOperator(LambdaOperator):
 
 
 class MinOperator(LambdaOperator):
+    __slots__ = ()
+
     def __init__(self, exp, func=None):
         super(MinOperator, self).__init__(exp, func)
 
@@ -89,6 +119,8 @@ class MinOperator(LambdaOperator):
 
 
 class SumOperator(LambdaOperator):
+    __slots__ = ()
+
     def __init__(self, exp, func=None):
         super(SumOperator, self).__init__(exp, func)
 
@@ -97,6 +129,8 @@ class SumOperator(LambdaOperator):
 
 
 class AveOperator(LambdaOperator):
+    __slots__ = ()
+
     def __init__(self, exp, func=None):
         super(AveOperator, self).__init__(exp, func)
 
@@ -105,6 +139,8 @@ class AveOperator(LambdaOperator):
 
 
 class WhereOperator(LambdaOperator):
+    __slots__ = ()
+
     def __init__(self, exp, func):
         super(WhereOperator, self).__init__(exp, func)
 
@@ -113,6 +149,8 @@ class WhereOperator(LambdaOperator):
 
 
 class OrderByOperator(LambdaOperator):
+    __slots__ = ()
+
     def __init__(self, exp, func):
         super(OrderByOperator, self).__init__(exp, func)
 
@@ -121,6 +159,8 @@ class OrderByOperator(LambdaOperator):
 
 
 class OrderByDescendingOperator(LambdaOperator):
+    __slots__ = ()
+
     def __init__(self, exp, func):
         super(OrderByDescendingOperator, self).__init__(exp, func)
 
@@ -129,6 +169,8 @@ class OrderByDescendingOperator(LambdaOperator):
 
 
 class ThenByOperator(LambdaOperator):
+    __slots__ = ()
+
     def __init__(self, exp, func):
         super(ThenByOperator, self).__init__(exp, func)
 
@@ -137,8 +179,243 @@ class ThenByOperator(LambdaOperator):
 
 
 class ThenByDescendingOperator(LambdaOperator):
+    __slots__ = ()
+
     def __init__(self, exp, func):
         super(ThenByDescendingOperator, self).__init__(exp, func)
 
     def visit(self, visitor):
         return visitor.visit_ThenByDescendingOperator(self)
+
+
+class SeekOperator(UnaryExpression):
+    """
+    Keeps the rows of an ordered source that come after a given row in its ordering, i.e. whose ordering
+    keys compare greater (less for descending orderings) than the keys of that row
+    """
+    __slots__ = ('values',)
+
+    def __init__(self, exp, values):
+        """
+        Default constructor
+        :param exp: OrderBy, OrderByDescending, ThenBy or ThenByDescending operator
+        :param values: tuple of the ordering key values of the last row seen, one per ordering operator
+        :return: void
+        """
+        super(SeekOperator, self).__init__(exp)
+        self.values = tuple(values)
+
+    def key_fields(self):
+        return self.exp, self.values
+
+    def visit(self, visitor):
+        return visitor.visit_SeekOperator(self)
+
+    @staticmethod
+    def orderings(expression):
+        """
+        Gets the ordering terms of a chain of ordering operators
+        :param expression: OrderBy, OrderByDescending, ThenBy or ThenByDescending operator
+        :return: tuple of (list of (lambda, descending) in ordering precedence, source of the OrderBy operator)
+        """
+        orderings = []
+        while isinstance(expression, (ThenByOperator, ThenByDescendingOperator)):
+            orderings.insert(0, (expression.func, isinstance(expression, ThenByDescendingOperator)))
+            expression = expression.exp
+        if not isinstance(expression, (OrderByOperator, OrderByDescendingOperator)):
+            raise AttributeError(u"Seek needs to follow OrderBy or OrderByDescending")
+        orderings.insert(0, (expression.func, isinstance(expression, OrderByDescendingOperator)))
+        return orderings, expression.exp
+
+
+class DistinctOperator(UnaryExpression):
+    """
+    Removes duplicate rows from its source
+    """
+    __slots__ = ()
+
+    def __init__(self, exp):
+        super(DistinctOperator, self).__init__(exp)
+
+    def visit(self, visitor):
+        return visitor.visit_DistinctOperator(self)
+
+
+class AnyOperator(UnaryExpression):
+    __slots__ = ()
+
+    def __init__(self, exp):
+        super(AnyOperator, self).__init__(exp)
+
+    def visit(self, visitor):
+        return visitor.visit_AnyOperator(self)
+
+
+class AllOperator(LambdaOperator):
+    __slots__ = ()
+
+    def __init__(self, exp, func):
+        super(AllOperator, self).__init__(exp, func)
+
+    def visit(self, visitor):
+        return visitor.visit_AllOperator(self)
+
+
+class AggregateOperator(UnaryExpression):
+    """
+    Computes several aggregate values of the same source in one statement
+    """
+    __slots__ = ('aggregates',)
+
+    def __init__(self, exp, aggregates):
+        """
+        Default constructor
+        :param exp: source expression
+        :param aggregates: tuple of (name, aggregate function name, lambda) where the aggregate function is one
+        of COUNT, MAX, MIN, SUM or AVG. The lambda may be None for COUNT to count every row.
+        :return: void
+        """
+        super(AggregateOperator, self).__init__(exp)
+        self.aggregates = tuple(aggregates)
+
+    def key_fields(self):
+        return self.exp, tuple((n, a, LambdaExpression.fingerprint(f)) for n, a, f in self.aggregates)
+
+    def visit(self, visitor):
+        return visitor.visit_AggregateOperator(self)
+
+
+class GroupByOperator(LambdaOperator):
+    """
+    Groups the rows of its source by the value of a key lambda. Selecting from a GroupByOperator projects
+    one row per group where the lambda argument is the group: g.key is the group's key and g.count(),
+    g.max(lambda s: ...), g.min, g.sum and g.average are aggregates of the group's rows.
+    """
+    __slots__ = ()
+
+    def __init__(self, exp, func):
+        super(GroupByOperator, self).__init__(exp, func)
+
+    def visit(self, visitor):
+        return visitor.visit_GroupByOperator(self)
+
+
+class HavingOperator(LambdaOperator):
+    """
+    Filters the groups of a GroupByOperator
+    """
+    __slots__ = ()
+
+    def __init__(self, exp, func):
+        super(HavingOperator, self).__init__(exp, func)
+
+    def visit(self, visitor):
+        return visitor.visit_HavingOperator(self)
+
+
+class IncludeOperator(LambdaOperator):
+    """
+    Loads the entity referenced by a ForeignKey column together with each row of its source. The lambda selects
+    the ForeignKey attribute, e.g. lambda e: e.student.
+    """
+    __slots__ = ()
+
+    def __init__(self, exp, func):
+        super(IncludeOperator, self).__init__(exp, func)
+
+    def visit(self, visitor):
+        return visitor.visit_IncludeOperator(self)
+
+    @property
+    def attribute(self):
+        """
+        :return: name of the ForeignKey attribute selected by the lambda
+        """
+        return LambdaExpression.parse(self.type, self.func).body.attr
+
+    @property
+    def column(self):
+        """
+        :return: ForeignKey column selected by the lambda
+        """
+        return self.type.metadata().members_by_attribute[self.attribute]
+
+
+class FlatSelectOperator(Expression):
+    """
+    A single SELECT statement over a table: projection, filters, ordering, limit and offset, optionally
+    reduced by an aggregate function, without duplicate rows or starting after a row of its ordering (see
+    SeekOperator). Produced by OptimizeVisitor when a chain of operators can be merged
+    without changing its result.
+    """
+    __slots__ = ('exp', 'func', 'predicates', 'orderings', 'limit', 'offset', 'aggregate', 'after', 'distinct')
+
+    def __init__(self, exp, func=None, predicates=(), orderings=(), limit=None, offset=None, aggregate=None,
+                 after=None, distinct=False):
+        """
+        Default constructor
+        :param exp: TableExpression selected from
+        :param func: projection lambda or None to select every column
+        :param predicates: tuple of (lambda, negated) filter terms combined with AND
+        :param orderings: tuple of (lambda, descending) ordering terms
+        :param limit: maximum number of rows or None
+        :param offset: number of rows skipped or None
+        :param aggregate: name of the SQL aggregate function applied to the projection (COUNT, MAX, MIN, SUM
+        or AVG), EXISTS or NOT EXISTS to test whether the statement returns any row, or None
+        :param after: tuple of ordering key values, one per ordering term, to only select the rows ordered after
+        them, or None
+        :param distinct: remove duplicate rows of the projection
+        :return: void
+        """
+        super(FlatSelectOperator, self).__init__()
+        self.exp = exp
+        self.func = func
+        self.predicates = tuple(predicates)
+        self.orderings = tuple(orderings)
+        self.limit = limit
+        self.offset = offset
+        self.aggregate = aggregate
+        self.after = None if after is None else tuple(after)
+        self.distinct = distinct
+
+    def replace(self, **kwargs):
+        """
+        Creates a copy of this instance with the given attributes replaced
+        :return: FlatSelectOperator instance
+        """
+        values = dict((k, getattr(self, k)) for k in self.__slots__)
+        values.update(kwargs)
+        return FlatSelectOperator(**values)
+
+    def visit(self, visitor):
+        return visitor.visit_FlatSelectOperator(self)
+
+    @property
+    def children(self):
+        return [self.exp]
+
+    def key_fields(self):
+        return (
+            self.exp,
+            LambdaExpression.fingerprint(self.func),
+            tuple((LambdaExpression.fingerprint(f), n) for f, n in self.predicates),
+            tuple((LambdaExpression.fingerprint(f), d) for f, d in self.orderings),
+            self.limit,
+            self.offset,
+            self.aggregate,
+            self.after,
+            self.distinct
+        )
+
+    def __repr__(self):
+        return u"{0}(exp={1}, predicates={2}, orderings={3}, limit={4}, offset={5}, aggregate={6}, after={7}, distinct={8})".format(
+            self.__class__.__name__,
+            self.exp.__repr__(),
+            len(self.predicates),
+            len(self.orderings),
+            self.limit,
+            self.offset,
+            self.aggregate,
+            self.after,
+            self.distinct
+        )
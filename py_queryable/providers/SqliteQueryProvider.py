@@ -1,4 +1,5 @@
 from ..query.Queryable import Queryable
+from ..query.IndexAdvisor import IndexAdvisor
 from ..providers import IQueryProvider
 from ..visitors.sql import SqlVisitor
 
@@ -7,7 +8,8 @@ class SqliteQueryProvider(IQueryProvider):
 
     def __init__(self, db_provider):
         self.__provider = db_provider
-        self.__visitor = SqlVisitor()
+        self.__visitor = SqlVisitor(optimize=True)
+        self.__advisor = None
 
     @property
     def db_provider(self):
@@ -17,6 +19,39 @@ class SqliteQueryProvider(IQueryProvider):
     def provider_visitor(self):
         return self.__visitor
 
+    @property
+    def index_advisor(self):
+        """
+        :return: IndexAdvisor recording the queries executed by this provider or None when recording is off
+        """
+        return self.__advisor
+
+    def enable_index_advisor(self):
+        """
+        Starts recording the filter and ordering columns of executed queries
+        :return: IndexAdvisor instance
+        """
+        if self.__advisor is None:
+            self.__advisor = IndexAdvisor(self.db_provider)
+        return self.__advisor
+
+    def disable_index_advisor(self):
+        """
+        Stops recording executed queries and discards the recorded executions
+        :return: void
+        """
+        self.__advisor = None
+
+    def advise_indexes(self, create=False):
+        """
+        Proposes indexes for the recorded queries, see IndexAdvisor.advise_indexes
+        :param create: whether to create the proposed indexes
+        :return: list of dictionaries describing the proposed indexes
+        """
+        if self.__advisor is None:
+            raise AttributeError(u"Index advisor is not enabled")
+        return self.__advisor.advise_indexes(create)
+
     def createQuery(self, expression):
         """
         Create Queryable instance from given expression
@@ -31,7 +66,6 @@ class SqliteQueryProvider(IQueryProvider):
         :param expression: An AST expression instance
         :return: db_provider cursor object
         """
-        cursor = self.db_provider.connection.cursor()
-        queryable = self.createQuery(expression)
-        cursor.execute(queryable.sql)
-        return cursor
+        sql, parameters = self.createQuery(expression).translate()
+        with self.db_provider.open_cursor(sql, parameters) as cursor:
+            return cursor
@@ -0,0 +1,77 @@
+import inspect
+from py_linq import Enumerable
+from ..exceptions import InvalidArgumentError
+from ..visitors.lambda_visitors import QueryParameter
+from .Queryable import Queryable
+
+
+class CompiledQuery(object):
+    """
+    A query that is translated into SQL once and then executed any number of times with different
+    argument values
+    """
+
+    def __init__(self, queryable, func):
+        """
+        Builds and translates the query
+        :param queryable: Queryable instance the query is built from
+        :param func: function taking the queryable followed by the query arguments that returns a Queryable.
+        Lambdas in the query that capture the arguments have them bound as SQL parameters.
+        :return: void
+        """
+        self._names = inspect.getargspec(func).args[1:]
+        query = func(queryable, *[QueryParameter(n) for n in self._names])
+        if not isinstance(query, Queryable):
+            raise InvalidArgumentError(u"Compiled query function must return a Queryable instance, not {0}".format(
+                type(query).__name__))
+        self._query = query
+        self._sql, self._parameters = query.translate()
+
+    @property
+    def sql(self):
+        return self._sql
+
+    @property
+    def parameter_names(self):
+        return list(self._names)
+
+    def bind(self, *args, **kwargs):
+        """
+        Gets the parameter values for the compiled SQL given the query arguments
+        :param args: query arguments by position
+        :param kwargs: query arguments by name
+        :return: list of parameter values
+        """
+        values = dict(zip(self._names, args))
+        values.update(kwargs)
+        missing = [n for n in self._names if n not in values]
+        if len(missing) > 0 or len(values) != len(self._names):
+            raise InvalidArgumentError(
+                u"Compiled query expects arguments ({0}) but got ({1})".format(
+                    u", ".join(self._names), u", ".join(sorted(values.keys()))
+                )
+            )
+        return [
+            p.bind(values[p.name]) if isinstance(p, QueryParameter) else p
+            for p in self._parameters
+        ]
+
+    def statement(self, *args, **kwargs):
+        """
+        Gets the statement to execute given the query arguments. The ? placeholders of the arguments tested for
+        membership, e.g. s.student_id in ids, are expanded for the collections they are bound to.
+        :param args: query arguments by position
+        :param kwargs: query arguments by name
+        :return: tuple of (sql, list of parameter values)
+        """
+        return self._query.provider.provider_visitor.expand(self._sql, self.bind(*args, **kwargs))
+
+    def __call__(self, *args, **kwargs):
+        """
+        Executes the compiled query
+        :param args: query arguments by position
+        :param kwargs: query arguments by name
+        :return: Enumerable of results
+        """
+        sql, parameters = self.statement(*args, **kwargs)
+        return Enumerable(self._query._materialize(sql, parameters))
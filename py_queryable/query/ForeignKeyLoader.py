@@ -0,0 +1,96 @@
+
+import timeit
+
+
+class ForeignKeyLoader(object):
+    """
+    Loads the entities referenced by a ForeignKey column for the entities of one result set. Keys are collected
+    as the entities are created and the first access of a referenced entity loads every collected key with one
+    WHERE primary_key IN (...) query per batch_size keys.
+    """
+    batch_size = 500
+
+    def __init__(self, provider, column):
+        """
+        Default constructor
+        :param provider: query provider of the result set
+        :param column: ForeignKey column
+        :return: void
+        """
+        self.__provider = provider
+        self.__column = column
+        self.__pending = []
+        self.__loaded = {}
+        self.__queries = 0
+        # function adding the keys of the rows of the result set that are not read yet, called before the first load
+        self.prefetch = None
+
+    @staticmethod
+    def loaders(provider, model):
+        """
+        Creates a loader for every ForeignKey column of a model
+        :param provider: query provider of the result set
+        :param model: Model type
+        :return: dictionary of ForeignKey attribute name to ForeignKeyLoader instance or None when the model has no
+        ForeignKey column
+        """
+        result = dict(
+            (name, ForeignKeyLoader(provider, column)) for name, column in model.metadata().foreign_keys
+        )
+        return result if len(result) > 0 else None
+
+    @property
+    def queries(self):
+        """
+        :return: number of queries executed by this loader
+        """
+        return self.__queries
+
+    def add(self, key):
+        """
+        Adds a key to load with the next batch
+        :param key: ForeignKey value
+        :return: void
+        """
+        if key not in self.__loaded:
+            self.__loaded[key] = None
+            self.__pending.append(key)
+
+    def load(self, key):
+        """
+        Gets the entity referenced by a key, loading every pending key if it is not loaded yet
+        :param key: ForeignKey value
+        :return: DynamicModelProxy or ModelRecord instance or None when no entity has the key
+        """
+        self.add(key)
+        if self.prefetch is not None:
+            prefetch, self.prefetch = self.prefetch, None
+            prefetch()
+        if len(self.__pending) > 0:
+            pending, self.__pending = self.__pending, []
+            for i in range(0, len(pending), self.batch_size):
+                self.__load(pending[i:i + self.batch_size])
+        return self.__loaded[key]
+
+    def __load(self, keys):
+        model = self.__column.foreign_key
+        columns = model.metadata().columns
+        primary_key = model.metadata().column_names[self.__column.foreign_column]
+        sql = u"SELECT {0} FROM {1} WHERE {2} IN ({3})".format(
+            u", ".join(n for n, c in columns),
+            model.table_name(),
+            primary_key,
+            u", ".join(u"?" for k in keys)
+        )
+        index = [n for n, c in columns].index(primary_key)
+        db_provider = self.__provider.db_provider
+        create = db_provider.row_factory(model, ForeignKeyLoader.loaders(self.__provider, model))
+        advisor = getattr(self.__provider, u"index_advisor", None)
+        start = timeit.default_timer()
+        # executed like the queries of the result set, so the plan is recorded and the index advisor sees the lookup
+        with db_provider.open_cursor(sql, keys) as cursor:
+            if advisor is not None:
+                advisor.record_lookup(model, (primary_key,), timeit.default_timer() - start)
+            self.__queries += 1
+            for row in cursor:
+                self.__loaded[row[index]] = create(row)
@@ -0,0 +1,204 @@
+import ast
+import threading
+from ..cache import LruCache
+from ..expressions import LambdaExpression
+from ..expressions import operators
+
+
+class IndexAdvisor(object):
+    """
+    Records the columns that the Where, OrderBy and ThenBy lambdas of executed queries filter and sort on, weighted
+    by the number of executions and the time spent executing them, and proposes indexes for them. A proposed index
+    starts with the columns compared for equality, followed by the ordering columns or else the first column
+    compared with a range.
+    """
+    __orderings = (
+        operators.OrderByOperator,
+        operators.OrderByDescendingOperator,
+        operators.ThenByOperator,
+        operators.ThenByDescendingOperator
+    )
+
+    def __init__(self, db_provider):
+        """
+        Default constructor
+        :param db_provider: database connection the queries are executed on
+        :return: void
+        """
+        self.__db_provider = db_provider
+        self.__usages = LruCache(maxsize=256)
+        self.__stats = {}
+        self.__lock = threading.Lock()
+
+    def record(self, expression, elapsed):
+        """
+        Records an execution of a query
+        :param expression: expression tree of the query
+        :param elapsed: seconds spent executing the query
+        :return: void
+        """
+        usages = self.__usages.get(expression, lambda: self._usages(expression))
+        with self.__lock:
+            for usage in usages:
+                stats = self.__stats.setdefault(usage, [0, 0.0])
+                stats[0] += 1
+                stats[1] += elapsed
+
+    def record_lookup(self, model, columns, elapsed):
+        """
+        Records an execution of a statement that is not translated from an expression, e.g. the IN (...) lookup of
+        the entities referenced by a ForeignKey attribute
+        :param model: Model type of the table the statement reads
+        :param columns: names of the columns the statement compares for equality
+        :param elapsed: seconds spent executing the statement
+        :return: void
+        """
+        usage = (model, tuple(sorted(unicode(c) for c in columns)), (), ())
+        with self.__lock:
+            stats = self.__stats.setdefault(usage, [0, 0.0])
+            stats[0] += 1
+            stats[1] += elapsed
+
+    def clear(self):
+        """
+        Forgets every recorded execution
+        :return: void
+        """
+        with self.__lock:
+            self.__stats.clear()
+
+    @staticmethod
+    def _column(node, name, columns):
+        if isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name) and node.value.id == name \
+                and node.attr in columns:
+            return unicode(node.attr)
+        return None
+
+    def _filter_columns(self, node, name, columns, equality, ranges):
+        """
+        Collects the columns of a Where lambda's AND terms that an index can search
+        :param node: node of the translated lambda body
+        :param name: name of the lambda argument
+        :param columns: names of the model's columns
+        :param equality: list the columns compared for equality are appended to
+        :param ranges: list the columns compared with a range are appended to
+        :return: void
+        """
+        if isinstance(node, ast.BoolOp) and isinstance(node.op, ast.And):
+            for value in node.values:
+                self._filter_columns(value, name, columns, equality, ranges)
+            return
+        if not isinstance(node, ast.Compare) or len(node.ops) != 1:
+            return
+        left = self._column(node.left, name, columns)
+        right = self._column(node.comparators[0], name, columns)
+        operator = node.ops[0]
+        if left is not None and right is None and isinstance(operator, (ast.Eq, ast.In)):
+            equality.append(left)
+        elif (left is None) != (right is None) and isinstance(operator, ast.Eq):
+            equality.append(right)
+        elif (left is None) != (right is None) and isinstance(operator, (ast.Lt, ast.LtE, ast.Gt, ast.GtE)):
+            ranges.append(left or right)
+
+    def _usages(self, expression):
+        """
+        Gets the filter and ordering columns of a query per model
+        :param expression: expression tree of the query
+        :return: tuple of (model, equality columns, range columns, ordering columns)
+        """
+        models = {}
+        nodes = [expression]
+        while len(nodes) > 0:
+            node = nodes.pop()
+            nodes.extend(node.children)
+            if not isinstance(node, (operators.WhereOperator,) + self.__orderings):
+                continue
+            model = node.type
+            t = LambdaExpression.parse(model, node.func)
+            name = t.args.args[0].id
+            body = t.body.value if isinstance(t.body, ast.Return) else t.body
+            columns = set(n for n, c in model.inspect_columns())
+            equality, ranges, orderings = models.setdefault(model, ([], [], []))
+            if isinstance(node, operators.WhereOperator):
+                self._filter_columns(body, name, columns, equality, ranges)
+            else:
+                column = self._column(body, name, columns)
+                if column is not None:
+                    # the children of a node are visited after it, i.e. in reverse order of the chain
+                    orderings.insert(0, column)
+        result = []
+        for model, (equality, ranges, orderings) in models.items():
+            equality = tuple(sorted(set(equality)))
+            result.append((
+                model,
+                equality,
+                tuple(c for c in sorted(set(ranges)) if c not in equality),
+                tuple(c for i, c in enumerate(orderings) if c not in equality and c not in orderings[:i])
+            ))
+        return tuple(result)
+
+    def _existing_indexes(self, model):
+        """
+        :return: list of the column name tuples of the indexes of a model's table, including its primary key
+        """
+        connection = self.__db_provider.connection
+        result = [tuple(n for n, c in model.inspect_columns() if c.is_primary_key)]
+        for row in connection.execute(u"PRAGMA index_list({0})".format(model.table_name())).fetchall():
+            # partial indexes only cover some rows
+            if row[4]:
+                continue
+            info = connection.execute(u"PRAGMA index_info({0})".format(row[1])).fetchall()
+            result.append(tuple(i[2] for i in sorted(info)))
+        return result
+
+    def advise_indexes(self, create=False):
+        """
+        Proposes an index for the recorded queries that no existing index supports
+        :param create: whether to create the proposed indexes
+        :return: list of dictionaries of table, columns, executions (number of recorded executions that would use
+        the index), time (seconds spent executing them), sql (statement creating the index) and created, ordered
+        by time spent
+        """
+        with self.__lock:
+            stats = dict((k, list(v)) for k, v in self.__stats.items())
+        candidates = {}
+        for (model, equality, ranges, orderings), (count, elapsed) in stats.items():
+            columns = equality + (orderings if len(orderings) > 0 else ranges[:1])
+            if len(columns) == 0:
+                continue
+            candidate = candidates.setdefault((model, columns), [0, 0.0])
+            candidate[0] += count
+            candidate[1] += elapsed
+        # an index also supports the queries using a prefix of its columns
+        for model, columns in sorted(candidates.keys(), key=lambda k: -len(k[1])):
+            longer = [
+                c for m, c in candidates.keys()
+                if m is model and len(c) > len(columns) and c[:len(columns)] == columns
+            ]
+            if len(longer) > 0:
+                count, elapsed = candidates.pop((model, columns))
+                candidates[(model, longer[0])][0] += count
+                candidates[(model, longer[0])][1] += elapsed
+        result = []
+        for (model, columns), (count, elapsed) in candidates.items():
+            if any(i[:len(columns)] == columns for i in self._existing_indexes(model)):
+                continue
+            sql = u"CREATE INDEX IF NOT EXISTS {0}_{1}_index ON {0} ({2})".format(
+                model.table_name(),
+                u"_".join(columns),
+                u", ".join(columns)
+            )
+            result.append({
+                u"table": model.table_name(),
+                u"columns": list(columns),
+                u"executions": count,
+                u"time": elapsed,
+                u"sql": sql,
+                u"created": False
+            })
+        result.sort(key=lambda r: (-r[u"time"], -r[u"executions"], r[u"sql"]))
+        if create:
+            for r in result:
+                self.__db_provider.connection.execute(r[u"sql"])
+                r[u"created"] = True
+        return result
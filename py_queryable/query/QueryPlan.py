@@ -0,0 +1,185 @@
+import re
+from ..entity.model import ModelType
+
+
+class QueryPlanNode(object):
+    """
+    A step of the plan SQLite uses to execute a query, as reported by EXPLAIN QUERY PLAN
+    """
+    __scan = re.compile(r"^SCAN (?:TABLE )?(\w+)")
+    __subquery = re.compile(r"^(?:CO-ROUTINE|MATERIALIZE) (?:SUBQUERY )?(\w+)")
+
+    def __init__(self, id, detail):
+        """
+        Default constructor
+        :param id: id of the step in the EXPLAIN QUERY PLAN output
+        :param detail: description of the step, e.g. SCAN student
+        :return: void
+        """
+        self.id = id
+        self.detail = detail
+        self.children = []
+        # set by QueryPlan once the names the statement gives its tables are known
+        self.table = None
+
+    @property
+    def scanned(self):
+        """
+        :return: name or alias of the table, subquery or common table expression the step reads every row of,
+        else None
+        """
+        match = self.__scan.match(self.detail)
+        return None if match is None else match.group(1)
+
+    @property
+    def subquery(self):
+        """
+        :return: alias of the subquery or name of the common table expression the step computes, else None
+        """
+        match = self.__subquery.match(self.detail)
+        return None if match is None else match.group(1)
+
+    @property
+    def is_full_scan(self):
+        """
+        :return: whether the step reads every row of a table
+        """
+        return self.table is not None
+
+    @property
+    def uses_temp_btree(self):
+        """
+        :return: whether the step sorts or deduplicates rows in a temporary b-tree, i.e. no index provides the
+        ORDER BY, GROUP BY or DISTINCT order
+        """
+        return u"TEMP B-TREE" in self.detail
+
+    @property
+    def uses_automatic_index(self):
+        """
+        :return: whether SQLite builds a temporary index for the step because no declared index can be used
+        """
+        return u"AUTOMATIC" in self.detail
+
+    def walk(self):
+        """
+        :return: generator of this step followed by its descendants in plan order
+        """
+        yield self
+        for child in self.children:
+            for node in child.walk():
+                yield node
+
+    def __repr__(self):
+        return u"QueryPlanNode(id={0}, detail={1})".format(self.id, self.detail)
+
+
+class QueryPlan(object):
+    """
+    Tree of the steps SQLite uses to execute a query
+    """
+    __source = re.compile(r"\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?", re.IGNORECASE)
+    __keywords = frozenset([
+        u"WHERE", u"JOIN", u"LEFT", u"INNER", u"CROSS", u"NATURAL", u"ON", u"USING", u"GROUP", u"ORDER", u"LIMIT",
+        u"HAVING", u"UNION", u"INTERSECT", u"EXCEPT", u"WINDOW", u"INDEXED", u"NOT"
+    ])
+
+    def __init__(self, sql, parameters, rows):
+        """
+        Default constructor
+        :param sql: sql statement that was explained
+        :param parameters: parameter values of the statement
+        :param rows: rows of (id, parent, notused, detail) returned by EXPLAIN QUERY PLAN
+        :return: void
+        """
+        self.sql = sql
+        self.parameters = list(parameters)
+        self.roots = []
+        nodes = {}
+        for id, parent, notused, detail in rows:
+            node = QueryPlanNode(id, detail)
+            nodes[id] = node
+            if parent in nodes:
+                nodes[parent].children.append(node)
+            else:
+                self.roots.append(node)
+        tables = self._tables(sql)
+        for root in self.roots:
+            self._resolve(root, [], tables)
+
+    @classmethod
+    def _tables(cls, sql):
+        """
+        Gets the tables a statement reads by the names it uses for them
+        :param sql: sql statement
+        :return: dictionary of table name or alias to the name of a table declared by a Model
+        """
+        result = {}
+        for table, alias in cls.__source.findall(sql):
+            if table not in ModelType.tables:
+                continue
+            result[table] = table
+            if alias and alias.upper() not in cls.__keywords:
+                result[alias] = table
+        return result
+
+    def _resolve(self, node, ancestors, tables):
+        """
+        Sets the table of the full scan steps of a subtree of the plan. A scan of a subquery or common table
+        expression is not a table scan: it has the name SQLite gives the step computing the subquery, which is not
+        an ancestor of the scan, and its alias may be used for a table inside the subquery too.
+        :param node: QueryPlanNode instance
+        :param ancestors: list of the steps containing the node
+        :param tables: dictionary returned by _tables
+        :return: void
+        """
+        name = node.scanned
+        if name is not None and name in tables:
+            subqueries = set(n.subquery for n in self.nodes if n not in ancestors)
+            if name not in subqueries:
+                node.table = tables[name]
+        for child in node.children:
+            self._resolve(child, ancestors + [node], tables)
+
+    @property
+    def nodes(self):
+        """
+        :return: list of every step of the plan in plan order
+        """
+        return [n for r in self.roots for n in r.walk()]
+
+    @property
+    def full_scans(self):
+        return [n for n in self.nodes if n.is_full_scan]
+
+    @property
+    def temp_btrees(self):
+        return [n for n in self.nodes if n.uses_temp_btree]
+
+    @property
+    def automatic_indexes(self):
+        return [n for n in self.nodes if n.uses_automatic_index]
+
+    @property
+    def warnings(self):
+        """
+        Steps that usually mean a lambda of the query is not supported by an index: full table scans, temporary
+        b-tree sorts and automatic indexes
+        :return: list of QueryPlanNode instances
+        """
+        return [n for n in self.nodes if n.is_full_scan or n.uses_temp_btree or n.uses_automatic_index]
+
+    def __str__(self):
+        lines = []
+
+        def add(node, depth):
+            lines.append(u"{0}{1}".format(u"  " * depth, node.detail))
+            for child in node.children:
+                add(child, depth + 1)
+
+        for root in self.roots:
+            add(root, 0)
+        return u"\n".join(lines)
+
+    def __repr__(self):
+        return u"QueryPlan(sql={0}, steps={1})".format(self.sql, len(self.nodes))
@@ -1,48 +1,178 @@
-from ..expressions import LambdaExpression
+import ast
+import collections
+import inspect
+import operator
+import timeit
+import types
+from contextlib import contextmanager
+from ..cache import LruCache
+from ..expressions import LambdaExpression, TableExpression
 from ..expressions import operators
-from ..entity.proxy import DynamicModelProxy
+from ..expressions.binary import JoinExpression, SetExpression
+from ..exceptions import InvalidArgumentError
+from ..visitors.lambda_visitors import QueryParameter
+from .ForeignKeyLoader import ForeignKeyLoader
 from py_linq import Enumerable
 from py_linq.exceptions import NoElementsError, NoMatchingElement, MoreThanOneMatchingElement
 
 
 class Queryable(object):
     __class_type__ = None
+    __aggregates__ = {
+        u"count": u"COUNT",
+        u"max": u"MAX",
+        u"min": u"MIN",
+        u"sum": u"SUM",
+        u"avg": u"AVG",
+        u"average": u"AVG"
+    }
 
     def __init__(self, expression, query_provider):
         self.__exp = expression
         self.__provider = query_provider
+        self.__compiled = None
+        self.__translation_time = 0.0
+        self.__hits = 0
+        self.__derived = None
 
     def __iter__(self):
-        num_cols = len(self.type.inspect_columns())
-        result_type = self.expression.type
-
-        cursor = self.provider.db_provider.connection.cursor()
-        cursor.execute(self.sql)
-        for r in cursor:
-            # if returning just one column
-            if len(r) == 1:
-                yield r[0]
-            # if returning more than one column
-            else:
-                if isinstance(list, result_type):
-                    yield Enumerable(r).select(lambda x: x[0]).to_list()
-                elif isinstance(tuple, result_type):
-                    yield tuple(Enumerable(r).select(lambda x: x[0]).to_list())
-                elif isinstance(dict, result_type):
-                    result = {}
-                    for i in range(0, len(r), 1):
-                        result.__setattr__(cursor.description[i][0], r[i])
-                    yield result
-                elif result_type == self.type and len(r) == num_cols:
-                    proxy = DynamicModelProxy(self.type)
-                    for i in range(0, len(r), 1):
-                        proxy.__setattr__(cursor.description[i][0], r[i])
-                    yield proxy
-                else:
-                    raise Exception(
-                        u"""Casting not supported.
-                        Please consider using a tuple or dict or list in lambda expression of select"""
-                    )
+        sql, parameters = self.translate()
+        return self._materialize(sql, parameters)
+
+    def _materialize(self, sql, parameters):
+        """
+        Executes SQL translated from this instance's expression and creates the results
+        :param sql: sql translated from the expression
+        :param parameters: parameter values for the ? placeholders in the sql
+        :return: generator of results
+        """
+        shape = self._result_shape()
+        loaders = None
+        if hasattr(shape, u"inspect_columns"):
+            loaders = ForeignKeyLoader.loaders(self.provider, shape)
+        elif isinstance(shape, operators.IncludeOperator):
+            loaders = ForeignKeyLoader.loaders(self.provider, shape.find(TableExpression).type)
+
+        with self._open_cursor(sql, parameters) as cursor:
+            decode = self._row_decoder(shape, cursor.description, loaders)
+            if loaders is None:
+                for r in cursor:
+                    yield decode(r)
+                return
+            pending = collections.deque()
+
+            def prefetch():
+                # the first access of a referenced entity reads the rest of the result set, so that one query loads
+                # the referenced entities of every row and not only of the rows yielded so far
+                pending.extend(decode(r) for r in cursor)
+
+            for loader in loaders.values():
+                loader.prefetch = prefetch
+            try:
+                for r in cursor:
+                    yield decode(r)
+                    while len(pending) > 0:
+                        yield pending.popleft()
+            finally:
+                for loader in loaders.values():
+                    loader.prefetch = None
+
+    def _row_decoder(self, shape, description, loaders):
+        """
+        Chooses how the rows of a result set are turned into results, once per query
+        :param shape: result shape returned by _result_shape
+        :param description: description of the cursor executing the query
+        :param loaders: ForeignKeyLoader instances of the entity's ForeignKey attributes, or None
+        :return: function of a row returning a result
+        """
+        if shape is tuple or shape is list:
+            return shape
+        if shape is dict:
+            names = [d[0] for d in description]
+            return lambda r: dict(zip(names, r))
+        if shape is None:
+            return operator.itemgetter(0)
+        row_factory = self.provider.db_provider.row_factory
+        if isinstance(shape, operators.IncludeOperator):
+            return self._include_decoder(shape, loaders, row_factory)
+        if len(description) == len(shape.inspect_columns()):
+            return row_factory(shape, loaders)
+
+        def cast(r):
+            raise Exception(
+                u"""Casting not supported.
+                Please consider using a tuple or dict or list in lambda expression of select"""
+            )
+        return cast
+
+    @staticmethod
+    def _include_decoder(expression, loaders, row_factory):
+        """
+        Creates the function creating an entity and the entities referenced by its included ForeignKey attributes
+        from one row
+        :param expression: outermost IncludeOperator of the query
+        :param loaders: ForeignKeyLoader instances of the entity's ForeignKey attributes, or None
+        :param row_factory: function of a model and loaders returning the function creating an entity from a row
+        :return: function of a row of the column values of the entity followed by the column values of each
+        included entity returning an entity
+        """
+        includes = []
+        while isinstance(expression, operators.IncludeOperator):
+            includes.insert(0, expression)
+            expression = expression.exp
+        if loaders is not None:
+            # the included attributes are not loaded on first access
+            loaders = dict((k, v) for k, v in loaders.items() if k not in [i.attribute for i in includes]) or None
+        start = len(expression.type.inspect_columns())
+        create = row_factory(expression.type, loaders)
+        related = []
+        for include in includes:
+            model = include.column.foreign_key
+            end = start + len(model.inspect_columns())
+            related.append((include.attribute, start, end, row_factory(model, None)))
+            start = end
+        width = len(expression.type.inspect_columns())
+
+        def decode(row):
+            entity = create(row[:width])
+            for attribute, first, last, create_related in related:
+                values = row[first:last]
+                # the referenced columns are NULL when the foreign key is. The entity replaces the key value without
+                # the column type check of DynamicModelProxy.__setattr__.
+                related_entity = create_related(values) if any(v is not None for v in values) else None
+                object.__setattr__(entity, attribute, related_entity)
+            return entity
+        return decode
+
+    def _result_shape(self):
+        """
+        Gets the type of the rows returned by this instance from the lambda of its nearest projection
+        :return: tuple, list or dict when the lambda returns one of them, the model type when rows are
+        entities, an IncludeOperator when rows are entities with included entities or None when rows are single
+        values
+        """
+        projection = self.expression.find(
+            (operators.SelectOperator, operators.GroupByOperator, operators.IncludeOperator, JoinExpression))
+        if projection is None:
+            return self.type
+        if isinstance(projection, operators.IncludeOperator):
+            return projection
+        func = projection.select_func if isinstance(projection, JoinExpression) else projection.func
+        if func is None:
+            return projection.type
+        t = LambdaExpression.parse(self.type, func)
+        body = t.body.value if isinstance(t.body, ast.Return) else t.body
+        if isinstance(body, ast.Tuple):
+            return tuple
+        if isinstance(body, ast.List):
+            return list
+        if isinstance(body, ast.Dict):
+            return dict
+        if isinstance(body, ast.Name) and not hasattr(body, u"sql"):
+            if isinstance(projection, JoinExpression) and body.id == t.args.args[1].id:
+                return projection.right.type
+            return projection.type
+        return None
 
     @property
     def provider(self):
@@ -58,14 +188,122 @@ class Queryable(object):
 
     @property
     def sql(self):
-        return self.provider.provider_visitor.visit(self.expression)
+        return self.translate()[0]
+
+    @property
+    def parameters(self):
+        return self.translate()[1]
+
+    @property
+    def compile_stats(self):
+        """
+        Statistics about the translation of the expression into SQL
+        :return: dictionary of translation_time (seconds spent translating), translations (number of
+        times the expression was translated) and hits (number of times the translated SQL was reused)
+        """
+        return {
+            u"translation_time": self.__translation_time,
+            u"translations": 0 if self.__compiled is None else 1,
+            u"hits": self.__hits
+        }
+
+    def translate(self):
+        """
+        Translates the expression into SQL. The SQL is translated once per instance; values captured by
+        lambdas are looked up, and collections tested for membership expanded, on every call.
+        :return: tuple of (sql, list of parameter values for the ? placeholders in the sql)
+        """
+        if self.__compiled is None:
+            start = timeit.default_timer()
+            compiled = self.provider.provider_visitor.compile(self.expression)
+            self.__translation_time = timeit.default_timer() - start
+            self.__compiled = compiled
+        else:
+            self.__hits += 1
+        sql, parameters = self.__compiled
+        visitor = self.provider.provider_visitor
+        return visitor.expand(sql, visitor.resolve(parameters))
+
+    def explain(self):
+        """
+        Gets the plan SQLite uses to execute this query, e.g. to find full table scans caused by lambdas that no
+        index supports
+        :return: QueryPlan instance
+        """
+        sql, parameters = self.translate()
+        return self.provider.db_provider.explain(sql, parameters)
+
+    def _derive(self, expression):
+        """
+        Gets a Queryable for an expression built on top of this instance's expression. Queryables are kept
+        per expression so that repeated calls such as count() reuse the translated SQL.
+        :param expression: expression with this instance's expression as its source
+        :return: Queryable instance
+        """
+        if self.__derived is None:
+            self.__derived = LruCache(maxsize=16)
+        # the structural key compares the values the lambdas captured when the key was made, and the translated
+        # SQL looks them up from its own lambdas when executed, so a Queryable is only shared by the same lambdas
+        key = (expression, tuple(id(f) for f in self._functions(expression)))
+        return self.__derived.get(key, lambda: Queryable(expression, self.provider))
+
+    @staticmethod
+    def _functions(expression):
+        """
+        Gets the lambda functions of an expression tree
+        :param expression: an expression tree
+        :return: list of functions
+        """
+        result = []
+        values = []
+        nodes = [expression]
+        while len(nodes) > 0:
+            node = nodes.pop()
+            nodes.extend(node.children)
+            values.extend(
+                getattr(node, name, None) for cls in type(node).__mro__ for name in getattr(cls, u"__slots__", ()))
+        while len(values) > 0:
+            value = values.pop()
+            if isinstance(value, types.FunctionType):
+                result.append(value)
+            elif isinstance(value, (tuple, list)):
+                values.extend(value)
+        return result
+
+    @contextmanager
+    def _open_cursor(self, sql, parameters):
+        """
+        Executes SQL translated from this instance's expression, recording the execution with the index advisor
+        of the provider when it has one
+        :param sql: sql translated from the expression
+        :param parameters: parameter values for the ? placeholders in the sql
+        :return: context manager of the cursor executing the statement
+        """
+        if any(isinstance(p, QueryParameter) for p in parameters):
+            raise InvalidArgumentError(
+                u"A compiled query function must return a Queryable instead of executing it, e.g. with count, "
+                u"first or to_list. Execute the compiled query and call these on its results.")
+        advisor = getattr(self.provider, u"index_advisor", None)
+        start = timeit.default_timer()
+        with self.provider.db_provider.open_cursor(sql, parameters) as cursor:
+            if advisor is not None:
+                advisor.record(self.expression, timeit.default_timer() - start)
+            yield cursor
+
+    def _execute_scalar(self, expression):
+        query = self._derive(expression)
+        sql, parameters = query.translate()
+        with query._open_cursor(sql, parameters) as cursor:
+            result = cursor.fetchone()
+        if result is None:
+            raise Exception(u"No scalar result from {0}".format(sql))
+        return result[0]
 
     def select(self, func):
         return Queryable(operators.SelectOperator(self.expression, func), self.provider)
 
     def count(self):
-        query = Queryable(operators.CountOperator(self.expression), self.provider)
-        return self.provider.db_provider.execute_scalar(query.sql)
+        return self._execute_scalar(operators.CountOperator(self.expression))
 
     def take(self, limit):
         return Queryable(operators.TakeOperator(self.expression, limit), self.provider)
@@ -74,29 +312,48 @@ class Queryable(object):
         return Queryable(operators.SkipOperator(self.expression, offset), self.provider)
 
     def max(self, func=None):
-        query = Queryable(operators.MaxOperator(self.expression, func), self.provider)
-        return self.provider.db_provider.execute_scalar(query.sql)
+        return self._execute_scalar(operators.MaxOperator(self.expression, func))
 
     def min(self, func=None):
-        query = Queryable(operators.MinOperator(self.expression, func), self.provider)
-        return self.provider.db_provider.execute_scalar(query.sql)
+        return self._execute_scalar(operators.MinOperator(self.expression, func))
 
     def sum(self, func=None):
-        query = Queryable(operators.SumOperator(self.expression, func), self.provider)
-        return self.provider.db_provider.execute_scalar(query.sql)
+        return self._execute_scalar(operators.SumOperator(self.expression, func))
 
     def average(self, func=None):
-        query = Queryable(operators.AveOperator(self.expression, func), self.provider)
-        return self.provider.db_provider.execute_scalar(query.sql)
+        return self._execute_scalar(operators.AveOperator(self.expression, func))
+
+    def aggregate(self, **kwargs):
+        """
+        Computes several aggregate values in one statement. Each keyword names a result and starts with the
+        aggregate function to apply (count, max, min, sum, avg or average), e.g.
+        aggregate(count=None, max_gpa=lambda s: s.gpa, avg_gpa=lambda s: s.gpa). count may be given None to
+        count every row.
+        :return: dictionary of keyword to aggregate value
+        """
+        if len(kwargs) == 0:
+            raise InvalidArgumentError(u"aggregate needs at least one keyword argument")
+        aggregates = []
+        for name in sorted(kwargs):
+            aggregate = self.__aggregates__.get(name.split(u"_")[0])
+            if aggregate is None:
+                raise InvalidArgumentError(
+                    u"{0} does not start with one of {1}".format(name, u", ".join(sorted(self.__aggregates__))))
+            if kwargs[name] is None and aggregate != u"COUNT":
+                raise InvalidArgumentError(u"lambda function is required for {0}".format(name))
+            aggregates.append((name, aggregate, kwargs[name]))
+        query = self._derive(operators.AggregateOperator(self.expression, aggregates))
+        with query._open_cursor(*query.translate()) as cursor:
+            return dict(zip([a[0] for a in aggregates], cursor.fetchone()))
 
     def any(self, func=None):
-        return self.count() > 0 if func is None else self.where(func).count() > 0
+        expression = self.expression if func is None else operators.WhereOperator(self.expression, func)
+        return bool(self._execute_scalar(operators.AnyOperator(expression)))
 
     def all(self, func=None):
         if func is None:
             return True
-        count = self.count()
-        return self.where(func).count() == count
+        return bool(self._execute_scalar(operators.AllOperator(self.expression, func)))
 
     def first(self):
         return self.take(1).as_enumerable().first()
@@ -116,8 +373,103 @@ class Queryable(object):
     def where(self, func):
         return Queryable(operators.WhereOperator(self.expression, func), self.provider)
 
+    def include(self, func):
+        """
+        Loads the entities referenced by a ForeignKey attribute in the same statement as this query's entities
+        :param func: lambda selecting the ForeignKey attribute, e.g. lambda e: e.student
+        :return: Queryable instance
+        """
+        body = LambdaExpression.parse(self.type, func).body.value
+        columns = self.type.metadata().members_by_attribute
+        if not isinstance(body, ast.Attribute) or getattr(columns.get(body.attr), u"foreign_key", None) is None:
+            raise InvalidArgumentError(u"include needs a lambda selecting a ForeignKey attribute of {0}".format(
+                self.type.__name__))
+        return Queryable(operators.IncludeOperator(self.expression, func), self.provider)
+
+    def join(self, inner, outer_key, inner_key, result_func):
+        """
+        Correlates the rows of this query with the rows of another query whose keys are equal (INNER JOIN)
+        :param inner: Queryable instance to join
+        :param outer_key: lambda selecting the key of a row of this query
+        :param inner_key: lambda selecting the key of a row of the inner query
+        :param result_func: lambda of a row of this query and a matching inner row selecting the result,
+        e.g. lambda s, e: (s.first_name, e.grade). Its argument names are used as the aliases of both sources.
+        :return: Queryable instance
+        """
+        return self._join(inner, outer_key, inner_key, result_func, u"INNER")
+
+    def group_join(self, inner, outer_key, inner_key, result_func):
+        """
+        Correlates the rows of this query with the rows of another query whose keys are equal, keeping the rows of
+        this query without a match (LEFT JOIN). The columns of the inner row are None when there is no match.
+        :param inner: Queryable instance to join
+        :param outer_key: lambda selecting the key of a row of this query
+        :param inner_key: lambda selecting the key of a row of the inner query
+        :param result_func: lambda of a row of this query and an inner row selecting the result
+        :return: Queryable instance
+        """
+        return self._join(inner, outer_key, inner_key, result_func, u"LEFT")
+
+    def _join(self, inner, outer_key, inner_key, result_func, join_type):
+        if not isinstance(inner, Queryable):
+            raise InvalidArgumentError(u"inner needs to be a Queryable instance")
+        if isinstance(inner, GroupedQueryable):
+            inner._unsupported(u"join")
+        if len(inspect.getargspec(result_func).args) != 2:
+            raise InvalidArgumentError(u"result_func needs to take an outer and an inner row")
+        return Queryable(
+            JoinExpression(self.expression, inner.expression, outer_key, inner_key, result_func, join_type),
+            self.provider
+        )
+
+    def distinct(self):
+        return Queryable(operators.DistinctOperator(self.expression), self.provider)
+
+    def union(self, inner):
+        """
+        Gets the rows of this query and another query without duplicates (UNION)
+        :param inner: Queryable instance with the same projection as this query
+        :return: Queryable instance
+        """
+        return self._set(inner, u"UNION")
+
+    def union_all(self, inner):
+        """
+        Gets the rows of this query followed by the rows of another query, keeping duplicates (UNION ALL)
+        :param inner: Queryable instance with the same projection as this query
+        :return: Queryable instance
+        """
+        return self._set(inner, u"UNION ALL")
+
+    def intersect(self, inner):
+        """
+        Gets the distinct rows of this query that are also returned by another query (INTERSECT)
+        :param inner: Queryable instance with the same projection as this query
+        :return: Queryable instance
+        """
+        return self._set(inner, u"INTERSECT")
+
+    def except_(self, inner):
+        """
+        Gets the distinct rows of this query that are not returned by another query (EXCEPT)
+        :param inner: Queryable instance with the same projection as this query
+        :return: Queryable instance
+        """
+        return self._set(inner, u"EXCEPT")
+
+    def _set(self, inner, operation):
+        if not isinstance(inner, Queryable):
+            raise InvalidArgumentError(u"inner needs to be a Queryable instance")
+        if self._result_shape() != inner._result_shape():
+            raise InvalidArgumentError(u"{0} needs queries with the same projection".format(operation))
+        return Queryable(SetExpression(self.expression, inner.expression, operation), self.provider)
+
+    def group_by(self, func):
+        return GroupedQueryable(operators.GroupByOperator(self.expression, func), self.provider)
+
     def single(self, func=None):
-        result = self.where(func).to_list() if func is not None else self.to_list()
+        # two rows are enough to tell whether there is more than one match
+        result = (self.where(func) if func is not None else self).take(2).to_list()
         count = len(result)
         if count == 0:
             raise NoMatchingElement(u"No matching elements could be found")
@@ -147,3 +499,100 @@ class OrderedQueryable(Queryable):
 
     def then_by_descending(self, func):
         return OrderedQueryable(operators.ThenByDescendingOperator(self.expression, func), self.provider)
+
+    def page_after(self, last_row):
+        """
+        Gets the rows ordered after a row of this query (keyset pagination). Unlike skip, the rows before it are
+        not read again, so every page costs the same when the ordering keys are indexed. The ordering needs to
+        be unique, e.g. end with the primary key, and its keys must not be NULL.
+        :param last_row: the last row of the previous page, an entity returned by this query
+        :return: Queryable instance
+        """
+        orderings, source = operators.SeekOperator.orderings(self.expression)
+        values = [func(last_row) for func, descending in orderings]
+        return Queryable(operators.SeekOperator(self.expression, values), self.provider)
+
+    def iter_pages(self, page_size):
+        """
+        Iterates over the rows of this query one page at a time, using page_after to get the next page
+        :param page_size: maximum number of rows per page
+        :return: generator of lists of rows
+        """
+        if page_size < 1:
+            raise InvalidArgumentError(u"page_size needs to be greater than zero")
+        page = self.take(page_size).to_list()
+        while len(page) > 0:
+            yield page
+            if len(page) < page_size:
+                return
+            page = self.page_after(page[-1]).take(page_size).to_list()
+
+
+class GroupedQueryable(Queryable):
+    """
+    Groups of a query. Iterating yields the group keys; use select to project one row per group from the key
+    and aggregates of the group, e.g. select(lambda g: (g.key, g.count(), g.max(lambda s: s.gpa))). The
+    lambdas of where, any and single may filter the groups by their key and aggregates too. The other
+    operators taking a lambda raise InvalidArgumentError; order or aggregate the projected groups instead.
+    """
+    def __init__(self, expression, query_provider):
+        super(GroupedQueryable, self).__init__(expression, query_provider)
+
+    def select(self, func):
+        return Queryable(operators.SelectOperator(self.expression, func), self.provider)
+
+    def where(self, func):
+        return GroupedQueryable(operators.HavingOperator(self.expression, func), self.provider)
+
+    def any(self, func=None):
+        return super(GroupedQueryable, self).any() if func is None else self.where(func).any()
+
+    @staticmethod
+    def _unsupported(name):
+        """
+        Raises for the operators taking a lambda of a group other than select and where, which are only
+        translated with the key and aggregates of the group when they project or filter the groups
+        :param name: name of the operator
+        :return: void
+        """
+        raise InvalidArgumentError(
+            u"{0} is not supported on groups, project the groups with select first, "
+            u"e.g. select(lambda g: {{u'key': g.key, u'count': g.count()}}).{0}(...)".format(name))
+
+    def all(self, func=None):
+        if func is None:
+            return True
+        self._unsupported(u"all")
+
+    def order_by(self, func):
+        self._unsupported(u"order_by")
+
+    def order_by_descending(self, func):
+        self._unsupported(u"order_by_descending")
+
+    def max(self, func=None):
+        self._unsupported(u"max")
+
+    def min(self, func=None):
+        self._unsupported(u"min")
+
+    def sum(self, func=None):
+        self._unsupported(u"sum")
+
+    def average(self, func=None):
+        self._unsupported(u"average")
+
+    def aggregate(self, **kwargs):
+        self._unsupported(u"aggregate")
+
+    def group_by(self, func):
+        self._unsupported(u"group_by")
+
+    def include(self, func):
+        self._unsupported(u"include")
+
+    def join(self, inner, outer_key, inner_key, result_func):
+        self._unsupported(u"join")
+
+    def group_join(self, inner, outer_key, inner_key, result_func):
+        self._unsupported(u"group_join")
@@ -1,20 +1,205 @@
+import __builtin__
 import ast
 import inspect
+import re
 from py_linq import Enumerable
 from collections import deque
 
 
-class SqlLambdaTranslator(ast.NodeVisitor):
+def rebind(sql, name, alias):
+    """
+    Renames the lambda argument used in the sql of a translated lambda
+    :param sql: sql of a translated lambda
+    :param name: name of the lambda argument
+    :param alias: new name
+    :return: sql
+    """
+    if name == alias:
+        return sql
+    return re.sub(r"(?<![\w.]){0}\.".format(re.escape(name)), u"{0}.".format(alias), sql)
+
+
+def is_collection(value):
+    """
+    Checks whether a value is a collection to test membership in, e.g. a list, set or Queryable, rather than a
+    string to test for a substring
+    :param value: value captured by a lambda
+    :return: boolean
+    """
+    return not isinstance(value, basestring) and hasattr(value, u"__iter__")
+
+
+class QueryParameter(object):
+    """
+    Placeholder for an argument of a compiled query. It is captured by the lambdas of the query in place of
+    a value and bound to the argument's value each time the compiled query is called.
+    """
+
+    def __init__(self, name, attr=None, template=None):
+        self.name = name
+        self.attr = attr
+        self.template = template
+
+    def bind(self, value):
+        """
+        Gets the parameter value for a given argument value
+        :param value: value of the compiled query argument
+        :return: parameter value
+        """
+        if self.attr is not None:
+            value = getattr(value, self.attr)
+        if self.template is not None:
+            value = self.template.format(value)
+        return value
+
+    def __repr__(self):
+        return u"QueryParameter(name={0})".format(self.name)
+
+
+class CapturedValue(object):
+    """
+    Placeholder for a value captured by a lambda from its closure, default arguments, globals or builtins.
+    The value is looked up every time the lambda is bound so a translated tree can be shared between
+    closures of the same code object.
+    """
+
+    def __init__(self, name, attr=None, template=None):
+        self.name = name
+        self.attr = attr
+        self.template = template
+
+    def resolve(self, func):
+        """
+        Gets the current value of the captured variable
+        :param func: the lambda function that captured the variable
+        :return: value
+        """
+        value = CapturedValue.lookup(func, self.name)
+        if isinstance(value, QueryParameter):
+            return QueryParameter(value.name, self.attr, self.template)
+        if self.attr is not None:
+            value = getattr(value, self.attr)
+        if self.template is not None:
+            value = self.template.format(value)
+        return value
+
+    @staticmethod
+    def lookup(func, name):
+        code = func.__code__
+        if name in code.co_freevars:
+            return func.__closure__[code.co_freevars.index(name)].cell_contents
+        arg_names = code.co_varnames[:code.co_argcount]
+        defaults = func.__defaults__ or ()
+        if name in arg_names[len(arg_names) - len(defaults):]:
+            return defaults[arg_names.index(name) - len(arg_names) + len(defaults)]
+        if name in func.__globals__:
+            return func.__globals__[name]
+        builtins = func.__globals__.get(u"__builtins__", __builtin__)
+        builtins = builtins if isinstance(builtins, dict) else builtins.__dict__
+        if name in builtins:
+            return builtins[name]
+        raise NameError(u"name '{0}' is not defined".format(name))
+
+    def __repr__(self):
+        return u"CapturedValue(name={0}, attr={1})".format(self.name, self.attr)
+
+
+class DeferredValue(object):
+    """
+    A value captured by a specific lambda function that is looked up when a statement is executed rather
+    than when it is translated
+    """
+    __slots__ = ('captured', 'func')
+
+    def __init__(self, captured, func):
+        self.captured = captured
+        self.func = func
+
+    def resolve(self):
+        return self.captured.resolve(self.func)
+
 
-    def __init__(self):
+class SqlLambdaTranslator(ast.NodeVisitor):
+    """
+    Adds sql and params attributes to the nodes of a decompiled lambda. Literals and values captured
+    from the enclosing scope are written as ? placeholders and listed in params in the same order as
+    the placeholders appear in sql. Captured values are listed as CapturedValue instances.
+
+    Membership tests of a column in a list or tuple literal are translated to IN lists. Membership tests in
+    a captured collection or Queryable, e.g. s.student_id in ids, are translated to IN ? where the placeholder
+    is expanded by SqlVisitor.expand once the collection is known. Other membership tests are substring tests.
+
+    Calls of count, max, min, sum and average on a lambda argument, e.g. g.max(lambda s: s.gpa), are
+    translated to SQL aggregate functions over the argument, e.g. MAX(g.gpa), for lambdas over groups.
+    """
+    __aggregates = {
+        u"count": u"COUNT",
+        u"max": u"MAX",
+        u"min": u"MIN",
+        u"sum": u"SUM",
+        u"average": u"AVG",
+        u"avg": u"AVG"
+    }
+
+    def __init__(self, func=None):
+        """
+        Default constructor
+        :param func: the lambda function that was decompiled. The decompiled tree does not include default
+        argument values, so they are counted from the function itself.
+        :return: void
+        """
         super(SqlLambdaTranslator, self).__init__()
+        self._arg_names = set()
+        self._func = func
+        self._num_defaults = len(func.__defaults__ or ()) if func is not None else 0
 
     def __flatten_node_properties(self, node, attribute):
         self.generic_visit(node)
         attr_node = getattr(node, attribute)
         members = attr_node.__dict__.keys()
         for a in members:
-            setattr(node, a, getattr(attr_node, a))
+            # keep the flattened node itself, e.g. the value of an Attribute would replace the Return's value
+            if a != attribute:
+                setattr(node, a, getattr(attr_node, a))
+
+    @staticmethod
+    def __params(*nodes):
+        result = []
+        for n in nodes:
+            result.extend(getattr(n, u"params", []))
+        return result
+
+    @staticmethod
+    def _is_constant(node):
+        return getattr(node, u"is_constant", False)
+
+    def __set_constant(self, node, value):
+        node.sql = u"?"
+        node.params = [value]
+        node.is_constant = True
+
+    def _is_captured(self, node):
+        return isinstance(node, ast.Name) and node.id not in self._arg_names
+
+    def _is_captured_collection(self, node):
+        """
+        Checks whether a translated node is a captured collection. Translated trees are cached by the types of
+        the captured values, so the value found now has the same type as the values the tree is bound to. An
+        argument of a compiled query is a collection, as the value it is bound to is only known when the query is
+        called.
+        :param node: translated node
+        :return: boolean
+        """
+        if self._func is None or not isinstance(node, (ast.Name, ast.Attribute)) or not self._is_constant(node):
+            return False
+        captured = node.params[0]
+        if not isinstance(captured, CapturedValue) or captured.template is not None:
+            return False
+        try:
+            value = captured.resolve(self._func)
+            return isinstance(value, QueryParameter) or is_collection(value)
+        except (NameError, AttributeError, ValueError):
+            return False
 
     def find_node_type(self, start_node, node_type, children_attr):
         if isinstance(start_node, node_type):
@@ -62,10 +247,21 @@ class SqlLambdaTranslator(ast.NodeVisitor):
         node.sql = u"%"
 
     def visit_Num(self, node):
-        node.sql = node.n
+        self.__set_constant(node, node.n)
 
     def visit_Str(self, node):
-        node.sql = unicode(node.s)
+        self.__set_constant(node, unicode(node.s))
+
+    def visit_Name(self, node):
+        if self._is_captured(node):
+            self.__set_constant(node, CapturedValue(node.id))
+
+    def visit_arguments(self, node):
+        # arguments with default values are captured values rather than rows
+        num_defaults = max(len(node.defaults), self._num_defaults)
+        self._num_defaults = 0
+        for arg in node.args[:len(node.args) - num_defaults]:
+            self._arg_names.add(arg.id)
 
     def visit_In(self, node):
         node.sql = u"IN"
@@ -76,7 +272,11 @@ class SqlLambdaTranslator(ast.NodeVisitor):
         node.text_sql = u"NOT LIKE"
 
     def visit_Attribute(self, node):
+        if self._is_captured(node.value):
+            self.__set_constant(node, CapturedValue(node.value.id, node.attr))
+            return
         node.sql = u"{0}.{1}".format(node.value.id, node.attr)
+        node.params = []
         node.id = node.value.id
 
     def visit_And(self, node):
@@ -90,34 +290,45 @@ class SqlLambdaTranslator(ast.NodeVisitor):
 
     def visit_Compare(self, node):
         self.generic_visit(node)
-
-        operator = node.ops[0].sql
-        if operator == "IN":
-            if isinstance(node.left, ast.Str):
-                node.id = node.comparators[0].id
-                node.sql = u"{0} {1} '%{2}%'".format(node.comparators[0].sql, node.ops[0].text_sql, node.left.sql)
-            elif isinstance(node.left, unicode) and isinstance(node.comparators[0], unicode):
-                node.sql = u"{0} {1} '%{2}%'".format(node.comparators[0], node.ops[0].text_sql, node.left)
-            elif isinstance(node.left, unicode) and isinstance(node.comparators[0], ast.Attribute):
-                node.id = node.comparators[0].id
-                node.sql = u"{0} {1} '%{2}%'".format(node.comparators[0].sql, node.ops[0].text_sql, node.left)
-            elif isinstance(node.left, ast.Attribute) and isinstance(node.comparators[0], unicode):
-                node.id = node.left.id
-                node.sql = u"{0} {1} '%{2}%'".format(node.left.sql, node.ops[0].sql, node.comparators[0])
-            elif isinstance(node.left, ast.Attribute) and isinstance(node.comparators[0], ast.Str):
-                node.id = node.left.id
-                node.sql = u"{0} {1} '%{2}%'".format(node.left.sql, node.ops[0].sql, node.comparators[0].sql)
+        left = node.left
+        right = node.comparators[0]
+        operator = node.ops[0]
+        if operator.sql in (u"IN", u"NOT IN"):
+            if not self._is_constant(left) and isinstance(right, (ast.List, ast.Tuple)):
+                # membership in a literal list, e.g. s.student_id in [1, 2]
+                node.id = getattr(left, u"id", None)
+                node.sql = u"{0} {1} ({2})".format(left.sql, operator.sql, right.sql)
+                node.params = self.__params(left, right)
+            elif not self._is_constant(left) and self._is_captured_collection(right):
+                # membership in a captured collection or query, e.g. s.student_id in ids
+                node.id = getattr(left, u"id", None)
+                node.sql = u"{0} {1} ?".format(left.sql, operator.sql)
+                node.params = self.__params(left, right)
+            elif self._is_constant(left) and isinstance(right, ast.Attribute) and not self._is_constant(right):
+                # substring test on a column, e.g. u"k" in s.last_name
+                node.id = right.id
+                node.sql = u"{0} {1} ?".format(right.sql, operator.text_sql)
+                value = left.params[0]
+                if isinstance(value, CapturedValue):
+                    node.params = [CapturedValue(value.name, value.attr, u"%{0}%")]
+                else:
+                    node.params = [u"%{0}%".format(value)]
+            elif isinstance(left, ast.Attribute) and not self._is_constant(left) and self._is_constant(right):
+                # column is a substring of a given value, e.g. s.last_name in u"Fenske"
+                node.id = left.id
+                node.sql = u"instr(?, {0}) {1} 0".format(left.sql, u">" if operator.sql == u"IN" else u"=")
+                node.params = self.__params(right, left)
             else:
                 raise Exception(u"Don't know what to do with this node={0} for the IN operator".format(node.__repr__()))
         else:
-            node.id = node.left.id
-            if hasattr(node.comparators[0], u"sql"):
-                comparator = node.comparators[0].sql if not isinstance(node.comparators[0].sql, unicode) else "'{0}'".format(node.comparators[0].sql)
-            elif isinstance(node.comparators[0], unicode):
-                comparator = u"'{0}'".format(node.comparators[0])
-            else:
-                comparator = node.comparators[0]
-            node.sql = u"{0} {1} {2}".format(node.left.sql, node.ops[0].sql, comparator)
+            node.id = left.id if hasattr(left, u"id") else getattr(right, u"id", None)
+            operator_sql = operator.sql
+            if self._is_constant(left) or self._is_constant(right):
+                # null safe equality operators, so a comparison with a value selects the rows it does in Python
+                # whether the value is a literal or captured, and a captured value may be None
+                operator_sql = {u"=": u"IS", u"<>": u"IS NOT"}.get(operator_sql, operator_sql)
+            node.sql = u"{0} {1} {2}".format(left.sql, operator_sql, right.sql)
+            node.params = self.__params(left, right)
 
     def visit_BoolOp(self, node):
         self.generic_visit(node)
@@ -129,10 +340,12 @@ class SqlLambdaTranslator(ast.NodeVisitor):
         node.sql = u" {0} ".format(node.op.sql).join(
             vals.select(lambda v: u"({0})".format(v.sql) if isinstance(v, ast.BoolOp) else v.sql)
         )
+        node.params = self.__params(*node.values)
 
     def visit_BinOp(self, node):
         self.generic_visit(node)
         node.sql = u"{0} {1} {2}".format(node.left.sql, node.op.sql, node.right.sql)
+        node.params = self.__params(node.left, node.right)
 
     def visit_Not(self, node):
         node.sql = u"NOT"
@@ -143,14 +356,38 @@ class SqlLambdaTranslator(ast.NodeVisitor):
     def visit_UnaryOp(self, node):
         self.generic_visit(node)
         node.sql = u"{0} {1}".format(node.op.sql, node.operand.sql)
+        node.params = self.__params(node.operand)
 
     def visit_Lambda(self, node):
         self.__flatten_node_properties(node, u"body")
 
+    def visit_Call(self, node):
+        self.generic_visit(node)
+        func = node.func
+        if not isinstance(func, ast.Attribute) or self._is_constant(func) \
+                or func.attr not in self.__aggregates or len(node.args) > 1:
+            raise Exception(u"Don't know what to do with this node={0}".format(ast.dump(node)))
+        aggregate = self.__aggregates[func.attr]
+        node.id = func.value.id
+        node.params = []
+        if len(node.args) == 0:
+            if aggregate != u"COUNT":
+                raise Exception(u"{0} needs a lambda expression".format(func.attr))
+            node.sql = u"COUNT(*)"
+            return
+        selector = node.args[0]
+        sql = rebind(selector.sql, selector.args.args[0].id, node.id)
+        node.params = self.__params(selector)
+        if aggregate == u"COUNT":
+            node.sql = u"COUNT(CASE WHEN {0} THEN 1 END)".format(sql)
+        else:
+            node.sql = u"{0}({1})".format(aggregate, sql)
+
     def visit_List(self, node):
         self.generic_visit(node)
         node.sql = u", ".join(Enumerable(node.elts).select(lambda x: x.sql))
-        node.id = node.elts[0].value.id
+        node.params = self.__params(*node.elts)
+        node.id = next((e.id for e in node.elts if hasattr(e, u"id")), None)
 
     def visit_Tuple(self, node):
         self.visit_List(node)
@@ -161,4 +398,5 @@ class SqlLambdaTranslator(ast.NodeVisitor):
         for i in range(len(node.values)):
             result.append(u"{0} AS '{1}'".format(node.values[i].sql, node.keys[i].s))
         node.sql = u", ".join(result)
+        node.params = self.__params(*node.values)
         node.id = node.values[0].id
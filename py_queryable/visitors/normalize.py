@@ -0,0 +1,209 @@
+from ..expressions import TableExpression
+from ..expressions import operators
+from ..expressions.binary import JoinExpression, SetExpression
+from . import Visitor
+
+
+class NormalizeVisitor(Visitor):
+    """
+    Rewrites an expression tree into the canonical form expected by SqlVisitor. The given tree is left
+    untouched and a new tree is returned where:
+        - Where, OrderBy, Any, All, Aggregate, GroupBy and Distinct operators always have a SelectOperator in
+          their source
+        - Having operators always follow a GroupBy or another Having operator
+        - Seek operators always follow an OrderBy, OrderByDescending, ThenBy or ThenByDescending operator
+        - both sources of a Join are tables or have a SelectOperator
+        - both sources of a Set expression have a SelectOperator
+        - Include operators always have a SelectOperator in their source
+        - Skip operators always wrap a Take operator (LIMIT -1 when no limit was given)
+        - Take operators never wrap a Skip operator
+        - aggregate operators always have a lambda and a SelectOperator source
+    Canonical trees are returned unchanged by this visitor.
+    """
+
+    @staticmethod
+    def _ensure_select(expression):
+        if expression.find(operators.SelectOperator) is None:
+            return operators.SelectOperator(expression)
+        return expression
+
+    @staticmethod
+    def _subquery(expression):
+        """
+        Wraps an expression that already has a LIMIT or OFFSET so that another one can be applied to it
+        :param expression: canonical expression
+        :return: SelectOperator selecting every column from the expression
+        """
+        return operators.SelectOperator(operators.AliasOperator(expression.type.table_name(), expression))
+
+    def _visit_filter(self, expression):
+        exp = self._ensure_select(expression.exp.visit(self))
+        if exp is expression.exp:
+            return expression
+        return expression.__class__(exp, expression.func)
+
+    def _visit_aggregate(self, expression):
+        exp = expression.exp.visit(self)
+        func = expression.func
+        # the distinct values of a projection, e.g. select(lambda s: s.gpa).distinct().sum(), are aggregated by
+        # the projection lambda with the DistinctOperator kept
+        distinct = func is None and isinstance(exp, operators.DistinctOperator)
+        if func is None:
+            source = exp.exp if distinct else exp
+            if not isinstance(source, operators.SelectOperator) or source.func is None:
+                raise AttributeError("lambda function is required for SelectOperator")
+            func = source.func
+        if not isinstance(exp, operators.SelectOperator) and not distinct:
+            exp = operators.SelectOperator(exp, func)
+        if exp is expression.exp and func is expression.func:
+            return expression
+        return expression.__class__(exp, func)
+
+    def visit_TableExpression(self, expression):
+        return expression
+
+    def visit_FlatSelectOperator(self, expression):
+        return expression
+
+    def visit_SelectOperator(self, expression):
+        exp = expression.exp.visit(self)
+        if exp is expression.exp:
+            return expression
+        return operators.SelectOperator(exp, expression.func)
+
+    def visit_AliasOperator(self, expression):
+        exp = expression.exp.visit(self)
+        if exp is expression.exp:
+            return expression
+        return operators.AliasOperator(expression.alias, exp)
+
+    def visit_CountOperator(self, expression):
+        exp = expression.exp.visit(self)
+        if exp is expression.exp:
+            return expression
+        return operators.CountOperator(exp)
+
+    def visit_WhereOperator(self, expression):
+        return self._visit_filter(expression)
+
+    def visit_OrderByOperator(self, expression):
+        return self._visit_filter(expression)
+
+    def visit_OrderByDescendingOperator(self, expression):
+        return self._visit_filter(expression)
+
+    def visit_AnyOperator(self, expression):
+        exp = self._ensure_select(expression.exp.visit(self))
+        if exp is expression.exp:
+            return expression
+        return operators.AnyOperator(exp)
+
+    def visit_DistinctOperator(self, expression):
+        exp = self._ensure_select(expression.exp.visit(self))
+        if exp is expression.exp:
+            return expression
+        return operators.DistinctOperator(exp)
+
+    def visit_AggregateOperator(self, expression):
+        exp = self._ensure_select(expression.exp.visit(self))
+        if exp is expression.exp:
+            return expression
+        return operators.AggregateOperator(exp, expression.aggregates)
+
+    def visit_AllOperator(self, expression):
+        return self._visit_filter(expression)
+
+    def visit_IncludeOperator(self, expression):
+        return self._visit_filter(expression)
+
+    def visit_GroupByOperator(self, expression):
+        return self._visit_filter(expression)
+
+    def visit_HavingOperator(self, expression):
+        if not isinstance(expression.exp, (operators.GroupByOperator, operators.HavingOperator)):
+            raise AttributeError("Having needs to follow GroupBy")
+        exp = expression.exp.visit(self)
+        if exp is expression.exp:
+            return expression
+        return operators.HavingOperator(exp, expression.func)
+
+    def visit_ThenByOperator(self, expression):
+        if not isinstance(expression.exp, (
+                operators.OrderByOperator,
+                operators.OrderByDescendingOperator,
+                operators.ThenByOperator,
+                operators.ThenByDescendingOperator)):
+            raise AttributeError("ThenBy needs to follow OrderBy or OrderByDescending")
+        exp = expression.exp.visit(self)
+        if exp is expression.exp:
+            return expression
+        return expression.__class__(exp, expression.func)
+
+    def visit_ThenByDescendingOperator(self, expression):
+        return self.visit_ThenByOperator(expression)
+
+    def visit_SeekOperator(self, expression):
+        operators.SeekOperator.orderings(expression.exp)
+        exp = expression.exp.visit(self)
+        if exp is expression.exp:
+            return expression
+        return operators.SeekOperator(exp, expression.values)
+
+    def visit_TakeOperator(self, expression):
+        exp = expression.exp.visit(self)
+        if isinstance(exp, operators.SkipOperator):
+            if exp.exp.limit != -1:
+                return operators.TakeOperator(self._subquery(exp), expression.limit)
+            return operators.SkipOperator(operators.TakeOperator(exp.exp.exp, expression.limit), exp.skip)
+        if isinstance(exp, operators.TakeOperator):
+            return operators.TakeOperator(self._subquery(exp), expression.limit)
+        exp = self._ensure_select(exp)
+        if exp is expression.exp:
+            return expression
+        return operators.TakeOperator(exp, expression.limit)
+
+    def visit_SkipOperator(self, expression):
+        exp = expression.exp.visit(self)
+        if isinstance(exp, operators.SkipOperator):
+            exp = self._subquery(exp)
+        if isinstance(exp, operators.TakeOperator):
+            if exp is expression.exp:
+                return expression
+            return operators.SkipOperator(exp, expression.skip)
+        return operators.SkipOperator(operators.TakeOperator(self._ensure_select(exp), -1), expression.skip)
+
+    def visit_MaxOperator(self, expression):
+        return self._visit_aggregate(expression)
+
+    def visit_MinOperator(self, expression):
+        return self._visit_aggregate(expression)
+
+    def visit_SumOperator(self, expression):
+        return self._visit_aggregate(expression)
+
+    def visit_AveOperator(self, expression):
+        return self._visit_aggregate(expression)
+
+    def visit_JoinExpression(self, expression):
+        left, right = expression.left.visit(self), expression.right.visit(self)
+        if not isinstance(left, TableExpression):
+            left = self._ensure_select(left)
+        if not isinstance(right, TableExpression):
+            right = self._ensure_select(right)
+        if left is expression.left and right is expression.right:
+            return expression
+        return JoinExpression(
+            left,
+            right,
+            expression.outer_key,
+            expression.inner_key,
+            expression.select_func,
+            expression.join_type
+        )
+
+    def visit_SetExpression(self, expression):
+        left = self._ensure_select(expression.left.visit(self))
+        right = self._ensure_select(expression.right.visit(self))
+        if left is expression.left and right is expression.right:
+            return expression
+        return SetExpression(left, right, expression.operation)
@@ -0,0 +1,249 @@
+import ast
+from ..expressions import LambdaExpression, TableExpression
+from ..expressions import operators
+from ..expressions.binary import JoinExpression, SetExpression
+from . import Visitor
+
+
+class OptimizeVisitor(Visitor):
+    """
+    Rewrites a canonical expression tree (see NormalizeVisitor) into an equivalent tree that translates
+    into fewer nested SELECT statements. Chains of Select, Where, OrderBy, ThenBy, Take and Skip over a
+    table are merged into a single FlatSelectOperator: consecutive Where predicates are combined with AND
+    and ordering, limit and offset are applied to the same statement. A chain is only merged while the
+    result is unchanged, i.e. no filter or ordering is applied after a limit and the projection only
+    selects table columns under their own names. Count and the other aggregates over such a statement are
+    computed by the statement itself, selecting only the aggregated column and dropping its ordering. A Seek
+    of an ordered statement becomes a condition on the ordering keys of the same statement. Any
+    and All become EXISTS tests of the statement limited to one row. GroupBy and Aggregate operators select
+    directly from such a statement. Distinct selects the statement's projection without duplicates.
+    """
+
+    @staticmethod
+    def _selects_columns(expression):
+        """
+        Checks whether the projection of a FlatSelectOperator keeps the table's column names
+        :param expression: FlatSelectOperator instance
+        :return: boolean
+        """
+        if expression.func is None:
+            return True
+        body = LambdaExpression.parse(expression.type, expression.func).body
+        body = body.value if isinstance(body, ast.Return) else body
+        elements = body.elts if isinstance(body, (ast.Tuple, ast.List)) else [body]
+        for e in elements:
+            if isinstance(e, ast.Attribute) and not getattr(e, u"is_constant", False):
+                continue
+            if isinstance(e, ast.Name) and not hasattr(e, u"sql"):
+                continue
+            return False
+        return True
+
+    def _can_extend(self, expression):
+        return isinstance(expression, operators.FlatSelectOperator)\
+            and expression.limit is None\
+            and expression.offset is None\
+            and expression.after is None\
+            and self._selects_columns(expression)
+
+    @staticmethod
+    def _source(expression):
+        if isinstance(expression, operators.AliasOperator):
+            return expression.exp
+        return expression
+
+    @staticmethod
+    def _rebuild(expression, exp, *args):
+        if exp is expression.exp:
+            return expression
+        return expression.__class__(exp, *args)
+
+    def visit_TableExpression(self, expression):
+        return expression
+
+    def visit_FlatSelectOperator(self, expression):
+        return expression
+
+    def visit_AliasOperator(self, expression):
+        exp = expression.exp.visit(self)
+        if exp is expression.exp:
+            return expression
+        return operators.AliasOperator(expression.alias, exp)
+
+    def visit_SelectOperator(self, expression):
+        exp = expression.exp.visit(self)
+        source = self._source(exp)
+        if isinstance(source, TableExpression):
+            return operators.FlatSelectOperator(source, expression.func)
+        if isinstance(source, operators.FlatSelectOperator) and source.func is None\
+                and source.limit is None and source.offset is None and not source.distinct:
+            return source.replace(func=expression.func)
+        return self._rebuild(expression, exp, expression.func)
+
+    def visit_WhereOperator(self, expression):
+        exp = expression.exp.visit(self)
+        if self._can_extend(exp):
+            return exp.replace(predicates=exp.predicates + ((expression.func, False),))
+        return self._rebuild(expression, exp, expression.func)
+
+    def _visit_order_by(self, expression, descending):
+        exp = expression.exp.visit(self)
+        if self._can_extend(exp):
+            return exp.replace(orderings=((expression.func, descending),))
+        return self._rebuild(expression, exp, expression.func)
+
+    def _visit_then_by(self, expression, descending):
+        exp = expression.exp.visit(self)
+        if isinstance(exp, operators.FlatSelectOperator) and len(exp.orderings) > 0 and exp.limit is None:
+            return exp.replace(orderings=exp.orderings + ((expression.func, descending),))
+        return self._rebuild(expression, exp, expression.func)
+
+    def visit_OrderByOperator(self, expression):
+        return self._visit_order_by(expression, False)
+
+    def visit_OrderByDescendingOperator(self, expression):
+        return self._visit_order_by(expression, True)
+
+    def visit_ThenByOperator(self, expression):
+        return self._visit_then_by(expression, False)
+
+    def visit_ThenByDescendingOperator(self, expression):
+        return self._visit_then_by(expression, True)
+
+    def visit_SeekOperator(self, expression):
+        exp = expression.exp.visit(self)
+        if isinstance(exp, operators.FlatSelectOperator) and len(exp.orderings) == len(expression.values)\
+                and exp.limit is None and exp.offset is None and exp.aggregate is None and exp.after is None:
+            return exp.replace(after=expression.values)
+        return self._rebuild(expression, exp, expression.values)
+
+    def visit_TakeOperator(self, expression):
+        exp = expression.exp.visit(self)
+        if isinstance(exp, operators.FlatSelectOperator) and exp.limit is None and exp.offset is None:
+            return exp.replace(limit=expression.limit)
+        return self._rebuild(expression, exp, expression.limit)
+
+    def visit_SkipOperator(self, expression):
+        exp = expression.exp.visit(self)
+        if isinstance(exp, operators.FlatSelectOperator) and exp.limit is not None and exp.offset is None:
+            return exp.replace(offset=expression.skip)
+        return self._rebuild(expression, exp, expression.skip)
+
+    @staticmethod
+    def _can_aggregate(expression):
+        return isinstance(expression, operators.FlatSelectOperator)\
+            and expression.limit is None\
+            and expression.offset is None\
+            and expression.aggregate is None\
+            and expression.after is None\
+            and not expression.distinct
+
+    def _visit_aggregate(self, expression, aggregate):
+        exp = expression.exp.visit(self)
+        if self._can_aggregate(exp) and (exp.func is expression.func or self._selects_columns(exp)):
+            return exp.replace(func=expression.func, orderings=(), aggregate=aggregate)
+        if isinstance(exp, operators.FlatSelectOperator) and exp.distinct and exp.func is expression.func\
+                and self._can_aggregate(exp.replace(distinct=False)):
+            # aggregate of the distinct values of the projection, e.g. SUM(DISTINCT s.gpa)
+            return exp.replace(orderings=(), aggregate=aggregate)
+        return self._rebuild(expression, exp, expression.func)
+
+    def visit_CountOperator(self, expression):
+        exp = expression.exp.visit(self)
+        if isinstance(exp, TableExpression):
+            return operators.FlatSelectOperator(exp, aggregate=u"COUNT")
+        if self._can_aggregate(exp):
+            return exp.replace(func=None, orderings=(), aggregate=u"COUNT")
+        return self._rebuild(expression, exp)
+
+    def visit_DistinctOperator(self, expression):
+        exp = expression.exp.visit(self)
+        if isinstance(exp, operators.FlatSelectOperator) and exp.limit is None and exp.offset is None\
+                and exp.aggregate is None:
+            return exp.replace(distinct=True)
+        return self._rebuild(expression, exp)
+
+    def visit_AnyOperator(self, expression):
+        exp = expression.exp.visit(self)
+        if self._can_aggregate(exp):
+            return exp.replace(func=None, orderings=(), limit=1, aggregate=u"EXISTS")
+        return self._rebuild(expression, exp)
+
+    def visit_AllOperator(self, expression):
+        exp = expression.exp.visit(self)
+        if self._can_extend(exp) and exp.aggregate is None:
+            return exp.replace(
+                func=None,
+                predicates=exp.predicates + ((expression.func, True),),
+                orderings=(),
+                limit=1,
+                aggregate=u"NOT EXISTS"
+            )
+        return self._rebuild(expression, exp, expression.func)
+
+    def visit_AggregateOperator(self, expression):
+        exp = expression.exp.visit(self)
+        if self._can_aggregate(exp) and self._selects_columns(exp):
+            # SqlVisitor selects the aggregates directly from a source without projection
+            return operators.AggregateOperator(exp.replace(func=None, orderings=()), expression.aggregates)
+        return self._rebuild(expression, exp, expression.aggregates)
+
+    def visit_GroupByOperator(self, expression):
+        exp = expression.exp.visit(self)
+        if self._can_aggregate(exp) and self._selects_columns(exp):
+            # SqlVisitor groups the rows of a source without projection in the same statement
+            return operators.GroupByOperator(exp.replace(func=None, orderings=()), expression.func)
+        return self._rebuild(expression, exp, expression.func)
+
+    def visit_HavingOperator(self, expression):
+        return self._rebuild(expression, expression.exp.visit(self), expression.func)
+
+    def visit_MaxOperator(self, expression):
+        return self._visit_aggregate(expression, u"MAX")
+
+    def visit_MinOperator(self, expression):
+        return self._visit_aggregate(expression, u"MIN")
+
+    def visit_SumOperator(self, expression):
+        return self._visit_aggregate(expression, u"SUM")
+
+    def visit_AveOperator(self, expression):
+        return self._visit_aggregate(expression, u"AVG")
+
+    @staticmethod
+    def _table(expression):
+        """
+        Gets the table of a FlatSelectOperator that selects every row and column of it
+        :param expression: expression
+        :return: TableExpression or the given expression
+        """
+        if isinstance(expression, operators.FlatSelectOperator) and expression.func is None\
+                and len(expression.predicates) == 0 and len(expression.orderings) == 0\
+                and expression.limit is None and expression.offset is None and expression.aggregate is None\
+                and expression.after is None and not expression.distinct:
+            return expression.exp
+        return expression
+
+    def visit_IncludeOperator(self, expression):
+        return self._rebuild(expression, self._table(expression.exp.visit(self)), expression.func)
+
+    def visit_JoinExpression(self, expression):
+        left = self._table(expression.left.visit(self))
+        right = self._table(expression.right.visit(self))
+        if left is expression.left and right is expression.right:
+            return expression
+        return JoinExpression(
+            left,
+            right,
+            expression.outer_key,
+            expression.inner_key,
+            expression.select_func,
+            expression.join_type
+        )
+
+    def visit_SetExpression(self, expression):
+        left = expression.left.visit(self)
+        right = expression.right.visit(self)
+        if left is expression.left and right is expression.right:
+            return expression
+        return SetExpression(left, right, expression.operation)
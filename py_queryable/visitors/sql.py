@@ -1,125 +1,552 @@
 import ast
+import re
 from py_linq import Enumerable
 from ..expressions import LambdaExpression, TableExpression
 from ..expressions import operators
+from ..expressions.binary import SetExpression
+from ..exceptions import InvalidArgumentError
 from . import Visitor
+from .lambda_visitors import DeferredValue, QueryParameter, rebind, is_collection
+from .normalize import NormalizeVisitor
+from .optimize import OptimizeVisitor
+
+
+class CollectionParameter(object):
+    """
+    Values of a collection tested for membership that are too many to be bound one by one. The database
+    provider binds them as a single JSON array that the statement reads with json_each, so executing a query
+    never writes to the database.
+    """
+    __slots__ = ('values',)
+
+    def __init__(self, values):
+        self.values = values
+
+    def __repr__(self):
+        return u"CollectionParameter(values={0})".format(len(self.values))
 
 
 class SqlVisitor(Visitor):
+    """
+    Translates an expression tree into a parameterized SQL statement. Each visit method returns a tuple of
+    sql and the list of parameter values for the ? placeholders in that sql. The visit methods expect a
+    tree in the canonical form produced by NormalizeVisitor and never modify it.
+    """
+    # largest collection tested for membership with a list of placeholders, see expand
+    max_in_parameters = 500
+
+    def __init__(self, optimize=False):
+        """
+        Default constructor
+        :param optimize: rewrite expression trees with OptimizeVisitor before translating them
+        :return: void
+        """
+        self._normalizer = NormalizeVisitor()
+        self._optimizer = OptimizeVisitor() if optimize else None
+
+    def visit(self, expression):
+        return self.translate(expression)[0]
+
+    def translate(self, expression):
+        """
+        Translates an expression tree into SQL
+        :param expression: an expression tree
+        :return: tuple of (sql, list of parameter values)
+        """
+        sql, parameters = self.compile(expression)
+        return self.expand(sql, self.resolve(parameters))
+
+    def compile(self, expression):
+        """
+        Translates an expression tree into SQL without looking up the values captured by its lambdas
+        :param expression: an expression tree
+        :return: tuple of (sql, list of parameter values and DeferredValue instances)
+        """
+        expression = self.normalize(expression)
+        if self._optimizer is not None:
+            expression = expression.visit(self._optimizer)
+        return expression.visit(self)
+
+    @staticmethod
+    def resolve(parameters):
+        """
+        Looks up the current values of the captured values in a compiled parameter list
+        :param parameters: list of parameter values and DeferredValue instances
+        :return: list of parameter values
+        """
+        return [p.resolve() if isinstance(p, DeferredValue) else p for p in parameters]
+
+    def expand(self, sql, parameters):
+        """
+        Expands the ? placeholders of the collections and queries that lambdas test for membership, e.g.
+        s.student_id in ids. A Queryable becomes a subquery. A collection becomes a list of placeholders, or
+        a subquery of the values of a JSON array when it has more than max_in_parameters values.
+        :param sql: translated sql
+        :param parameters: list of parameter values
+        :return: tuple of (sql, list of parameter values)
+        """
+        if not any(is_collection(p) for p in parameters) and u" IN ?" not in sql:
+            return sql, parameters
+        result = []
+        values = iter(parameters)
+
+        def replace(match):
+            value = next(values)
+            if not is_collection(value):
+                if sql.endswith(u" IN ", 0, match.start()) and not isinstance(value, QueryParameter):
+                    # e.g. an argument of a compiled query bound to a string, which can't be a substring test
+                    # because the statement is translated before the value is known
+                    raise InvalidArgumentError(
+                        u"Membership test requires a collection or query, not {0}".format(type(value).__name__))
+                result.append(value)
+                return u"?"
+            if hasattr(value, u"translate"):
+                query_sql, query_params = value.translate()
+                result.extend(query_params)
+                return u"({0})".format(query_sql)
+            value = list(value)
+            if len(value) > self.max_in_parameters:
+                result.append(CollectionParameter(value))
+                return u"(SELECT value FROM json_each(?))"
+            result.extend(value)
+            return u"({0})".format(u", ".join(u"?" for v in value))
+
+        return re.sub(u"\\?", replace, sql), result
+
+    def normalize(self, expression):
+        """
+        Gets the canonical form of an expression tree
+        :param expression: an expression tree
+        :return: new expression tree in canonical form
+        """
+        return expression.visit(self._normalizer)
+
+    @staticmethod
+    def _parse(expression, func=None):
+        """
+        Parses the lambda function of an expression
+        :param expression: a LambdaOperator instance
+        :param func: lambda function to parse instead of the expression's function
+        :return: tuple of (translated tree, parameters of the tree's body)
+        """
+        func = expression.func if func is None else func
+        t = LambdaExpression.parse(expression.type, func)
+        return t, LambdaExpression.defer(t.body, func)
 
-    def _set_lambda(self, expression):
-        if expression.func is None:
-            if not isinstance(expression.exp, operators.SelectOperator)\
-                    or (isinstance(expression.exp, operators.SelectOperator) and expression.exp.func is None):
-                raise AttributeError("lambda function is required for SelectOperator")
-            expression.func = expression.exp.func
-        return expression
+    @staticmethod
+    def _columns(T, alias):
+        cols = Enumerable(T.inspect_columns())
+        if not cols.count() > 0:
+            raise TypeError(u"{0} has no defined columns in model".format(T.__class__.__name__))
+        return u", ".join(cols.select(lambda c: u"{0}.{1}".format(alias, c[1].column_name)))
+
+    def _visit_alias(self, alias, expression):
+        sql, params = expression.visit(self)
+        return u"FROM ({0}) {1}".format(sql, alias), params
 
     def _visit_lambda(self, expression, sql):
-        expression = self._set_lambda(expression)
-        t = LambdaExpression.parse(expression.type, expression.func)
-        return u"SELECT {0}({1}) {2}".format(
-            sql,
-            t.body.sql,
-            operators.AliasOperator(t.body.id, expression.exp).visit(self)
-            if isinstance(expression.exp, operators.SelectOperator)
-            else operators.AliasOperator(t.body.id, operators.SelectOperator(expression.exp, expression.func)).visit(self))
+        t, params = self._parse(expression)
+        exp = expression.exp
+        if isinstance(exp, operators.DistinctOperator) and getattr(exp.exp, u"func", None) is expression.func:
+            # aggregate of the distinct values of the projection, e.g. SUM(DISTINCT s.gpa)
+            from_sql, from_params = self._visit_source(t.body.id, exp.exp.exp)
+            return u"SELECT {0}(DISTINCT {1}) {2}".format(sql, t.body.sql, from_sql), params + from_params
+        from_sql, from_params = self._visit_alias(t.body.id, exp)
+        return u"SELECT {0}({1}) {2}".format(sql, t.body.sql, from_sql), params + from_params
+
+    def _visit_reference(self, alias, expression):
+        """
+        Translates a table or subquery referenced by a FROM or JOIN clause
+        :param alias: alias used for the source in the rest of the statement
+        :param expression: source expression
+        :return: tuple of (sql, parameters)
+        """
+        if isinstance(expression, TableExpression):
+            name = expression.type.table_name()
+            return name if alias == name else u"{0} {1}".format(name, alias), []
+        if isinstance(expression, operators.AliasOperator):
+            expression = expression.exp
+        sql, params = expression.visit(self)
+        return u"({0}) {1}".format(sql, alias), params
+
+    def _visit_source(self, alias, expression):
+        """
+        Translates the FROM clause of a SELECT statement
+        :param alias: alias used for the source in the rest of the statement
+        :param expression: source expression
+        :return: tuple of (sql, parameters)
+        """
+        sql, params = self._visit_reference(alias, expression)
+        return u"FROM {0}".format(sql), params
 
     def visit_SelectOperator(self, expression):
+        if isinstance(expression.exp, (operators.GroupByOperator, operators.HavingOperator)):
+            return self._visit_group(expression.exp, expression.func)
         cols = Enumerable(expression.type.inspect_columns())
         if not cols.count() > 0:
             raise TypeError(u"{0} has no defined columns in model".format(expression.type.__class__.__name__))
         if expression.func is not None:
-            t = LambdaExpression.parse(expression.type, expression.func)
-            if not hasattr(t.body, "sql"):
-                sql = cols.select(
+            t, params = self._parse(expression)
+            if hasattr(t.body, "sql"):
+                sql = t.body.sql
+            else:
+                sql = u", ".join(cols.select(
                     lambda c: u"{0}.{1}".format(t.body.id, c[1].column_name)
-                )
-                t.body.sql = u", ".join(sql)
-            return u"SELECT {0} {1} {2}".format(t.body.sql, expression.exp.visit(self), t.body.id)
+                ))
+            from_sql, from_params = self._visit_source(t.body.id, expression.exp)
+            return u"SELECT {0} {1}".format(sql, from_sql), params + from_params
         else:
             sql = cols.select(
                 lambda c: u"{0}.{1}".format(expression.type.table_name(), c[1].column_name)
             )
-            return u"SELECT {0} {1}".format(
-                u", ".join(sql),
-                expression.exp.visit(self)
-            )
+            from_sql, from_params = self._visit_source(expression.type.table_name(), expression.exp)
+            return u"SELECT {0} {1}".format(u", ".join(sql), from_sql), from_params
+
+    @staticmethod
+    def _negate(sql):
+        """
+        Negates the sql of a translated predicate. Rows where the predicate is NULL do not satisfy it, so they
+        satisfy the negated predicate.
+        :param sql: sql of a translated predicate
+        :return: sql
+        """
+        return u"NOT COALESCE({0}, 0)".format(sql)
+
+    def visit_FlatSelectOperator(self, expression):
+        return self._visit_flat(expression)
+
+    def _visit_flat(self, expression, projection=None, group=None):
+        """
+        Translates a FlatSelectOperator
+        :param expression: FlatSelectOperator instance
+        :param projection: function of the statement's alias returning a tuple of (sql, parameters) to select
+        instead of the expression's own projection
+        :param group: function of the statement's alias returning a tuple of (sql, parameters) for the GROUP BY
+        and HAVING clauses
+        :return: tuple of (sql, parameters)
+        """
+        funcs = [expression.func] + [f for f, n in expression.predicates] + [f for f, d in expression.orderings]
+        parsed = [self._parse(expression, f) if f is not None else (None, []) for f in funcs]
+        names = [t.args.args[0].id for t, p in parsed if t is not None]
+        alias = names[0] if len(names) > 0 else expression.type.table_name()
+        sql = [
+            rebind(t.body.sql, t.args.args[0].id, alias) if t is not None and hasattr(t.body, u"sql") else None
+            for t, p in parsed
+        ]
+        predicates = [
+            self._negate(p) if n else p for p, (f, n) in zip(sql[1:len(expression.predicates) + 1], expression.predicates)
+        ]
+        orderings = [
+            u"{0} {1}".format(o, u"DESC" if d else u"ASC")
+            for o, (f, d) in zip(sql[len(expression.predicates) + 1:], expression.orderings)
+        ]
+
+        if projection is not None:
+            projection, projection_params = projection(alias)
+        else:
+            projection, projection_params = sql[0], parsed[0][1]
+        if projection is None:
+            projection = self._columns(expression.type, alias)
+        if expression.aggregate == u"COUNT":
+            projection = u"COUNT(*)"
+        elif expression.aggregate in (u"EXISTS", u"NOT EXISTS"):
+            projection = u"1"
+        elif expression.aggregate is not None:
+            projection = u"{0}({1}{2})".format(
+                expression.aggregate, u"DISTINCT " if expression.distinct else u"", projection)
+        elif expression.distinct:
+            projection = u"DISTINCT {0}".format(projection)
+        from_sql, from_params = self._visit_source(alias, expression.exp)
+        result = u"SELECT {0} {1}".format(projection, from_sql)
+        params = projection_params + from_params
+        for t, p in parsed[1:len(expression.predicates) + 1]:
+            params.extend(p)
+        if expression.after is not None:
+            first = len(expression.predicates) + 1
+            keys = [(o, p, d) for o, (t, p), (f, d) in zip(sql[first:], parsed[first:], expression.orderings)]
+            seek_sql, seek_params = self._seek(keys, expression.after)
+            predicates.append(seek_sql)
+            params.extend(seek_params)
+
+        if len(predicates) == 1:
+            result = u"{0} WHERE {1}".format(result, predicates[0])
+        elif len(predicates) > 1:
+            result = u"{0} WHERE {1}".format(result, u" AND ".join(u"({0})".format(p) for p in predicates))
+        if group is not None:
+            group_sql, group_params = group(alias)
+            result = u"{0} {1}".format(result, group_sql)
+            params.extend(group_params)
+        for t, p in parsed[len(expression.predicates) + 1:]:
+            params.extend(p)
+        if len(orderings) > 0:
+            result = u"{0} ORDER BY {1}".format(result, u", ".join(orderings))
+        if expression.limit is not None or expression.offset is not None:
+            result = u"{0} LIMIT ?".format(result)
+            params.append(expression.limit if expression.limit is not None else -1)
+        if expression.offset is not None:
+            result = u"{0} OFFSET ?".format(result)
+            params.append(expression.offset)
+        if expression.aggregate in (u"EXISTS", u"NOT EXISTS"):
+            result = u"SELECT {0}({1})".format(expression.aggregate, result)
+        return result, params
+
+    @staticmethod
+    def _seek(keys, values):
+        """
+        Translates the condition selecting the rows ordered after the given ordering key values. Keys ordered in
+        the same direction are compared as one row value, otherwise the comparison is expanded into terms of the
+        form a > ? OR (a = ? AND b < ?).
+        :param keys: list of (sql, parameters, descending) of the ordering keys in ordering precedence
+        :param values: ordering key values of the last row seen
+        :return: tuple of (sql, parameters)
+        """
+        if len(set(d for k, p, d in keys)) == 1:
+            operator = u"<" if keys[0][2] else u">"
+            params = [v for k, p, d in keys for v in p] + list(values)
+            if len(keys) == 1:
+                return u"{0} {1} ?".format(keys[0][0], operator), params
+            return u"({0}) {1} ({2})".format(
+                u", ".join(k for k, p, d in keys),
+                operator,
+                u", ".join(u"?" for v in values)
+            ), params
+        terms = []
+        params = []
+        for i, (sql, p, d) in enumerate(keys):
+            terms.append(u" AND ".join(
+                [u"{0} = ?".format(k) for k, kp, kd in keys[:i]] + [u"{0} {1} ?".format(sql, u"<" if d else u">")]
+            ))
+            for (k, kp, kd), v in zip(keys[:i + 1], values):
+                params.extend(kp)
+                params.append(v)
+        return u" OR ".join(u"({0})".format(t) for t in terms), params
+
+    def visit_SeekOperator(self, expression):
+        orderings, source = operators.SeekOperator.orderings(expression.exp)
+        parsed = [(self._parse(expression, f), d) for f, d in orderings]
+        alias = parsed[0][0][0].args.args[0].id
+        keys = [(rebind(t.body.sql, t.args.args[0].id, alias), p, d) for (t, p), d in parsed]
+        from_sql, from_params = self._visit_alias(alias, source)
+        seek_sql, seek_params = self._seek(keys, expression.values)
+        order_params = [v for k, p, d in keys for v in p]
+        return u"SELECT * {0} WHERE {1} ORDER BY {2}".format(
+            from_sql,
+            seek_sql,
+            u", ".join(u"{0} {1}".format(k, u"DESC" if d else u"ASC") for k, p, d in keys)
+        ), from_params + seek_params + order_params
 
     def visit_AliasOperator(self, expression):
-        return "FROM ({0}) {1}".format(expression.exp.visit(self), expression.alias)
+        return self._visit_alias(expression.alias, expression.exp)
 
     def visit_WhereOperator(self, expression):
-        select = expression.find(operators.SelectOperator)
-        if select is None:
-            expression.exp = operators.SelectOperator(expression.exp)
-        t = LambdaExpression.parse(expression.type, expression.func)
-        return u"SELECT * {0} WHERE {1}".format(
-            operators.AliasOperator(t.body.id, expression.exp).visit(self),
-            t.body.sql
-        )
+        t, params = self._parse(expression)
+        from_sql, from_params = self._visit_alias(t.body.id, expression.exp)
+        return u"SELECT * {0} WHERE {1}".format(from_sql, t.body.sql), from_params + params
 
     def visit_TableExpression(self, expression):
-        return u"FROM {0}".format(expression.type.table_name())
+        return u"FROM {0}".format(expression.type.table_name()), []
 
     def visit_CountOperator(self, expression):
-        result = expression.exp.visit(self)
+        result, params = expression.exp.visit(self)
         if not isinstance(expression.exp, TableExpression):
             result = u"FROM ({0})".format(result)
-        return u"SELECT COUNT(*) {0}".format(result)
+        return u"SELECT COUNT(*) {0}".format(result), params
 
     def visit_TakeOperator(self, expression):
-        select = expression.find(operators.SelectOperator)
-        if select is None:
-            if isinstance(expression.exp, operators.SkipOperator):
-                expression.exp.exp = operators.SelectOperator(expression.exp.exp)
-            else:
-                expression.exp = operators.SelectOperator(expression.exp)
-        if isinstance(expression.exp, operators.SkipOperator):
-            return operators.SkipOperator(
-                operators.TakeOperator(expression.exp.exp, expression.limit),
-                expression.exp.skip
-            ).visit(self)
-        return u"{0} LIMIT {1}".format(expression.exp.visit(self), expression.limit)
+        sql, params = expression.exp.visit(self)
+        return u"{0} LIMIT ?".format(sql), params + [expression.limit]
 
     def visit_SkipOperator(self, expression):
-        select = expression.find(operators.SelectOperator)
-        if select is None:
-            if isinstance(expression.exp, operators.TakeOperator):
-                expression.exp.exp = operators.SelectOperator(expression.exp.exp)
-            else:
-                expression.exp = operators.SelectOperator(expression.exp)
-        if not isinstance(expression.exp, operators.TakeOperator):
-            expression.exp = operators.TakeOperator(expression.exp, -1)
-        return u"{0} OFFSET {1}".format(expression.exp.visit(self), expression.skip)
+        sql, params = expression.exp.visit(self)
+        return u"{0} OFFSET ?".format(sql), params + [expression.skip]
 
     def visit_OrderByOperator(self, expression):
-        t = LambdaExpression.parse(expression.type, expression.func)
-        select = expression.find(operators.SelectOperator)
-        if select is None:
-            expression.exp = operators.SelectOperator(expression.exp)
-        return u"SELECT * {0} ORDER BY {1} ASC".format(
-            operators.AliasOperator(t.body.id, expression.exp).visit(self),
-            t.body.sql
-        )
+        t, params = self._parse(expression)
+        from_sql, from_params = self._visit_alias(t.body.id, expression.exp)
+        return u"SELECT * {0} ORDER BY {1} ASC".format(from_sql, t.body.sql), from_params + params
 
     def visit_OrderByDescendingOperator(self, expression):
-        sql = self.visit_OrderByOperator(expression)[0:-4]
-        return u"{0} DESC".format(sql)
+        sql, params = self.visit_OrderByOperator(expression)
+        return u"{0} DESC".format(sql[0:-4]), params
 
     def visit_ThenByOperator(self, expression):
-        if not isinstance(expression.exp, operators.OrderByOperator) and not isinstance(expression.exp, operators.OrderByDescendingOperator):
-            raise AttributeError("ThenBy needs to follow OrderBy or OrderByDescending")
-        t = LambdaExpression.parse(expression.type, expression.func)
-        te = LambdaExpression.parse(expression.exp.type, expression.exp.func)
+        t, params = self._parse(expression)
+        order_by = expression.exp
+        while isinstance(order_by, (operators.ThenByOperator, operators.ThenByDescendingOperator)):
+            order_by = order_by.exp
+        te = LambdaExpression.parse(order_by.type, order_by.func)
+        sql, exp_params = expression.exp.visit(self)
         return u"{0}, {1} ASC".format(
-            expression.exp.visit(self),
-            t.body.sql.replace(t.body.id, te.body.id)
-        )
+            sql,
+            rebind(t.body.sql, t.args.args[0].id, te.args.args[0].id)
+        ), exp_params + params
 
     def visit_ThenByDescendingOperator(self, expression):
-        sql = self.visit_ThenByOperator(expression)[0:-4]
-        return u"{0} DESC".format(sql)
+        sql, params = self.visit_ThenByOperator(expression)
+        return u"{0} DESC".format(sql[0:-4]), params
+
+    def visit_DistinctOperator(self, expression):
+        sql, params = expression.exp.visit(self)
+        return u"SELECT DISTINCT * FROM ({0})".format(sql), params
+
+    def _visit_compound_operand(self, expression, nested):
+        """
+        Translates an operand of a compound SELECT statement. Operands with their own ORDER BY or LIMIT, and
+        compound operands on the right, are selected from as a subquery.
+        :param expression: operand expression
+        :param nested: whether the operand may not be a compound statement itself
+        :return: tuple of (sql, parameters)
+        """
+        sql, params = expression.visit(self)
+        if isinstance(expression, operators.FlatSelectOperator):
+            wrap = len(expression.orderings) > 0 or expression.limit is not None or expression.offset is not None
+        else:
+            wrap = isinstance(expression, (
+                operators.TakeOperator,
+                operators.SkipOperator,
+                operators.OrderByOperator,
+                operators.OrderByDescendingOperator,
+                operators.ThenByOperator,
+                operators.ThenByDescendingOperator,
+                operators.SeekOperator)) or (nested and isinstance(expression, SetExpression))
+        if wrap:
+            return u"SELECT * FROM ({0})".format(sql), params
+        return sql, params
+
+    def visit_SetExpression(self, expression):
+        left_sql, left_params = self._visit_compound_operand(expression.left, False)
+        right_sql, right_params = self._visit_compound_operand(expression.right, True)
+        return u"{0} {1} {2}".format(left_sql, expression.operation, right_sql), left_params + right_params
+
+    def visit_AnyOperator(self, expression):
+        sql, params = expression.exp.visit(self)
+        return u"SELECT EXISTS({0})".format(sql), params
+
+    def visit_AllOperator(self, expression):
+        t, params = self._parse(expression)
+        from_sql, from_params = self._visit_alias(t.body.id, expression.exp)
+        return u"SELECT NOT EXISTS(SELECT 1 {0} WHERE {1})".format(from_sql, self._negate(t.body.sql)), \
+            from_params + params
+
+    def _visit_aggregates(self, expression, alias):
+        sql = []
+        params = []
+        for name, aggregate, func in expression.aggregates:
+            if func is None:
+                sql.append(u"{0}(*) AS '{1}'".format(aggregate, name))
+                continue
+            t, p = self._parse(expression, func)
+            value = rebind(t.body.sql, t.args.args[0].id, alias)
+            body = t.body.value if isinstance(t.body, ast.Return) else t.body
+            if aggregate == u"COUNT" and self._is_predicate(body):
+                # counts the rows the predicate is true for, like the count of a group, rather than the rows it
+                # is not NULL for
+                sql.append(u"COUNT(CASE WHEN {0} THEN 1 END) AS '{1}'".format(value, name))
+            else:
+                sql.append(u"{0}({1}) AS '{2}'".format(aggregate, value, name))
+            params.extend(p)
+        return u", ".join(sql), params
+
+    @staticmethod
+    def _is_predicate(node):
+        """
+        :param node: body of a translated lambda
+        :return: whether the lambda returns the result of a comparison or boolean operator
+        """
+        return isinstance(node, (ast.Compare, ast.BoolOp)) \
+            or (isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not))
+
+    @staticmethod
+    def _substitute(sql, params, pattern, replacement, replacement_params):
+        """
+        Replaces matches of a pattern in translated sql, keeping the parameters in the same order as the ?
+        placeholders
+        :param sql: translated sql
+        :param params: parameters of the sql
+        :param pattern: regular expression
+        :param replacement: sql replacing each match
+        :param replacement_params: parameters of the replacement sql
+        :return: tuple of (sql, parameters)
+        """
+        result = []
+        values = iter(params)
+
+        def replace(match):
+            if match.group(0) == u"?":
+                result.append(next(values))
+                return match.group(0)
+            result.extend(replacement_params)
+            return replacement
+
+        return re.sub(u"\\?|{0}".format(pattern), replace, sql), result
+
+    def _visit_group(self, expression, func=None):
+        """
+        Translates a GroupByOperator, followed by any number of HavingOperators
+        :param expression: GroupByOperator or HavingOperator instance
+        :param func: lambda selecting from the groups or None to select the group keys
+        :return: tuple of (sql, parameters)
+        """
+        havings = []
+        while isinstance(expression, operators.HavingOperator):
+            havings.insert(0, expression)
+            expression = expression.exp
+        key, key_params = self._parse(expression)
+        terms = [self._parse(expression, f) for f in [func] + [h.func for h in havings] if f is not None]
+
+        def group_term(alias, t, params):
+            key_sql = rebind(key.body.sql, key.args.args[0].id, alias)
+            if not isinstance(key.body.value, (ast.Attribute, ast.Tuple, ast.List)):
+                key_sql = u"({0})".format(key_sql)
+            sql = rebind(t.body.sql, t.args.args[0].id, alias)
+            return self._substitute(sql, params, u"(?<![\\w.]){0}\\.key\\b".format(re.escape(alias)), key_sql, key_params)
+
+        def projection(alias):
+            if func is None:
+                return rebind(key.body.sql, key.args.args[0].id, alias), list(key_params)
+            return group_term(alias, *terms[0])
+
+        def group(alias):
+            sql = u"GROUP BY {0}".format(rebind(key.body.sql, key.args.args[0].id, alias))
+            params = list(key_params)
+            having = [group_term(alias, t, p) for t, p in terms[len(terms) - len(havings):]]
+            if len(having) == 1:
+                sql = u"{0} HAVING {1}".format(sql, having[0][0])
+            elif len(having) > 1:
+                sql = u"{0} HAVING {1}".format(sql, u" AND ".join(u"({0})".format(h) for h, p in having))
+            for h, p in having:
+                params.extend(p)
+            return sql, params
+
+        exp = expression.exp
+        if isinstance(exp, operators.FlatSelectOperator) and exp.func is None and exp.aggregate is None\
+                and exp.limit is None and exp.offset is None and len(exp.orderings) == 0 and not exp.distinct:
+            return self._visit_flat(exp, projection, group)
+        alias = terms[0][0].args.args[0].id if len(terms) > 0 else key.args.args[0].id
+        sql, params = projection(alias)
+        from_sql, from_params = self._visit_source(alias, exp)
+        group_sql, group_params = group(alias)
+        return u"SELECT {0} {1} {2}".format(sql, from_sql, group_sql), params + from_params + group_params
+
+    def visit_GroupByOperator(self, expression):
+        return self._visit_group(expression)
+
+    def visit_HavingOperator(self, expression):
+        return self._visit_group(expression)
+
+    def visit_AggregateOperator(self, expression):
+        exp = expression.exp
+        if isinstance(exp, operators.FlatSelectOperator) and exp.func is None and exp.aggregate is None\
+                and exp.limit is None and exp.offset is None and not exp.distinct:
+            return self._visit_flat(exp, lambda alias: self._visit_aggregates(expression, alias))
+        names = [
+            LambdaExpression.parse(expression.type, f).args.args[0].id for n, a, f in expression.aggregates
+            if f is not None
+        ]
+        alias = names[0] if len(names) > 0 else expression.type.table_name()
+        sql, params = self._visit_aggregates(expression, alias)
+        from_sql, from_params = self._visit_alias(alias, exp)
+        return u"SELECT {0} {1}".format(sql, from_sql), params + from_params
 
     def visit_MaxOperator(self, expression):
         return self._visit_lambda(expression, u"MAX")
@@ -133,5 +560,66 @@ class SqlVisitor(Visitor):
     def visit_AveOperator(self, expression):
         return self._visit_lambda(expression, u"AVG")
 
+    def visit_IncludeOperator(self, expression):
+        includes = []
+        while isinstance(expression, operators.IncludeOperator):
+            includes.insert(0, expression)
+            expression = expression.exp
+        alias = LambdaExpression.parse(expression.type, includes[0].func).args.args[0].id
+        model = expression.type
+        columns = [self._columns(model, alias)]
+        joins = []
+        for include in includes:
+            column = include.column
+            related = u"{0}_{1}".format(alias, include.attribute)
+            columns.append(self._columns(column.foreign_key, related))
+            joins.append(u"LEFT JOIN {0} {1} ON {2}.{3} = {1}.{4}".format(
+                column.foreign_key.table_name(),
+                related,
+                alias,
+                column.column_name or include.attribute,
+                column.foreign_key.metadata().column_names[column.foreign_column]
+            ))
+        sql, params = self._visit_source(alias, expression)
+        return u"SELECT {0} {1} {2}".format(u", ".join(columns), sql, u" ".join(joins)), params
+
+    def _visit_join_keys(self, expression, outer_alias, inner_alias):
+        """
+        Translates the condition of a JoinExpression. Tuple keys are compared element by element.
+        :return: tuple of (sql, parameters)
+        """
+        keys = []
+        for func, alias in ((expression.outer_key, outer_alias), (expression.inner_key, inner_alias)):
+            t = LambdaExpression.parse(expression.type, func)
+            name = t.args.args[0].id
+            body = t.body.value
+            elements = body.elts if isinstance(body, (ast.Tuple, ast.List)) else [t.body]
+            keys.append([(rebind(e.sql, name, alias), LambdaExpression.defer(e, func)) for e in elements])
+        if len(keys[0]) != len(keys[1]):
+            raise AttributeError(u"outer and inner keys of a join need to have the same number of elements")
+        sql = []
+        params = []
+        for (outer_sql, outer_params), (inner_sql, inner_params) in zip(*keys):
+            sql.append(u"{0} = {1}".format(outer_sql, inner_sql))
+            params.extend(outer_params + inner_params)
+        return u" AND ".join(sql), params
+
     def visit_JoinExpression(self, expression):
-        raise NotImplementedError()
+        t, params = self._parse(expression, expression.select_func)
+        outer_alias, inner_alias = [a.id for a in t.args.args]
+        if hasattr(t.body, u"sql"):
+            sql = t.body.sql
+        elif t.body.value.id == inner_alias:
+            sql = self._columns(expression.right.type, inner_alias)
+        else:
+            sql = self._columns(expression.left.type, outer_alias)
+        outer_sql, outer_params = self._visit_reference(outer_alias, expression.left)
+        inner_sql, inner_params = self._visit_reference(inner_alias, expression.right)
+        on_sql, on_params = self._visit_join_keys(expression, outer_alias, inner_alias)
+        return u"SELECT {0} FROM {1} {2} JOIN {3} ON {4}".format(
+            sql,
+            outer_sql,
+            expression.join_type,
+            inner_sql,
+            on_sql
+        ), params + outer_params + inner_params + on_params
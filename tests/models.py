@@ -1,5 +1,5 @@
 from py_queryable import Model
-from py_queryable import Column, PrimaryKey, ForeignKey
+from py_queryable import Column, PrimaryKey, ForeignKey, Index
 
 
 class StubModel(Model):
@@ -28,6 +28,20 @@ class StubIntUnique(Model):
     test_unique = Column(int, 'int_column', is_unique=True)
 
 
+class StubIndexed(Model):
+    __table_name__ = u"indexed_table"
+    __indexes__ = [
+        Index(lambda s: (s.last_name, s.first_name), where=lambda s: s.gpa > 0),
+        Index(lambda s: s.gpa, include=lambda s: s.last_name, name=u"gpa_covering_index"),
+        Index(lambda s: s.first_name, unique=True),
+        Index(lambda s: s.last_name, where=lambda s: s.gpa != None)  # noqa: E711
+    ]
+    key = PrimaryKey(int, "key")
+    first_name = Column(unicode, "first_name")
+    last_name = Column(unicode, "last_name")
+    gpa = Column(int, "gpa")
+
+
 class StubForeignKey(Model):
     __table_name__ = u"foreign_key_table"
     test_pk = PrimaryKey(int, 'int_pk')
@@ -46,3 +60,17 @@ class Student(Model):
     first_name = Column(unicode, "first_name")
     last_name = Column(unicode, "last_name")
     gpa = Column(int, "gpa")
+
+
+class Course(Model):
+    __table_name__ = u"course"
+    course_id = PrimaryKey(int, "course_id")
+    title = Column(unicode, "title")
+
+
+class Enrollment(Model):
+    __table_name__ = u"enrollment"
+    enrollment_id = PrimaryKey(int, "enrollment_id")
+    student = ForeignKey(Student, "student_id")
+    course = ForeignKey(Course, "course_id")
+    grade = Column(int, "grade")
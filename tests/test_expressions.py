@@ -1,8 +1,9 @@
 from unittest import TestCase
 from py_queryable import expressions
-from py_queryable.expressions import operators
+from py_queryable.expressions import operators, LambdaExpression
 from py_queryable.visitors.sql import SqlVisitor
-from .models import Student
+from py_queryable.expressions.binary import JoinExpression, SetExpression
+from .models import Student, Enrollment
 
 
 class TestSqlExpressions(TestCase):
@@ -42,26 +43,71 @@ class TestSqlExpressions(TestCase):
     def test_where_expression(self):
         we = operators.WhereOperator(
             expressions.TableExpression(Student), lambda x: x.gpa > 10)
-        sql = self.visitor.visit(we)
+        sql, params = self.visitor.translate(we)
         self.assertEquals(
             sql,
-            u"SELECT * FROM (SELECT student.student_id, student.first_name, student.gpa, student.last_name FROM student) x WHERE x.gpa > 10")
+            u"SELECT * FROM (SELECT student.student_id, student.first_name, student.gpa, student.last_name FROM student) x WHERE x.gpa > ?")
+        self.assertEquals(params, [10])
 
     def test_where_expression_complex(self):
         we = operators.WhereOperator(
             expressions.TableExpression(Student),
             lambda x: (x.gpa > 10 and x.first_name == u'Bruce') or x.first_name == u'Dustin')
-        sql = self.visitor.visit(we)
+        sql, params = self.visitor.translate(we)
         self.assertEquals(
             sql,
-            u"SELECT * FROM (SELECT student.student_id, student.first_name, student.gpa, student.last_name FROM student) x WHERE (x.gpa > 10 AND x.first_name = 'Bruce') OR x.first_name = 'Dustin'")
+            u"SELECT * FROM (SELECT student.student_id, student.first_name, student.gpa, student.last_name FROM student) x WHERE (x.gpa > ? AND x.first_name IS ?) OR x.first_name IS ?")
+        self.assertEquals(params, [10, u'Bruce', u'Dustin'])
 
         we = operators.WhereOperator(
             expressions.TableExpression(Student),
             lambda x: ((x.first_name == u'Bruce' and x.last_name == u'Fenske') or x.first_name == u'Dustin') or (x.gpa > 10 and x.gpa < 20)
         )
-        sql = self.visitor.visit(we)
-        self.assertEquals(sql, u"SELECT * FROM (SELECT student.student_id, student.first_name, student.gpa, student.last_name FROM student) x WHERE (x.first_name = 'Bruce' AND x.last_name = 'Fenske') OR (x.first_name = 'Dustin' OR (x.gpa > 10 AND x.gpa < 20))")
+        sql, params = self.visitor.translate(we)
+        self.assertEquals(sql, u"SELECT * FROM (SELECT student.student_id, student.first_name, student.gpa, student.last_name FROM student) x WHERE (x.first_name IS ? AND x.last_name IS ?) OR (x.first_name IS ? OR (x.gpa > ? AND x.gpa < ?))")
+        self.assertEquals(params, [u'Bruce', u'Fenske', u'Dustin', 10, 20])
+
+    def test_where_expression_captured(self):
+        minimum = 10
+        name = None
+        we = operators.WhereOperator(
+            expressions.TableExpression(Student),
+            lambda x: x.gpa > minimum and x.first_name == name)
+        sql, params = self.visitor.translate(we)
+        self.assertEquals(
+            sql,
+            u"SELECT * FROM (SELECT student.student_id, student.first_name, student.gpa, student.last_name FROM student) x WHERE x.gpa > ? AND x.first_name IS ?")
+        self.assertEquals(params, [10, None])
+
+        minimum = 20
+        self.assertEquals(self.visitor.translate(we), (sql, [20, None]))
+
+    def test_membership_expression(self):
+        visitor = SqlVisitor(optimize=True)
+        ids = [1, 2, 3]
+        table = expressions.TableExpression(Student)
+        self.assertEqual(
+            visitor.translate(operators.WhereOperator(table, lambda x: x.student_id in ids)),
+            (u"SELECT x.student_id, x.first_name, x.gpa, x.last_name FROM student x WHERE x.student_id IN (?, ?, ?)",
+             [1, 2, 3]))
+        self.assertEqual(
+            visitor.translate(operators.WhereOperator(table, lambda x: x.student_id not in [4, 5])),
+            (u"SELECT x.student_id, x.first_name, x.gpa, x.last_name FROM student x WHERE x.student_id NOT IN (?, ?)",
+             [4, 5]))
+        # strings are still tested for substrings
+        name = u"Bruce"
+        self.assertEqual(
+            visitor.visit(operators.WhereOperator(table, lambda x: x.first_name in name)),
+            u"SELECT x.student_id, x.first_name, x.gpa, x.last_name FROM student x WHERE instr(?, x.first_name) > 0")
+
+        ids = range(visitor.max_in_parameters + 1)
+        sql, params = visitor.translate(operators.WhereOperator(table, lambda x: x.student_id in ids))
+        self.assertEqual(
+            sql,
+            u"SELECT x.student_id, x.first_name, x.gpa, x.last_name FROM student x "
+            u"WHERE x.student_id IN (SELECT value FROM json_each(?))")
+        self.assertEqual(len(params), 1)
+        self.assertEqual(params[0].values, ids)
 
     def test_count_expression(self):
         ce = operators.CountOperator(expressions.TableExpression(Student))
@@ -82,51 +128,55 @@ class TestSqlExpressions(TestCase):
     def test_take_expression(self):
         te = operators.TakeOperator(operators.SelectOperator(
             expressions.TableExpression(Student), lambda s: s.first_name), 1)
-        sql = self.visitor.visit(te)
-        self.assertEqual(sql, u"SELECT s.first_name FROM student s LIMIT 1")
+        sql, params = self.visitor.translate(te)
+        self.assertEqual(sql, u"SELECT s.first_name FROM student s LIMIT ?")
+        self.assertEqual(params, [1])
 
         te = operators.TakeOperator(expressions.TableExpression(Student), 1)
         sql = self.visitor.visit(te)
         self.assertEqual(
             sql,
-            u'SELECT student.student_id, student.first_name, student.gpa, student.last_name FROM student LIMIT 1')
+            u'SELECT student.student_id, student.first_name, student.gpa, student.last_name FROM student LIMIT ?')
 
     def test_skip_expression(self):
         se = operators.SkipOperator(operators.SelectOperator(
             expressions.TableExpression(Student), lambda s: s.first_name), 1)
-        sql = self.visitor.visit(se)
-        self.assertEqual(sql, u"SELECT s.first_name FROM student s LIMIT -1 OFFSET 1")
+        sql, params = self.visitor.translate(se)
+        self.assertEqual(sql, u"SELECT s.first_name FROM student s LIMIT ? OFFSET ?")
+        self.assertEqual(params, [-1, 1])
 
         se = operators.SkipOperator(expressions.TableExpression(Student), 1)
         sql = self.visitor.visit(se)
         self.assertEquals(
             sql,
-            u'SELECT student.student_id, student.first_name, student.gpa, student.last_name FROM student LIMIT -1 OFFSET 1')
+            u'SELECT student.student_id, student.first_name, student.gpa, student.last_name FROM student LIMIT ? OFFSET ?')
 
     def test_skip_limit_expression(self):
         qe = operators.TakeOperator(operators.SkipOperator(operators.SelectOperator(
-            expressions.TableExpression(Student), lambda s: s.first_name), 1), 1)
-        sql = self.visitor.visit(qe)
-        self.assertEqual(sql, u"SELECT s.first_name FROM student s LIMIT 1 OFFSET 1")
+            expressions.TableExpression(Student), lambda s: s.first_name), 2), 1)
+        sql, params = self.visitor.translate(qe)
+        self.assertEqual(sql, u"SELECT s.first_name FROM student s LIMIT ? OFFSET ?")
+        self.assertEqual(params, [1, 2])
 
         qe = operators.TakeOperator(operators.SkipOperator(
             expressions.TableExpression(Student), 1), 1)
         sql = self.visitor.visit(qe)
         self.assertEqual(
             sql,
-            u'SELECT student.student_id, student.first_name, student.gpa, student.last_name FROM student LIMIT 1 OFFSET 1')
+            u'SELECT student.student_id, student.first_name, student.gpa, student.last_name FROM student LIMIT ? OFFSET ?')
 
         qe = operators.SkipOperator(operators.TakeOperator(operators.SelectOperator(
-            expressions.TableExpression(Student), lambda s: s.first_name), 1), 1)
-        sql = self.visitor.visit(qe)
-        self.assertEqual(sql, u"SELECT s.first_name FROM student s LIMIT 1 OFFSET 1")
+            expressions.TableExpression(Student), lambda s: s.first_name), 1), 2)
+        sql, params = self.visitor.translate(qe)
+        self.assertEqual(sql, u"SELECT s.first_name FROM student s LIMIT ? OFFSET ?")
+        self.assertEqual(params, [1, 2])
 
         qe = operators.SkipOperator(operators.TakeOperator(
             expressions.TableExpression(Student), 1), 1)
         sql = self.visitor.visit(qe)
         self.assertEqual(
             sql,
-            u'SELECT student.student_id, student.first_name, student.gpa, student.last_name FROM student LIMIT 1 OFFSET 1')
+            u'SELECT student.student_id, student.first_name, student.gpa, student.last_name FROM student LIMIT ? OFFSET ?')
 
     def test_order_by_expression(self):
         te = operators.OrderByOperator(
@@ -337,3 +387,350 @@ class TestSqlExpressions(TestCase):
             sql,
             u"SELECT AVG(u.gpa) FROM (SELECT s.gpa FROM student s) u"
         )
+
+    def test_translate_is_side_effect_free(self):
+        table = expressions.TableExpression(Student)
+        te = operators.TakeOperator(operators.SkipOperator(
+            operators.WhereOperator(table, lambda x: x.gpa > 10), 1), 2)
+        first = self.visitor.translate(te)
+        self.assertIs(te.exp.exp.exp, table)
+        self.assertEqual(self.visitor.translate(te), first)
+        self.assertEqual(
+            first[0],
+            u"SELECT * FROM (SELECT student.student_id, student.first_name, student.gpa, student.last_name FROM student) x WHERE x.gpa > ? LIMIT ? OFFSET ?")
+        self.assertEqual(first[1], [10, 2, 1])
+
+    def test_immutable(self):
+        we = operators.WhereOperator(expressions.TableExpression(Student), lambda x: x.gpa > 10)
+        self.assertRaises(AttributeError, setattr, we, u"exp", expressions.TableExpression(Student))
+        self.assertRaises(AttributeError, setattr, we, u"other", 1)
+        self.assertEqual(hash(we), hash(we))
+
+    def test_normalize(self):
+        table = expressions.TableExpression(Student)
+        we = operators.WhereOperator(operators.WhereOperator(table, lambda x: x.gpa > 10), lambda x: x.gpa < 20)
+        canonical = self.visitor.normalize(we)
+        self.assertIsInstance(canonical.exp.exp, operators.SelectOperator)
+        self.assertIs(canonical.exp.exp.exp, table)
+        self.assertIs(self.visitor.normalize(canonical), canonical)
+        self.assertEqual(
+            self.visitor.visit(we),
+            u"SELECT * FROM (SELECT * FROM (SELECT student.student_id, student.first_name, student.gpa, student.last_name FROM student) x WHERE x.gpa > ?) x WHERE x.gpa < ?")
+
+        me = operators.MaxOperator(operators.WhereOperator(table, lambda x: x.gpa > 10), lambda s: s.gpa)
+        canonical = self.visitor.normalize(me)
+        self.assertIsInstance(canonical.exp, operators.SelectOperator)
+        self.assertIs(canonical.exp.func, me.func)
+
+        te = operators.TakeOperator(operators.TakeOperator(table, 5), 2)
+        self.assertEqual(
+            self.visitor.visit(te),
+            u"SELECT student.student_id, student.first_name, student.gpa, student.last_name FROM (SELECT student.student_id, student.first_name, student.gpa, student.last_name FROM student LIMIT ?) student LIMIT ?")
+
+    def test_structural_equality(self):
+        def where(value):
+            return operators.WhereOperator(
+                operators.SelectOperator(expressions.TableExpression(Student)),
+                lambda x: x.gpa > value)
+
+        LambdaExpression.clear_cache()
+        first = where(10)
+        self.assertEqual(first, where(10))
+        self.assertEqual(hash(first), hash(where(10)))
+        self.assertNotEqual(first, where(20))
+        self.assertNotEqual(first, operators.OrderByOperator(first.exp, first.func))
+        self.assertNotEqual(first, None)
+        self.assertEqual(LambdaExpression.cache_info()[u"misses"], 0)
+
+        cache = {first: 1}
+        self.assertEqual(cache[where(10)], 1)
+        self.assertFalse(where(20) in cache)
+
+        te = operators.TakeOperator(first, 5)
+        self.assertEqual(te, operators.TakeOperator(where(10), 5))
+        self.assertNotEqual(te, operators.TakeOperator(where(10), 6))
+        self.assertEqual(
+            operators.MaxOperator(expressions.TableExpression(Student)),
+            operators.MaxOperator(expressions.TableExpression(Student)))
+
+        captured = [1, 2]
+        unhashable = operators.WhereOperator(expressions.TableExpression(Student), lambda x: x.gpa in captured)
+        self.assertEqual(unhashable, unhashable)
+        self.assertNotEqual(
+            unhashable,
+            operators.WhereOperator(expressions.TableExpression(Student), lambda x: x.gpa in captured))
+
+    def test_optimize(self):
+        visitor = SqlVisitor(optimize=True)
+        te = operators.SkipOperator(
+            operators.TakeOperator(
+                operators.ThenByDescendingOperator(
+                    operators.OrderByOperator(
+                        operators.WhereOperator(
+                            operators.WhereOperator(expressions.TableExpression(Student), lambda s: s.gpa > 3),
+                            lambda y: y.first_name == u"Bruce" or y.gpa < 2),
+                        lambda z: z.last_name),
+                    lambda w: w.first_name),
+                5),
+            2)
+        self.assertEqual(
+            visitor.translate(te),
+            (
+                u"SELECT s.student_id, s.first_name, s.gpa, s.last_name FROM student s "
+                u"WHERE (s.gpa > ?) AND (s.first_name IS ? OR s.gpa < ?) "
+                u"ORDER BY s.last_name ASC, s.first_name DESC LIMIT ? OFFSET ?",
+                [3, u"Bruce", 2, 5, 2]
+            )
+        )
+
+        se = operators.SelectOperator(
+            operators.WhereOperator(expressions.TableExpression(Student), lambda s: s.gpa > 3),
+            lambda x: (x.first_name, x.gpa))
+        self.assertEqual(visitor.visit(se), u"SELECT x.first_name, x.gpa FROM student x WHERE x.gpa > ?")
+
+        # filters after a limit or on computed columns keep their subquery
+        we = operators.WhereOperator(
+            operators.TakeOperator(expressions.TableExpression(Student), 3), lambda s: s.gpa > 1)
+        self.assertEqual(
+            visitor.visit(we),
+            u"SELECT * FROM (SELECT student.student_id, student.first_name, student.gpa, student.last_name "
+            u"FROM student LIMIT ?) s WHERE s.gpa > ?")
+        we = operators.WhereOperator(
+            operators.SelectOperator(expressions.TableExpression(Student), lambda x: {'first': x.first_name}),
+            lambda s: s.first == u"Bruce")
+        self.assertEqual(
+            visitor.visit(we),
+            u"SELECT * FROM (SELECT x.first_name AS 'first' FROM student x) s WHERE s.first IS ?")
+        te = operators.TakeOperator(operators.TakeOperator(expressions.TableExpression(Student), 2), 3)
+        self.assertEqual(
+            visitor.visit(te),
+            u"SELECT student.student_id, student.first_name, student.gpa, student.last_name FROM "
+            u"(SELECT student.student_id, student.first_name, student.gpa, student.last_name FROM student LIMIT ?) "
+            u"student LIMIT ?")
+
+    def test_optimize_aggregates(self):
+        visitor = SqlVisitor(optimize=True)
+        where = operators.WhereOperator(expressions.TableExpression(Student), lambda s: s.gpa > 1)
+        ce = operators.CountOperator(operators.OrderByOperator(where, lambda s: s.last_name))
+        self.assertEqual(visitor.translate(ce), (u"SELECT COUNT(*) FROM student s WHERE s.gpa > ?", [1]))
+        self.assertEqual(
+            visitor.visit(operators.CountOperator(expressions.TableExpression(Student))),
+            u"SELECT COUNT(*) FROM student")
+        me = operators.MaxOperator(where, lambda x: x.gpa)
+        self.assertEqual(visitor.visit(me), u"SELECT MAX(x.gpa) FROM student x WHERE x.gpa > ?")
+        ae = operators.AveOperator(operators.SelectOperator(where, lambda x: x.gpa * 2))
+        self.assertEqual(visitor.translate(ae), (u"SELECT AVG(x.gpa * ?) FROM student x WHERE x.gpa > ?", [2, 1]))
+
+        # a limit applies before the aggregate so it keeps its subquery
+        ce = operators.CountOperator(operators.TakeOperator(where, 2))
+        self.assertEqual(
+            visitor.translate(ce),
+            (
+                u"SELECT COUNT(*) FROM (SELECT s.student_id, s.first_name, s.gpa, s.last_name "
+                u"FROM student s WHERE s.gpa > ? LIMIT ?)",
+                [1, 2]
+            )
+        )
+
+    def test_exists_expression(self):
+        where = operators.WhereOperator(expressions.TableExpression(Student), lambda s: s.gpa > 1)
+        ae = operators.AllOperator(where, lambda x: x.first_name == u"Bruce")
+        self.assertEqual(
+            self.visitor.visit(operators.AnyOperator(where)),
+            u"SELECT EXISTS(SELECT * FROM (SELECT student.student_id, student.first_name, student.gpa, "
+            u"student.last_name FROM student) s WHERE s.gpa > ?)")
+        self.assertEqual(
+            self.visitor.visit(ae),
+            u"SELECT NOT EXISTS(SELECT 1 FROM (SELECT * FROM (SELECT student.student_id, student.first_name, "
+            u"student.gpa, student.last_name FROM student) s WHERE s.gpa > ?) x "
+            u"WHERE NOT COALESCE(x.first_name IS ?, 0))")
+
+        visitor = SqlVisitor(optimize=True)
+        self.assertEqual(
+            visitor.translate(operators.AnyOperator(where)),
+            (u"SELECT EXISTS(SELECT 1 FROM student s WHERE s.gpa > ? LIMIT ?)", [1, 1]))
+        self.assertEqual(
+            visitor.translate(ae),
+            (
+                u"SELECT NOT EXISTS(SELECT 1 FROM student s WHERE (s.gpa > ?) AND "
+                u"(NOT COALESCE(s.first_name IS ?, 0)) LIMIT ?)",
+                [1, u"Bruce", 1]
+            )
+        )
+
+    def test_seek_expression(self):
+        ordered = operators.ThenByOperator(
+            operators.OrderByDescendingOperator(expressions.TableExpression(Student), lambda s: s.gpa),
+            lambda s: s.student_id)
+        se = operators.TakeOperator(operators.SeekOperator(ordered, (3.5, 4)), 10)
+        self.assertEqual(
+            self.visitor.translate(se),
+            (
+                u"SELECT * FROM (SELECT student.student_id, student.first_name, student.gpa, student.last_name "
+                u"FROM student) s WHERE (s.gpa < ?) OR (s.gpa = ? AND s.student_id > ?) "
+                u"ORDER BY s.gpa DESC, s.student_id ASC LIMIT ?",
+                [3.5, 3.5, 4, 10]
+            )
+        )
+
+        visitor = SqlVisitor(optimize=True)
+        self.assertEqual(
+            visitor.translate(se),
+            (
+                u"SELECT s.student_id, s.first_name, s.gpa, s.last_name FROM student s "
+                u"WHERE (s.gpa < ?) OR (s.gpa = ? AND s.student_id > ?) ORDER BY s.gpa DESC, s.student_id ASC LIMIT ?",
+                [3.5, 3.5, 4, 10]
+            )
+        )
+        # keys ordered in the same direction are compared as a row value
+        ordered = operators.ThenByOperator(
+            operators.OrderByOperator(
+                operators.WhereOperator(expressions.TableExpression(Student), lambda s: s.gpa > 3),
+                lambda s: s.last_name),
+            lambda s: s.student_id)
+        self.assertEqual(
+            visitor.translate(operators.TakeOperator(operators.SeekOperator(ordered, (u"Wayne", 4)), 10)),
+            (
+                u"SELECT s.student_id, s.first_name, s.gpa, s.last_name FROM student s "
+                u"WHERE (s.gpa > ?) AND ((s.last_name, s.student_id) > (?, ?)) "
+                u"ORDER BY s.last_name ASC, s.student_id ASC LIMIT ?",
+                [3, u"Wayne", 4, 10]
+            )
+        )
+        self.assertRaises(
+            AttributeError,
+            self.visitor.visit,
+            operators.SeekOperator(expressions.TableExpression(Student), (1,)))
+
+    def test_aggregate_expression(self):
+        where = operators.WhereOperator(expressions.TableExpression(Student), lambda s: s.gpa > 1)
+        ae = operators.AggregateOperator(
+            operators.OrderByOperator(where, lambda s: s.last_name),
+            [(u"count", u"COUNT", None), (u"max_gpa", u"MAX", lambda x: x.gpa), (u"sum_gpa", u"SUM", lambda y: y.gpa)])
+        self.assertEqual(
+            SqlVisitor(optimize=True).translate(ae),
+            (
+                u"SELECT COUNT(*) AS 'count', MAX(s.gpa) AS 'max_gpa', SUM(s.gpa) AS 'sum_gpa' "
+                u"FROM student s WHERE s.gpa > ?",
+                [1]
+            )
+        )
+        ae = operators.AggregateOperator(where, [(u"count", u"COUNT", None), (u"avg_gpa", u"AVG", lambda x: x.gpa * 2)])
+        self.assertEqual(
+            self.visitor.translate(ae),
+            (
+                u"SELECT COUNT(*) AS 'count', AVG(x.gpa * ?) AS 'avg_gpa' FROM (SELECT * FROM (SELECT "
+                u"student.student_id, student.first_name, student.gpa, student.last_name FROM student) s "
+                u"WHERE s.gpa > ?) x",
+                [2, 1]
+            )
+        )
+
+    def test_group_by_expression(self):
+        ge = operators.GroupByOperator(
+            operators.WhereOperator(expressions.TableExpression(Student), lambda s: s.gpa > 1), lambda s: s.last_name)
+        se = operators.SelectOperator(
+            operators.HavingOperator(ge, lambda x: x.count() > 1),
+            lambda g: (g.key, g.count(), g.max(lambda s: s.gpa), g.count(lambda s: s.gpa > 5)))
+        self.assertEqual(
+            self.visitor.translate(se),
+            (
+                u"SELECT g.last_name, COUNT(*), MAX(g.gpa), COUNT(CASE WHEN g.gpa > ? THEN 1 END) FROM (SELECT * FROM "
+                u"(SELECT student.student_id, student.first_name, student.gpa, student.last_name FROM student) s "
+                u"WHERE s.gpa > ?) g GROUP BY g.last_name HAVING COUNT(*) > ?",
+                [5, 1, 1]
+            )
+        )
+        self.assertEqual(
+            SqlVisitor(optimize=True).translate(se),
+            (
+                u"SELECT s.last_name, COUNT(*), MAX(s.gpa), COUNT(CASE WHEN s.gpa > ? THEN 1 END) FROM student s "
+                u"WHERE s.gpa > ? GROUP BY s.last_name HAVING COUNT(*) > ?",
+                [5, 1, 1]
+            )
+        )
+
+        ge = operators.GroupByOperator(expressions.TableExpression(Student), lambda s: s.gpa > 10)
+        se = operators.SelectOperator(
+            operators.HavingOperator(ge, lambda g: g.key == 1), lambda g: {u"passed": g.key, u"total": g.sum(lambda s: s.gpa)})
+        self.assertEqual(
+            SqlVisitor(optimize=True).translate(se),
+            (
+                u"SELECT (student.gpa > ?) AS 'passed', SUM(student.gpa) AS 'total' FROM student "
+                u"GROUP BY student.gpa > ? HAVING (student.gpa > ?) IS ?",
+                [10, 10, 10, 1]
+            )
+        )
+        self.assertRaises(
+            AttributeError,
+            self.visitor.visit,
+            operators.HavingOperator(expressions.TableExpression(Student), lambda g: g.count() > 1))
+
+    def test_join_expression(self):
+        je = JoinExpression(
+            operators.SelectOperator(expressions.TableExpression(Student)),
+            operators.WhereOperator(expressions.TableExpression(Enrollment), lambda x: x.grade > 50),
+            lambda s: (s.student_id, s.gpa),
+            lambda e: (e.student_id, e.grade),
+            lambda s, e: (s.first_name, e.grade))
+        self.assertEqual(
+            SqlVisitor(optimize=True).translate(je),
+            (
+                u"SELECT s.first_name, e.grade FROM student s INNER JOIN (SELECT x.enrollment_id, x.course_id, "
+                u"x.student_id, x.grade FROM enrollment x WHERE x.grade > ?) e "
+                u"ON s.student_id = e.student_id AND s.gpa = e.grade",
+                [50]
+            )
+        )
+        je = JoinExpression(
+            expressions.TableExpression(Student),
+            expressions.TableExpression(Enrollment),
+            lambda s: s.student_id,
+            lambda e: e.student_id,
+            lambda s, e: e,
+            u"LEFT")
+        self.assertEqual(
+            self.visitor.visit(je),
+            u"SELECT e.enrollment_id, e.course_id, e.student_id, e.grade FROM student s "
+            u"LEFT JOIN enrollment e ON s.student_id = e.student_id")
+
+    def test_set_expression(self):
+        visitor = SqlVisitor(optimize=True)
+        names = operators.SelectOperator(
+            operators.WhereOperator(expressions.TableExpression(Student), lambda s: s.gpa > 3), lambda s: s.last_name)
+        self.assertEqual(
+            visitor.translate(operators.DistinctOperator(names)),
+            (u"SELECT DISTINCT s.last_name FROM student s WHERE s.gpa > ?", [3]))
+        self.assertEqual(
+            visitor.visit(operators.CountOperator(operators.DistinctOperator(names))),
+            u"SELECT COUNT(*) FROM (SELECT DISTINCT s.last_name FROM student s WHERE s.gpa > ?)")
+        self.assertEqual(
+            visitor.visit(operators.SumOperator(operators.DistinctOperator(names))),
+            u"SELECT SUM(DISTINCT s.last_name) FROM student s WHERE s.gpa > ?")
+        self.assertEqual(
+            self.visitor.visit(operators.MaxOperator(operators.DistinctOperator(names))),
+            u"SELECT MAX(DISTINCT s.last_name) FROM (SELECT * FROM (SELECT student.student_id, student.first_name, "
+            u"student.gpa, student.last_name FROM student) s WHERE s.gpa > ?) s")
+        self.assertEqual(
+            self.visitor.visit(operators.DistinctOperator(expressions.TableExpression(Student))),
+            u"SELECT DISTINCT * FROM (SELECT student.student_id, student.first_name, student.gpa, "
+            u"student.last_name FROM student)")
+
+        first = operators.TakeOperator(
+            operators.OrderByOperator(
+                operators.SelectOperator(expressions.TableExpression(Student), lambda x: x.first_name),
+                lambda x: x.first_name),
+            2)
+        self.assertEqual(
+            visitor.translate(SetExpression(names, first, u"UNION")),
+            (
+                u"SELECT s.last_name FROM student s WHERE s.gpa > ? UNION SELECT * FROM "
+                u"(SELECT x.first_name FROM student x ORDER BY x.first_name ASC LIMIT ?)",
+                [3, 2]
+            )
+        )
+        # compound operands on the right are selected from as a subquery
+        self.assertEqual(
+            visitor.visit(SetExpression(names, SetExpression(names, names, u"EXCEPT"), u"INTERSECT")),
+            u"SELECT s.last_name FROM student s WHERE s.gpa > ? INTERSECT SELECT * FROM "
+            u"(SELECT s.last_name FROM student s WHERE s.gpa > ? EXCEPT SELECT s.last_name FROM student s WHERE s.gpa > ?)")
@@ -116,18 +116,16 @@ class SqlLambdaTranslatorTest(TestCase):
     def test_num_binop(self):
         t = SqlLambdaTranslatorTest.translate(self.simple_mult)
         self.assertIsInstance(t.body.right, ast.Num, u"Should be a Num instance")
-        self.assertEquals(
-            t.body.right.sql,
-            t.body.right.n,
-            u"Num() node should have sql property equal to {0}".format(t.body.right.n)
-        )
+        self.assertEquals(t.body.right.sql, u"?", u"Num() node should have sql property equal to ?")
+        self.assertEquals(t.body.right.params, [t.body.right.n])
 
     def test_return(self):
         t = SqlLambdaTranslatorTest.translate(lambda x: lambda x: (x.gpa > 10 and x.first_name == u'Bruce') or x.first_name == u'Dustin')
         self.assertEquals(
             t.body.sql,
-            u"(x.gpa > 10 AND x.first_name = 'Bruce') OR x.first_name = 'Dustin'"
+            u"(x.gpa > ? AND x.first_name IS ?) OR x.first_name IS ?"
         )
+        self.assertEquals(t.body.params, [10, u'Bruce', u'Dustin'])
 
     def test_num_compare(self):
         t = SqlLambdaTranslatorTest.translate(self.simple_gte)
@@ -135,10 +133,10 @@ class SqlLambdaTranslatorTest(TestCase):
             t.body.comparators[0], ast.Num, u"Should be a Num instance")
         self.assertEquals(
             t.body.comparators[0].sql,
-            t.body.comparators[0].n,
-            u"Num() node should have sql property equal to {0}".format(
-                t.body.comparators[0].n)
+            u"?",
+            u"Num() node should have sql property equal to ?"
         )
+        self.assertEquals(t.body.comparators[0].params, [t.body.comparators[0].n])
 
     def test_str(self):
         t = SqlLambdaTranslatorTest.translate(self.simple_eq_str)
@@ -146,10 +144,10 @@ class SqlLambdaTranslatorTest(TestCase):
             t.body.comparators[0], ast.Str, u"Should be a Str instance")
         self.assertEquals(
             t.body.comparators[0].sql,
-            unicode(t.body.comparators[0].s),
-            u"Str() node should have sql property equal to {0}".format(
-                t.body.comparators[0].sql)
+            u"?",
+            u"Str() node should have sql property equal to ?"
         )
+        self.assertEquals(t.body.comparators[0].params, [unicode(t.body.comparators[0].s)])
 
     def test_attribute(self):
         t = SqlLambdaTranslatorTest.translate(self.simple_eq_uni)
@@ -181,17 +179,18 @@ class SqlLambdaTranslatorTest(TestCase):
 
     def test_compare_simple(self):
         t = SqlLambdaTranslatorTest.translate(self.simple_lte)
-        correct = u"x.gpa <= 10"
+        correct = u"x.gpa <= ?"
         self.assertEquals(
             t.body.sql,
             correct,
             u"{0} should be same as {1}".format(t.body.sql, correct)
         )
+        self.assertEquals(t.body.params, [10])
 
     def test_compare_complex(self):
         t = SqlLambdaTranslatorTest.translate(self.simple_and)
         values = t.body.values
-        corrects = [u"x.gpa >= 10", u"x.gpa <= 50"]
+        corrects = [u"x.gpa >= ?", u"x.gpa <= ?"]
         for i in range(0, len(values) - 1, 1):
             correct = corrects[i]
             value = values[i].sql
@@ -200,16 +199,17 @@ class SqlLambdaTranslatorTest(TestCase):
 
     def test_boolop(self):
         t = SqlLambdaTranslatorTest.translate(self.simple_and)
-        correct = u"x.gpa >= 10 AND x.gpa <= 50"
+        correct = u"x.gpa >= ? AND x.gpa <= ?"
         self.assertEqual(
             t.body.sql,
             correct,
             u"{0} should equal {1}".format(t.body.sql, correct)
         )
+        self.assertEqual(t.body.params, [10, 50])
 
     def test_binop(self):
         t = SqlLambdaTranslatorTest.translate(self.simple_plus)
-        correct = u"x.gpa + 10"
+        correct = u"x.gpa + ?"
         self.assertEqual(
             t.body.sql,
             correct,
@@ -237,7 +237,7 @@ class SqlLambdaTranslatorTest(TestCase):
 
     def test_unary(self):
         t = SqlLambdaTranslatorTest.translate(self.simple_not)
-        correct = u"NOT x.gpa = 10"
+        correct = u"NOT x.gpa IS ?"
         self.assertEqual(
             t.body.sql,
             correct,
@@ -246,7 +246,7 @@ class SqlLambdaTranslatorTest(TestCase):
 
     def test_Lambda(self):
         t = SqlLambdaTranslatorTest.translate(self.simple_and)
-        correct = u"x.gpa >= 10 AND x.gpa <= 50"
+        correct = u"x.gpa >= ? AND x.gpa <= ?"
         self.assertEqual(t.body.sql, correct,
                          u"{0} should equal {1}".format(t.body.sql, correct))
 
@@ -284,3 +284,72 @@ class SqlLambdaTranslatorTest(TestCase):
             correct,
             u"{0} should equal {1}".format(t.body.sql, correct)
         )
+
+    def test_parse_cache(self):
+        LambdaExpression.clear_cache()
+        first = SqlLambdaTranslatorTest.translate(self.simple_and)
+        second = SqlLambdaTranslatorTest.translate(self.simple_and)
+        self.assertIs(first, second)
+        info = LambdaExpression.cache_info()
+        self.assertEqual(info[u"hits"], 1)
+        self.assertEqual(info[u"misses"], 1)
+        self.assertEqual(info[u"size"], 1)
+
+        LambdaExpression.clear_cache()
+        info = LambdaExpression.cache_info()
+        self.assertEqual(info[u"hits"], 0)
+        self.assertEqual(info[u"size"], 0)
+        self.assertIsNot(SqlLambdaTranslatorTest.translate(self.simple_and), first)
+
+    def test_parse_cache_closure(self):
+        LambdaExpression.clear_cache()
+
+        def make(value):
+            return lambda x: x.gpa > value
+
+        first = make(1)
+        second = make(2)
+        t = SqlLambdaTranslatorTest.translate(first)
+        self.assertIs(SqlLambdaTranslatorTest.translate(second), t)
+        info = LambdaExpression.cache_info()
+        self.assertEqual(info[u"hits"], 1)
+        self.assertEqual(info[u"misses"], 1)
+        self.assertEqual(LambdaExpression.bind(t.body, first), [1])
+        self.assertEqual(LambdaExpression.bind(t.body, second), [2])
+
+        SqlLambdaTranslatorTest.translate(make(u"1"))
+        info = LambdaExpression.cache_info()
+        self.assertEqual(info[u"misses"], 2)
+        self.assertEqual(info[u"size"], 2)
+
+    def test_captured(self):
+        minimum = 10
+
+        class Limits(object):
+            maximum = 50
+
+        t = SqlLambdaTranslatorTest.translate(lambda x: x.gpa >= minimum and x.gpa <= Limits.maximum)
+        self.assertEqual(t.body.sql, u"x.gpa >= ? AND x.gpa <= ?")
+        self.assertEqual(t.body.params[0].name, u"minimum")
+
+        funcs = {
+            u"default": lambda x, name=u"Bruce": x.first_name == name,
+            u"none": lambda x: x.last_name == None,  # noqa: E711
+            u"like": lambda x: minimum in x.last_name,
+            u"instr": lambda x: x.last_name not in u"Fenske"
+        }
+        t = SqlLambdaTranslatorTest.translate(funcs[u"default"])
+        self.assertEqual(t.body.sql, u"x.first_name IS ?")
+        self.assertEqual(LambdaExpression.bind(t.body, funcs[u"default"]), [u"Bruce"])
+
+        t = SqlLambdaTranslatorTest.translate(funcs[u"none"])
+        self.assertEqual(t.body.sql, u"x.last_name IS ?")
+        self.assertEqual(LambdaExpression.bind(t.body, funcs[u"none"]), [None])
+
+        t = SqlLambdaTranslatorTest.translate(funcs[u"like"])
+        self.assertEqual(t.body.sql, u"x.last_name LIKE ?")
+        self.assertEqual(LambdaExpression.bind(t.body, funcs[u"like"]), [u"%10%"])
+
+        t = SqlLambdaTranslatorTest.translate(funcs[u"instr"])
+        self.assertEqual(t.body.sql, u"instr(?, x.last_name) = 0")
+        self.assertEqual(LambdaExpression.bind(t.body, funcs[u"instr"]), [u"Fenske"])
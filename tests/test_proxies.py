@@ -2,6 +2,7 @@ __author__ = 'Bruce.Fenske'
 
 from unittest import TestCase
 from py_queryable.entity.proxy import DynamicModelProxy
+from py_queryable.entity import hydration
 from py_queryable.exceptions import InvalidArgumentError
 from .models import *
 
@@ -35,3 +36,54 @@ class TestProxy(TestCase):
         proxy1 = DynamicModelProxy.create_proxy_from_model_instance(test_model1)
         proxy2 = DynamicModelProxy.create_proxy_from_model_instance(test_model2)
         self.assertNotEqual(proxy1.test_int_column, proxy2.test_int_column)
+
+    def test_row_factory(self):
+        create = DynamicModelProxy.row_factory(StubPrimary)
+        proxy = create((5,))
+        self.assertIsInstance(proxy, DynamicModelProxy)
+        self.assertEqual(proxy.test_pk, 5)
+        self.assertEqual(proxy.columns[u"test_pk"].value, 5)
+        self.assertIsNone(create((None,)).test_pk)
+        self.assertEqual(DynamicModelProxy.create_proxy_from_row(StubPrimary, (7,)).test_pk, 7)
+        self.assertIn((StubPrimary.metadata(), DynamicModelProxy, True), hydration._row_factories)
+        self.assertRaises(InvalidArgumentError, create, (u"text",))
+
+    def test_metadata(self):
+        metadata = StubForeignKey.metadata()
+        self.assertIs(metadata, StubForeignKey.metadata())
+        self.assertEqual(metadata.attributes, [u"test_pk", u"test_fk"])
+        self.assertEqual([n for n, c in metadata.columns], [u"int_pk", u"test_fk"])
+        self.assertEqual(StubForeignKey.inspect_columns(), metadata.columns)
+        self.assertEqual(metadata.primary_key[0], u"test_pk")
+        self.assertEqual([n for n, c in metadata.foreign_keys], [u"test_fk"])
+        self.assertEqual(StubPrimary.metadata().column_names[StubForeignKey.test_fk.foreign_column], u"int_pk")
+        self.assertEqual(metadata.defaults, {u"test_pk": 0, u"test_fk": 0})
+
+        class StubAdded(Model):
+            __table_name__ = u"test_table"
+            test_pk = PrimaryKey(int)
+
+        StubAdded.test_added = Column(unicode)
+        self.assertEqual(StubAdded.metadata().attributes, [u"test_pk", u"test_added"])
+        StubAdded.other_pk = PrimaryKey(int)
+        self.assertRaises(AttributeError, StubAdded.inspect_columns)
+
+    def test_subclass_init(self):
+        class StubNamed(StubPrimaryString):
+            def __init__(self, name):
+                self.test_pk = name
+                super(StubNamed, self).__init__()
+
+        self.assertEqual(StubNamed(u"x").test_pk, u"x")
+        self.assertEqual(StubPrimaryString().test_pk, '')
+
+    def test_from_row(self):
+        # inspect_columns order: primary key, then the other columns by attribute name
+        student = Student.from_row((1, u"Bruce", 50, u"Fenske"))
+        self.assertIsInstance(student, Student)
+        self.assertEqual(
+            [student.student_id, student.first_name, student.last_name, student.gpa],
+            [1, u"Bruce", u"Fenske", 50])
+        proxy = DynamicModelProxy.create_proxy_from_model_instance(student)
+        self.assertEqual(proxy.last_name, u"Fenske")
+        self.assertEqual(Student().__dict__, {u"student_id": 0, u"first_name": None, u"last_name": None, u"gpa": None})
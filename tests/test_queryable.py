@@ -1,10 +1,14 @@
 import os
+import shutil
+import sqlite3
+import tempfile
 from unittest import TestCase
 from . import _sqlite_db_path
 from py_queryable import expressions
 from py_queryable.expressions import operators
-from .models import Student
+from .models import Student, Course, Enrollment
 from py_queryable.db_providers import SqliteDbConnection
+from py_queryable.exceptions import InvalidArgumentError
 from py_linq.exceptions import NoElementsError, MoreThanOneMatchingElement, NoMatchingElement
 
 
@@ -206,6 +210,26 @@ class QueryableTest(TestCase):
             result,
             u"First or Default query should be none. The Student table is empty")
 
+    def test_where_null(self):
+        student = Student()
+        student.student_id = 3
+        # empty strings are inserted as NULL
+        student.first_name = u""
+        student.last_name = u"Nobody"
+        student.gpa = 1
+        self.conn.add(student)
+        self.conn.save_changes()
+        students = self.conn.query(operators.SelectOperator(expressions.TableExpression(Student)))
+        # literal and captured values select the same rows, including the row with a NULL first name
+        name = u"Bruce"
+        self.assertEqual(students.where(lambda s: s.first_name != u"Bruce").count(), 2)
+        self.assertEqual(students.where(lambda s: s.first_name != name).count(), 2)
+        self.assertEqual(students.where(lambda s: u"Bruce" != s.first_name).count(), 2)
+        self.assertEqual(students.where(lambda s: s.first_name == u"Bruce").count(), 1)
+        self.assertEqual(students.where(lambda s: s.first_name == name).count(), 1)
+        name = None
+        self.assertEqual(students.where(lambda s: s.first_name == name).select(lambda s: s.student_id).to_list(), [3])
+
     def test_where(self):
         students = self.conn.query(operators.SelectOperator(
             expressions.TableExpression(Student))).where(lambda s: s.student_id == 1)
@@ -386,11 +410,92 @@ class QueryableTest(TestCase):
         self.assertEquals(ordered_students[2].gpa, 50)
         self.assertEquals(ordered_students[2].last_name, u"Fenske")
 
+    def test_page_after(self):
+        for i, gpa in ((3, 9), (4, 20), (5, 9)):
+            student = Student()
+            student.student_id = i
+            student.first_name = u"Student{0}".format(i)
+            student.last_name = u"Last{0}".format(i)
+            student.gpa = gpa
+            self.conn.add(student)
+        self.conn.save_changes()
+
+        students = self.conn.query(operators.SelectOperator(expressions.TableExpression(Student)))
+        ordered = students.order_by_descending(lambda s: s.gpa).then_by(lambda s: s.student_id)
+        expected = [s.student_id for s in ordered.to_list()]
+        self.assertEqual(expected, [1, 4, 2, 3, 5])
+        page = ordered.take(2).to_list()
+        self.assertEqual([s.student_id for s in ordered.page_after(page[-1]).take(2)], [2, 3])
+
+        pages = [[s.student_id for s in p] for p in ordered.iter_pages(2)]
+        self.assertEqual(pages, [[1, 4], [2, 3], [5]])
+        pages = [[s.student_id for s in p] for p in students.order_by(lambda s: s.student_id).iter_pages(5)]
+        self.assertEqual(pages, [[1, 2, 3, 4, 5]])
+        self.assertRaises(InvalidArgumentError, lambda: list(ordered.iter_pages(0)))
+
     def test_max(self):
         max_gpa = self.conn.query(operators.SelectOperator(
             expressions.TableExpression(Student))).max(lambda s: s.gpa)
         self.assertEquals(max_gpa, 50)
 
+    def test_aggregate(self):
+        students = self.conn.query(operators.SelectOperator(expressions.TableExpression(Student)))
+        self.assertEqual(
+            students.aggregate(count=None, max_gpa=lambda s: s.gpa, min_gpa=lambda x: x.gpa, sum_gpa=lambda s: s.gpa),
+            {u"count": 2, u"max_gpa": 50, u"min_gpa": 9, u"sum_gpa": 59})
+        self.assertEqual(
+            students.where(lambda s: s.gpa > 10).aggregate(count=None, avg_gpa=lambda s: s.gpa),
+            {u"count": 1, u"avg_gpa": 50})
+        self.assertEqual(
+            students.aggregate(count=None, count_high=lambda s: s.gpa > 10, count_gpa=lambda s: s.gpa),
+            {u"count": 2, u"count_high": 1, u"count_gpa": 2})
+        self.assertRaises(InvalidArgumentError, students.aggregate)
+        self.assertRaises(InvalidArgumentError, students.aggregate, median_gpa=lambda s: s.gpa)
+        self.assertRaises(InvalidArgumentError, students.aggregate, max_gpa=None)
+
+    def test_group_by(self):
+        student3 = Student()
+        student3.student_id = 3
+        student3.first_name = u"Jim"
+        student3.last_name = u"Fenske"
+        student3.gpa = 20
+        self.conn.add(student3)
+        self.conn.save_changes()
+        students = self.conn.query(operators.SelectOperator(expressions.TableExpression(Student)))
+        groups = students.group_by(lambda s: s.last_name)
+        self.assertEqual(groups.to_list(), [u"Fenske", u"Mudryk"])
+        self.assertEqual(groups.count(), 2)
+        self.assertEqual(
+            groups.select(lambda g: (g.key, g.count(), g.max(lambda s: s.gpa))).to_list(),
+            [(u"Fenske", 2, 50), (u"Mudryk", 1, 9)])
+        self.assertEqual(
+            groups.where(lambda g: g.count() > 1).select(lambda g: {u"name": g.key, u"total": g.sum(lambda s: s.gpa)})
+            .to_list(),
+            [{u"name": u"Fenske", u"total": 70}])
+        self.assertEqual(
+            students.where(lambda s: s.gpa > 10).group_by(lambda s: s.last_name)
+            .select(lambda g: [g.key, g.average(lambda s: s.gpa)]).to_list(),
+            [[u"Fenske", 35]])
+
+        # operators with lambdas of groups other than select and where raise instead of producing invalid SQL
+        self.assertTrue(groups.any(lambda g: g.count() > 1))
+        self.assertFalse(groups.any(lambda g: g.key == u"Nobody"))
+        self.assertEqual(groups.take(1).to_list(), [u"Fenske"])
+        self.assertEqual(
+            groups.select(lambda g: {u"name": g.key, u"count": g.count()}).order_by(lambda r: r.count)
+            .select(lambda r: r.name).to_list(),
+            [u"Mudryk", u"Fenske"])
+        for call in (
+                lambda: groups.order_by(lambda g: g.key),
+                lambda: groups.order_by_descending(lambda g: g.key),
+                lambda: groups.all(lambda g: g.count() > 1),
+                lambda: groups.max(lambda g: g.key),
+                lambda: groups.sum(lambda g: g.count()),
+                lambda: groups.group_by(lambda g: g.key),
+                lambda: groups.join(students, lambda g: g.key, lambda s: s.last_name, lambda g, s: s),
+                lambda: students.join(groups, lambda s: s.last_name, lambda g: g.key, lambda s, g: s)):
+            self.assertRaises(InvalidArgumentError, call)
+
     def test_min(self):
         min_gpa = self.conn.query(operators.SelectOperator(
             expressions.TableExpression(Student))).min(lambda s: s.gpa)
@@ -428,6 +533,399 @@ class QueryableTest(TestCase):
         self.assertTrue(students.all(lambda s: u"k" in s.last_name))
         self.assertTrue(students.all())
 
+    def test_parameters(self):
+        students = self.conn.query(operators.SelectOperator(
+            expressions.TableExpression(Student)))
+        minimum = 10
+        query = students.where(lambda s: s.gpa > minimum)
+        sql = query.sql
+        self.assertEquals(query.parameters, [10])
+        self.assertEquals(query.count(), 1)
+
+        minimum = 5
+        self.assertEquals(query.sql, sql)
+        self.assertEquals(query.parameters, [5])
+        self.assertEquals(query.count(), 2)
+
+        name = u"O'Brien"
+        self.assertFalse(students.any(lambda s: s.last_name == name))
+
+    def test_compile_stats(self):
+        students = self.conn.query(operators.SelectOperator(
+            expressions.TableExpression(Student))).where(lambda s: s.gpa > 0)
+        stats = students.compile_stats
+        self.assertEquals(stats[u"translations"], 0)
+        self.assertEquals(stats[u"hits"], 0)
+
+        sql = students.sql
+        self.assertEquals(len(students.to_list()), 2)
+        self.assertEquals(students.sql, sql)
+        stats = students.compile_stats
+        self.assertEquals(stats[u"translations"], 1)
+        self.assertEquals(stats[u"hits"], 2)
+        self.assertTrue(stats[u"translation_time"] > 0)
+
+        self.assertEquals(students.count(), 2)
+        self.assertEquals(students.count(), 2)
+        self.assertEquals(students.max(lambda s: s.gpa), 50)
+        self.assertEquals(students.max(lambda s: s.gpa), 50)
+        self.assertEquals(students.compile_stats[u"hits"], 2)
+
+    def test_derived_captured_values(self):
+        students = self.conn.query(operators.SelectOperator(expressions.TableExpression(Student)))
+
+        def make(x):
+            result = students.any(lambda s: s.gpa > x)
+            # changes the value captured by the lambda of the cached query
+            x = 100
+            return result
+
+        self.assertEqual([make(5), make(5), make(60)], [True, True, False])
+        where = students.where(lambda s: s.gpa > 5)
+        self.assertEqual([where.count(), where.count()], [2, 2])
+
+    def test_compile(self):
+        self.student3 = Student()
+        self.student3.student_id = 3
+        self.student3.first_name = u"Miguel"
+        self.student3.last_name = u"McDavid"
+        self.student3.gpa = 90
+        self.conn.add(self.student3)
+        self.conn.save_changes()
+
+        compiled = self.conn.compile(
+            operators.SelectOperator(expressions.TableExpression(Student)),
+            lambda q, min_gpa, letter: q
+            .where(lambda s: s.gpa > min_gpa and letter in s.last_name)
+            .order_by_descending(lambda s: s.gpa)
+        )
+        self.assertEquals(compiled.parameter_names, [u"min_gpa", u"letter"])
+        sql = compiled.sql
+        self.assertTrue(u"?" in sql)
+
+        result = compiled(min_gpa=5, letter=u"k").to_list()
+        self.assertEquals([s.student_id for s in result], [1, 2])
+        result = compiled(10, u"D").to_list()
+        self.assertEquals([s.student_id for s in result], [3])
+        self.assertEquals(compiled.bind(10, letter=u"e"), [10, u"%e%"])
+        self.assertEquals(compiled.sql, sql)
+
+        self.assertRaises(InvalidArgumentError, compiled, 10)
+        self.assertRaises(InvalidArgumentError, compiled, 10, u"e", unknown=1)
+
+        students = operators.SelectOperator(expressions.TableExpression(Student))
+        self.assertRaises(InvalidArgumentError, self.conn.compile, students, lambda q, x: 1)
+        self.assertRaises(InvalidArgumentError, self.conn.compile, students, lambda q, x: None)
+        self.assertRaises(
+            InvalidArgumentError, self.conn.compile, students, lambda q, x: q.where(lambda s: s.gpa > x).count())
+        self.assertRaises(
+            InvalidArgumentError, self.conn.compile, students, lambda q, x: q.where(lambda s: s.gpa > x).to_list())
+
+        compiled = self.conn.compile(
+            operators.SelectOperator(expressions.TableExpression(Student)),
+            lambda q, page_size, offset: q.skip(offset).take(page_size)
+        )
+        self.assertEquals(compiled(1, 1).first().student_id, 2)
+
+        compiled = self.conn.compile(
+            operators.SelectOperator(expressions.TableExpression(Student)),
+            lambda q, ids: q.where(lambda s: s.student_id in ids)
+        )
+        self.assertTrue(compiled.sql.endswith(u"IN ?"))
+        self.assertEquals([s.student_id for s in compiled([1, 3])], [1, 3])
+        self.assertEquals([s.student_id for s in compiled(ids=(2,))], [2])
+        self.assertEquals(compiled.statement([1, 2])[1], [1, 2])
+        self.assertEquals(compiled([]).to_list(), [])
+        # the statement is translated before the argument is known, so it can't be a substring test
+        compiled = self.conn.compile(
+            operators.SelectOperator(expressions.TableExpression(Student)),
+            lambda q, name: q.where(lambda s: s.last_name in name)
+        )
+        self.assertEquals(compiled([u"Mudryk"]).first().student_id, 2)
+        self.assertRaises(InvalidArgumentError, compiled, u"Mudryk")
+        self.assertRaises(InvalidArgumentError, compiled, 2)
+
+    def _enroll(self):
+        self.conn.create_table(Course)
+        self.conn.create_table(Enrollment)
+        course = Course()
+        course.title = u"Physics"
+        self.conn.add(course)
+        for student_id, grade in ((1, 80), (1, 60)):
+            enrollment = Enrollment()
+            enrollment.student = student_id
+            enrollment.course = 1
+            enrollment.grade = grade
+            self.conn.add(enrollment)
+        self.conn.save_changes()
+        return self.conn.query(operators.SelectOperator(expressions.TableExpression(Enrollment)))
+
+    def test_join(self):
+        enrollments = self._enroll()
+        students = self.conn.query(operators.SelectOperator(expressions.TableExpression(Student)))
+        result = students.join(
+            enrollments,
+            lambda s: s.student_id,
+            lambda e: e.student_id,
+            lambda s, e: (s.first_name, e.grade))
+        self.assertEqual(sorted(result.to_list()), [(u"Bruce", 60), (u"Bruce", 80)])
+        self.assertEqual(result.count(), 2)
+
+        result = students.join(
+            enrollments.where(lambda e: e.grade > 70),
+            lambda s: s.student_id,
+            lambda e: e.student_id,
+            lambda s, e: s).to_list()
+        self.assertEqual(len(result), 1)
+        self.assertEqual(result[0].first_name, u"Bruce")
+
+        result = students.group_join(
+            enrollments,
+            lambda s: s.student_id,
+            lambda e: e.student_id,
+            lambda s, e: {u"name": s.first_name, u"grade": e.grade})
+        self.assertEqual(
+            sorted(result.to_list(), key=lambda r: r[u"grade"]),
+            [{u"name": u"Abraham", u"grade": None}, {u"name": u"Bruce", u"grade": 60}, {u"name": u"Bruce", u"grade": 80}])
+        self.assertRaises(
+            InvalidArgumentError,
+            students.join, enrollments, lambda s: s.student_id, lambda e: e.student_id, lambda s: s)
+
+    def test_set_operations(self):
+        student = Student()
+        student.student_id = 3
+        student.first_name = u"Miguel"
+        student.last_name = u"McDavid"
+        student.gpa = 9
+        self.conn.add(student)
+        self.conn.save_changes()
+
+        students = self.conn.query(operators.SelectOperator(expressions.TableExpression(Student)))
+        gpas = students.select(lambda s: s.gpa)
+        self.assertEqual(sorted(gpas.distinct().to_list()), [9, 50])
+        self.assertEqual(gpas.distinct().count(), 2)
+        self.assertEqual(gpas.sum(), 68)
+        self.assertEqual(gpas.distinct().sum(), 59)
+        self.assertEqual(gpas.distinct().average(), 29.5)
+        self.assertEqual(gpas.distinct().max(), 50)
+        self.assertEqual(gpas.distinct().min(), 9)
+
+        low = students.where(lambda s: s.gpa < 10)
+        high = students.where(lambda s: s.gpa > 10)
+        self.assertEqual(sorted(s.student_id for s in low.union(high)), [1, 2, 3])
+        self.assertEqual(sorted(gpas.union_all(gpas).to_list()), [9, 9, 9, 9, 50, 50])
+        self.assertEqual(gpas.union(gpas).count(), 2)
+        self.assertEqual(
+            students.intersect(low).order_by(lambda s: s.student_id).select(lambda s: s.student_id).to_list(), [2, 3])
+        self.assertEqual([s.student_id for s in students.except_(low)], [1])
+        self.assertRaises(InvalidArgumentError, students.union, gpas)
+        self.assertRaises(InvalidArgumentError, students.union, [])
+
+    def test_membership(self):
+        students = self.conn.query(operators.SelectOperator(expressions.TableExpression(Student)))
+        ids = [2, 3]
+        query = students.where(lambda s: s.student_id in ids)
+        self.assertEqual([s.student_id for s in query], [2])
+        ids.append(1)
+        self.assertEqual(sorted(s.student_id for s in query), [1, 2])
+        excluded = set([1])
+        self.assertEqual(students.where(lambda s: s.student_id not in excluded).count(), 1)
+
+        # large collections are bound as a JSON array
+        visitor = self.conn.query(expressions.TableExpression(Student)).provider.provider_visitor
+        visitor.max_in_parameters = 2
+        try:
+            self.assertEqual(sorted(s.student_id for s in query), [1, 2])
+            self.assertEqual(query.count(), 2)
+        finally:
+            del visitor.max_in_parameters
+
+        # executed by the query provider
+        ids = range(1, 1001)
+        rows = self.conn.query_provider.execute(students.where(lambda s: s.student_id in ids).expression)
+        self.assertEqual(sorted(r[0] for r in rows), [1, 2])
+        self.assertEqual(
+            [r[0] for r in self.conn.query_provider.execute(students.where(lambda s: s.student_id == 2).expression)],
+            [2])
+
+        high = students.where(lambda s: s.gpa > 10).select(lambda s: s.student_id)
+        self.assertEqual([s.first_name for s in students.where(lambda s: s.student_id in high)], [u"Bruce"])
+
+    def test_membership_without_transaction(self):
+        # binding a large collection must not leave a transaction holding a lock on the database
+        path = os.path.join(tempfile.mkdtemp(), u"membership.db")
+        try:
+            conn = SqliteDbConnection(u"sqlite:{0}".format(path))
+            conn.create_table(Student)
+            conn.add(self.student1)
+            conn.save_changes()
+            students = conn.query(operators.SelectOperator(expressions.TableExpression(Student)))
+            ids = range(1000)
+            other = sqlite3.connect(path, timeout=0)
+            self.assertEqual(len(students.where(lambda s: s.student_id in ids).to_list()), 1)
+            other.execute(u"INSERT INTO student (student_id, first_name, last_name, gpa) VALUES (2, 'a', 'b', 1)")
+            other.commit()
+            students.where(lambda s: s.student_id in ids).explain()
+            other.execute(u"INSERT INTO student (student_id, first_name, last_name, gpa) VALUES (3, 'a', 'b', 1)")
+            other.commit()
+            other.close()
+            self.assertEqual(students.count(), 3)
+            conn.connection.close()
+        finally:
+            shutil.rmtree(os.path.dirname(path))
+
+    def test_explain(self):
+        students = self.conn.query(operators.SelectOperator(expressions.TableExpression(Student)))
+        plan = students.where(lambda s: s.gpa > 3).order_by(lambda s: s.last_name).explain()
+        self.assertEqual([n.table for n in plan.full_scans], [u"student"])
+        # the scan of the subquery is not a table scan although the subquery has the alias of the table
+        plan = students.order_by(lambda s: s.gpa).take(5).where(lambda s: s.gpa > 1).explain()
+        self.assertEqual([n.scanned for n in plan.nodes if n.scanned is not None], [u"s", u"s"])
+        self.assertEqual([n.table for n in plan.full_scans], [u"student"])
+        self.assertEqual(len(plan.temp_btrees), 1)
+        self.assertEqual(len(plan.warnings), 2)
+        self.assertTrue(plan.sql.startswith(u"SELECT"))
+
+        plan = students.where(lambda s: s.student_id == 3).explain()
+        self.assertEqual(plan.warnings, [])
+        self.assertTrue(str(plan).startswith(u"SEARCH s"))
+
+        self.conn.create_table(Enrollment)
+        enrollments = self.conn.query(operators.SelectOperator(expressions.TableExpression(Enrollment)))
+        plan = students.join(enrollments, lambda s: s.gpa, lambda e: e.grade, lambda s, e: e.grade).explain()
+        self.assertEqual(len(plan.automatic_indexes), 1)
+
+    def test_index_advisor(self):
+        provider = self.conn.query_provider
+        self.assertRaises(AttributeError, provider.advise_indexes)
+        advisor = provider.enable_index_advisor()
+        students = self.conn.query(operators.SelectOperator(expressions.TableExpression(Student)))
+        for i in range(3):
+            students.where(lambda s: s.last_name == u"Fenske" and s.gpa > 2).to_list()
+        students.where(lambda s: s.last_name == u"Fenske").order_by(lambda s: s.first_name).count()
+        students.where(lambda s: s.student_id == 2).first()
+
+        advice = provider.advise_indexes()
+        self.assertEqual(
+            sorted((a[u"columns"], a[u"executions"]) for a in advice),
+            [([u"last_name", u"first_name"], 1), ([u"last_name", u"gpa"], 3)])
+        self.assertTrue(all(not a[u"created"] for a in advice))
+
+        advice = provider.advise_indexes(create=True)
+        self.assertTrue(all(a[u"created"] for a in advice))
+        self.assertEqual(provider.advise_indexes(), [])
+        advisor.clear()
+        provider.disable_index_advisor()
+        self.assertIsNone(provider.index_advisor)
+
+    def test_include(self):
+        enrollments = self._enroll()
+        self.conn.connection.execute(u"INSERT INTO enrollment (grade) VALUES (70)")
+
+        query = enrollments.include(lambda e: e.student).include(lambda e: e.course)
+        self.assertEqual(
+            query.sql,
+            u"SELECT e.enrollment_id, e.course_id, e.student_id, e.grade, e_student.student_id, "
+            u"e_student.first_name, e_student.gpa, e_student.last_name, e_course.course_id, e_course.title "
+            u"FROM enrollment e LEFT JOIN student e_student ON e.student_id = e_student.student_id "
+            u"LEFT JOIN course e_course ON e.course_id = e_course.course_id")
+        result = query.to_list()
+        self.assertEqual([e.grade for e in result], [80, 60, 70])
+        self.assertEqual(result[0].student.first_name, u"Bruce")
+        self.assertEqual(result[0].course.title, u"Physics")
+        self.assertEqual(result[1].student.student_id, 1)
+        self.assertIsNone(result[2].student)
+        self.assertIsNone(result[2].course)
+
+        result = query.where(lambda e: e.grade < 75).to_list()
+        self.assertEqual([e.student.first_name if e.student else None for e in result], [u"Bruce", None])
+        self.assertRaises(InvalidArgumentError, enrollments.include, lambda e: e.grade)
+
+    def test_lazy_foreign_key(self):
+        enrollments = self._enroll()
+        enrollment = Enrollment()
+        enrollment.student = 2
+        enrollment.course = 1
+        enrollment.grade = 40
+        self.conn.add(enrollment)
+        self.conn.save_changes()
+
+        result = enrollments.to_list()
+        loader = result[0].__dict__[u"_loaders"][u"student"]
+        self.assertTrue(all(e.__dict__[u"_loaders"][u"student"] is loader for e in result))
+        self.assertEqual(loader.queries, 0)
+        self.conn.record_plans = True
+        self.conn.query_provider.enable_index_advisor()
+        self.assertEqual([e.student.first_name for e in result], [u"Bruce", u"Bruce", u"Abraham"])
+        self.assertEqual(loader.queries, 1)
+        self.assertEqual(
+            [p.sql for p in self.conn.plans],
+            [u"SELECT student_id, first_name, gpa, last_name FROM student WHERE student_id IN (?, ?)"])
+        # the lookup is recorded, and the primary key already supports it
+        self.assertEqual(self.conn.query_provider.advise_indexes(), [])
+        self.conn.record_plans = False
+        self.assertIs(result[0].student, result[1].student)
+        self.assertEqual(result[2].course.title, u"Physics")
+
+        enrollment = enrollments.first()
+        enrollment.student = 2
+        self.assertEqual(enrollment.student, 2)
+
+    def test_lazy_foreign_key_streaming(self):
+        enrollments = self._enroll()
+        for student_id in (2, 1, 2):
+            enrollment = Enrollment()
+            enrollment.student = student_id
+            enrollment.course = 1
+            enrollment.grade = 40
+            self.conn.add(enrollment)
+        self.conn.save_changes()
+
+        self.conn.record_plans = True
+        names = []
+        for e in enrollments:
+            names.append(e.student.first_name)
+        self.assertEqual(names, [u"Bruce", u"Bruce", u"Abraham", u"Bruce", u"Abraham"])
+        # the enrollments and one lookup of the students of every row instead of one lookup per row
+        self.assertEqual(len(self.conn.plans), 2)
+        self.assertTrue(self.conn.plans[1].sql.endswith(u"WHERE student_id IN (?, ?)"))
+
+    def test_trusted_hydration(self):
+        self.conn.connection.execute(u"INSERT INTO student (student_id, first_name, gpa) VALUES (3, NULL, 'A')")
+        students = self.conn.query(operators.SelectOperator(expressions.TableExpression(Student)))
+
+        student = students.where(lambda s: s.student_id == 3).single()
+        self.assertEqual(student.gpa, u"A")
+        self.assertIsNone(student.first_name)
+        self.assertIsNone(student.columns[u"first_name"].value)
+        self.assertRaises(InvalidArgumentError, setattr, student, u"gpa", u"B")
+        student.gpa = 4
+        self.assertEqual(student.columns[u"gpa"].value, 4)
+
+        self.conn.trusted_hydration = False
+        self.assertEqual(students.where(lambda s: s.student_id == 1).single().gpa, 50)
+        self.assertRaises(InvalidArgumentError, students.where(lambda s: s.student_id == 3).single)
+
+    def test_records(self):
+        enrollments = self._enroll()
+        self.conn.use_records = True
+
+        result = enrollments.to_list()
+        self.assertEqual(type(result[0]).__name__, u"EnrollmentRecord")
+        self.assertFalse(hasattr(result[0], u"__dict__"))
+        self.assertIs(result[0].model, Enrollment)
+        self.assertEqual([e.grade for e in result], [80, 60])
+        self.assertEqual(repr(result[0]), u"EnrollmentRecord(enrollment_id=1, course=1, student=1, grade=80)")
+        self.assertEqual(result[0].student.first_name, u"Bruce")
+        self.assertIs(type(result[0].student), type(self.conn.query(operators.SelectOperator(
+            expressions.TableExpression(Student))).first()))
+        self.assertIs(result[0].student, result[1].student)
+
+        result = enrollments.include(lambda e: e.course).first()
+        self.assertEqual(result.course.title, u"Physics")
+        self.assertEqual(type(result.course).__name__, u"CourseRecord")
+        self.assertEqual(result.student.last_name, u"Fenske")
+
     def tearDown(self):
         if self.conn is not None:
             self.conn.connection.close()
@@ -6,6 +6,8 @@ from tests import _sqlite_db_path
 from py_queryable.db_providers import SqliteDbConnection
 from py_queryable.parsers import ProviderConfig
 from py_queryable.managers import ConnectionManager
+from py_queryable.expressions import TableExpression
+from py_queryable.exceptions import InvalidArgumentError
 from .models import *
 
 
@@ -72,6 +74,75 @@ class TestSqlite(TestCase):
         self.assertIsNotNone(result)
         self.assertEqual(result[0].lower(), index_name.lower())
 
+    def test_declared_index_creation(self):
+        self.assertEqual(
+            StubIndexed.__indexes__[0].sql(StubIndexed),
+            u"CREATE INDEX IF NOT EXISTS indexed_table_last_name_first_name_where_gpa_0_index ON indexed_table "
+            u"(last_name, first_name) WHERE gpa > 0")
+        self.conn.create_table(StubIndexed)
+        self.conn.create_indexes(StubIndexed)
+        self.conn.save_changes()
+
+        cursor = self.conn.connection.cursor()
+        cursor.execute(u"SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = 'indexed_table'")
+        indexes = dict(cursor.fetchall())
+        self.assertIn(u"indexed_table_last_name_first_name_where_gpa_0_index", indexes)
+        self.assertEqual(
+            indexes[u"gpa_covering_index"],
+            u"CREATE INDEX gpa_covering_index ON indexed_table (gpa, last_name)")
+        self.assertEqual(
+            indexes[u"indexed_table_first_name_unique_index"],
+            u"CREATE UNIQUE INDEX indexed_table_first_name_unique_index ON indexed_table (first_name)")
+        self.assertEqual(
+            indexes[u"indexed_table_last_name_where_gpa_is_not_null_index"],
+            u"CREATE INDEX indexed_table_last_name_where_gpa_is_not_null_index ON indexed_table (last_name) "
+            u"WHERE gpa IS NOT NULL")
+        self.assertRaises(
+            InvalidArgumentError, Index, lambda s: s.gpa, include=lambda s: s.last_name, unique=True)
+
+        plan = self.conn.query(TableExpression(StubIndexed))\
+            .where(lambda s: s.last_name == u"Fenske" and s.gpa > 0)\
+            .explain()
+        self.assertEqual(plan.full_scans, [])
+        # the bound value of s.gpa > 0 doesn't prove the condition of the partial index on gpa > 0, but the
+        # comparison proves gpa IS NOT NULL
+        self.assertIn(u"indexed_table_last_name_where_gpa_is_not_null_index", unicode(plan))
+        self.assertNotIn(u"indexed_table_last_name_first_name_where_gpa_0_index", unicode(plan))
+
+    def test_declared_index_names(self):
+        # indexes of the same columns differing in their condition or uniqueness get different names
+        indexes = [
+            Index(lambda s: s.gpa),
+            Index(lambda s: s.gpa, where=lambda s: s.gpa > 0),
+            Index(lambda s: s.gpa, where=lambda s: s.gpa > 1),
+            Index(lambda s: s.gpa, unique=True)
+        ]
+        self.assertEqual(len(set(i.index_name(StubIndexed) for i in indexes)), 4)
+
+        class StubDuplicateIndex(Model):
+            __table_name__ = u"duplicate_index_table"
+            __indexes__ = [
+                Index(lambda s: s.gpa, name=u"gpa_index"),
+                Index(lambda s: s.gpa, where=lambda s: s.gpa > 0, name=u"gpa_index")
+            ]
+            key = PrimaryKey(int, "key")
+            gpa = Column(int, "gpa")
+
+        self.conn.create_table(StubDuplicateIndex)
+        self.assertRaises(InvalidArgumentError, self.conn.create_indexes, StubDuplicateIndex)
+
+    def test_record_plans(self):
+        self.conn.create_table(Student)
+        self.conn.record_plans = True
+        self.conn.query(TableExpression(Student)).where(lambda s: s.gpa > 1).count()
+        self.assertEqual(len(self.conn.plans), 1)
+        self.assertEqual(self.conn.plans[0].parameters, [1])
+        self.assertEqual(len(self.conn.plans[0].full_scans), 1)
+
+        self.conn.record_plans = False
+        self.conn.query(TableExpression(Student)).count()
+        self.assertEqual(len(self.conn.plans), 1)
+
     def test_insert_primary(self):
         self._insert_test_primary()
 